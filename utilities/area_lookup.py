@@ -0,0 +1,291 @@
+"""
+Point-in-polygon lookup over the merged areas written by create_shapefiles.py
+(HUCs, boroughs, GMUs, fire zones, protected areas, etc.). The areas are loaded
+once and indexed with one STRtree per area `type`, and batches of points are
+answered with a single vectorized tree query per type.
+
+Run this script to serve lookups over HTTP on localhost:
+    GET  /lookup?lat=64.84&lon=-147.72[&type=huc&type=borough]
+    POST /lookup with a JSON body {"points": [[lat, lon], ...], "types": [...]}
+    GET  /stats for the request count and p50/p99 server-side latency
+
+Example usage:
+    python area_lookup.py
+    python area_lookup.py --areas all_places/all_areas.parquet --port 8080
+"""
+
+import argparse
+import collections
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# attributes returned for every matched area
+area_columns = ["id", "name", "area_type"]
+
+
+def load_areas(areas_path):
+    """Load the merged areas from a shapefile, GeoParquet, or FlatGeobuf file in EPSG:4326.
+
+    Args:
+        areas_path (str): Path to the all_areas output of create_shapefiles.py
+    Returns:
+        gpd.GeoDataFrame: The merged areas
+    """
+    if str(areas_path).endswith(".parquet"):
+        areas = gpd.read_parquet(areas_path)
+    else:
+        areas = gpd.read_file(areas_path)
+    if areas.crs != "EPSG:4326":
+        areas = areas.to_crs(4326)
+    return areas
+
+
+class AreaLookup:
+    """Spatial index over the merged areas, with one STRtree per area type."""
+
+    def __init__(self, areas):
+        """
+        Args:
+            areas (gpd.GeoDataFrame): Merged areas in EPSG:4326 from `load_areas`
+        """
+        self.trees = {}
+        self.geometries = {}
+        self.attributes = {}
+        for area_type, group in areas.groupby("type", sort=True):
+            geometries = group.geometry.values.to_numpy()
+            # STRtree predicates only prepare the query points, so the polygons are prepared here once instead
+            shapely.prepare(geometries)
+            self.geometries[area_type] = geometries
+            self.trees[area_type] = shapely.STRtree(geometries)
+            # attributes are kept as plain object arrays, indexing pandas columns would dominate the cost of small lookups
+            records = group.reindex(columns=area_columns).astype(object)
+            records = records.where(records.notna(), None)
+            self.attributes[area_type] = {
+                column: records[column].to_numpy() for column in area_columns
+            }
+
+    @property
+    def types(self):
+        return list(self.trees)
+
+    def query(self, lats, lons, types=None):
+        """Query the tree of each area type for the areas that contain each point.
+
+        Args:
+            lats (array-like): Latitudes in degrees
+            lons (array-like): Longitudes in degrees
+            types (list): Area types to search, defaults to all of them
+        Returns:
+            list: (area type, point indices, area indices) tuple for each searched type
+        """
+        x = np.asarray(lons, dtype="float64")
+        y = np.asarray(lats, dtype="float64")
+        points = shapely.points(x, y)
+        matches = []
+        for area_type in types or self.types:
+            if area_type not in self.trees:
+                raise ValueError(f"Unknown area type: {area_type}")
+            # bounding box candidates from the tree, refined against the prepared polygons
+            point_index, area_index = self.trees[area_type].query(points)
+            # points on a shared boundary are reported in both areas
+            hit = shapely.intersects_xy(
+                self.geometries[area_type][area_index], x[point_index], y[point_index]
+            )
+            matches.append((area_type, point_index[hit], area_index[hit]))
+        return matches
+
+    def lookup(self, lats, lons, types=None):
+        """Find the areas that contain each point.
+
+        Args:
+            lats (array-like): Latitudes in degrees
+            lons (array-like): Longitudes in degrees
+            types (list): Area types to search, defaults to all of them
+        Returns:
+            pd.DataFrame: One row per (point, area) match with a point_index column, the area type, and `area_columns`, sorted by point_index
+        """
+        matches = self.query(lats, lons, types)
+        columns = {
+            "point_index": np.concatenate(
+                [point_index for _, point_index, _ in matches] + [[]]
+            ).astype("int64"),
+            "type": np.concatenate(
+                [
+                    np.full(len(point_index), area_type, dtype=object)
+                    for area_type, point_index, _ in matches
+                ]
+                + [np.empty(0, dtype=object)]
+            ),
+        }
+        for column in area_columns:
+            columns[column] = np.concatenate(
+                [
+                    self.attributes[area_type][column][area_index]
+                    for area_type, _, area_index in matches
+                ]
+                + [np.empty(0, dtype=object)]
+            )
+        return pd.DataFrame(columns).sort_values(
+            "point_index", kind="stable", ignore_index=True
+        )
+
+    def lookup_records(self, lats, lons, types=None):
+        """Find the areas that contain each point, grouped per point for JSON responses.
+
+        Args:
+            lats (array-like): Latitudes in degrees
+            lons (array-like): Longitudes in degrees
+            types (list): Area types to search, defaults to all of them
+        Returns:
+            list: One dict per point, mapping area type to a list of matched area attribute dicts
+        """
+        results = [{} for _ in range(len(lats))]
+        for area_type, point_index, area_index in self.query(lats, lons, types):
+            attributes = self.attributes[area_type]
+            for i, j in zip(point_index.tolist(), area_index.tolist()):
+                area = {column: attributes[column][j] for column in area_columns}
+                results[i].setdefault(area_type, []).append(area)
+        return results
+
+
+class LatencyStats:
+    """Thread-safe record of recent request latencies."""
+
+    def __init__(self, maxlen=10000):
+        self.lock = threading.Lock()
+        self.latencies_ms = collections.deque(maxlen=maxlen)
+        self.requests = 0
+
+    def add(self, latency_ms):
+        with self.lock:
+            self.latencies_ms.append(latency_ms)
+            self.requests += 1
+
+    def summary(self):
+        """Get the request count and the p50/p99 latency of the recent requests in milliseconds."""
+        with self.lock:
+            latencies_ms = np.array(self.latencies_ms)
+            requests = self.requests
+        if len(latencies_ms) == 0:
+            return {"requests": requests, "p50_ms": None, "p99_ms": None}
+        return {
+            "requests": requests,
+            "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+            "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+        }
+
+
+def make_handler(area_lookup, stats):
+    """Make an HTTP request handler class bound to an AreaLookup and its LatencyStats."""
+
+    class AreaLookupHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def answer(self, lats, lons, types):
+            start = time.perf_counter()
+            try:
+                results = area_lookup.lookup_records(lats, lons, types)
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            self.send_json(200, {"results": results})
+            stats.add((time.perf_counter() - start) * 1000)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/stats":
+                self.send_json(200, stats.summary())
+            elif url.path == "/lookup":
+                query = parse_qs(url.query)
+                try:
+                    lats = [float(query["lat"][0])]
+                    lons = [float(query["lon"][0])]
+                except (KeyError, ValueError):
+                    self.send_json(400, {"error": "lat and lon are required numbers"})
+                    return
+                self.answer(lats, lons, query.get("type"))
+            else:
+                self.send_json(404, {"error": f"Unknown path: {url.path}"})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/lookup":
+                self.send_json(404, {"error": f"Unknown path: {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length))
+                points = np.asarray(body["points"], dtype="float64").reshape(-1, 2)
+            except (KeyError, ValueError, TypeError):
+                self.send_json(
+                    400, {"error": 'Body must be {"points": [[lat, lon], ...]}'}
+                )
+                return
+            self.answer(points[:, 0], points[:, 1], body.get("types"))
+
+        def log_message(self, format, *args):
+            # per-request logging would dominate the latency of small lookups
+            pass
+
+    return AreaLookupHandler
+
+
+def make_server(area_lookup, host="127.0.0.1", port=8000):
+    """Make a threaded HTTP server for an AreaLookup.
+
+    Args:
+        area_lookup (AreaLookup): Loaded lookup
+        host (str): Host to bind to
+        port (int): Port to bind to, 0 picks a free port
+    Returns:
+        ThreadingHTTPServer: The server, with its LatencyStats as the `stats` attribute
+    """
+    stats = LatencyStats()
+    server = ThreadingHTTPServer((host, port), make_handler(area_lookup, stats))
+    server.stats = stats
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--areas",
+        type=str,
+        default="all_places/all_areas.shp",
+        help="Path to the merged areas from create_shapefiles.py. Default is all_places/all_areas.shp.",
+    )
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1", help="Default is 127.0.0.1."
+    )
+    parser.add_argument("--port", type=int, default=8000, help="Default is 8000.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    area_lookup = AreaLookup(load_areas(args.areas))
+    print(
+        f"Indexed {len(area_lookup.types)} area types in {time.perf_counter() - start:.2f} seconds"
+    )
+    server = make_server(area_lookup, args.host, args.port)
+    print(f"Serving area lookups on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats.summary()))
+        server.server_close()
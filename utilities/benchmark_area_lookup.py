@@ -0,0 +1,177 @@
+"""
+Load test the point-in-polygon lookup in area_lookup.py.
+
+The community point locations are used as query points. The script first
+times in-process batch lookups, then starts the HTTP endpoint on a free local
+port and sends single-point GET requests and batched POST requests from
+several client threads, reporting the throughput and the client-side and
+server-side p50/p99 latencies.
+
+Example usage:
+    python benchmark_area_lookup.py
+    python benchmark_area_lookup.py --areas all_places/all_areas.parquet --requests 5000 --clients 16
+"""
+
+import argparse
+import glob
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from area_lookup import AreaLookup, load_areas, make_server
+
+
+def load_query_points():
+    """Load the community latitudes and longitudes from every point location CSV."""
+    communities = pd.concat(
+        [
+            pd.read_csv(csv, usecols=["latitude", "longitude"])
+            for csv in sorted(glob.iglob("../vector_data/point/*.csv"))
+        ],
+        ignore_index=True,
+    )
+    return communities["latitude"].to_numpy(), communities["longitude"].to_numpy()
+
+
+def percentiles_ms(latencies_s):
+    """Summarize latencies in seconds as p50/p99 milliseconds."""
+    latencies_ms = np.asarray(latencies_s) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 3),
+    }
+
+
+def benchmark_batch(area_lookup, lats, lons, batch_size, n_calls):
+    """
+    Time in-process lookups of random query points in batches.
+
+    Args:
+        area_lookup (AreaLookup): Loaded lookup.
+        lats (np.ndarray): Query latitudes.
+        lons (np.ndarray): Query longitudes.
+        batch_size (int): Number of points per lookup call.
+        n_calls (int): Number of lookup calls.
+
+    Returns:
+        dict: Throughput and per-call latency summary.
+    """
+    call_points = np.random.default_rng(0).integers(0, len(lats), (n_calls, batch_size))
+    latencies = []
+    start = time.perf_counter()
+    for idx in call_points:
+        call_start = time.perf_counter()
+        area_lookup.lookup(lats[idx], lons[idx])
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    return {
+        "test": f"in-process batch of {batch_size}",
+        "calls": n_calls,
+        "points_per_s": round(n_calls * batch_size / elapsed),
+        **percentiles_ms(latencies),
+    }
+
+
+def benchmark_http(url, lats, lons, n_requests, clients, batch_size):
+    """
+    Load test the HTTP endpoint from several client threads.
+
+    Args:
+        url (str): Base URL of the running server.
+        lats (np.ndarray): Query latitudes.
+        lons (np.ndarray): Query longitudes.
+        n_requests (int): Number of requests to send.
+        clients (int): Number of concurrent client threads.
+        batch_size (int): Points per request, 1 sends GET requests and more sends POST requests.
+
+    Returns:
+        dict: Throughput and client-side latency summary.
+    """
+    # draw every request's points up front, the generator isn't thread-safe
+    request_points = np.random.default_rng(0).integers(
+        0, len(lats), (n_requests, batch_size)
+    )
+
+    def send(idx):
+        if batch_size == 1:
+            request = f"{url}/lookup?lat={lats[idx[0]]}&lon={lons[idx[0]]}"
+        else:
+            body = json.dumps(
+                {"points": np.column_stack([lats[idx], lons[idx]]).tolist()}
+            )
+            request = urllib.request.Request(
+                f"{url}/lookup",
+                data=body.encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+            )
+        start = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        latencies = list(executor.map(send, request_points))
+    elapsed = time.perf_counter() - start
+    return {
+        "test": f"HTTP batch of {batch_size}, {clients} clients",
+        "calls": n_requests,
+        "points_per_s": round(n_requests * batch_size / elapsed),
+        **percentiles_ms(latencies),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--areas",
+        type=str,
+        default="all_places/all_areas.shp",
+        help="Path to the merged areas from create_shapefiles.py. Default is all_places/all_areas.shp.",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=2000,
+        help="Number of HTTP requests per test. Default is 2000.",
+    )
+    parser.add_argument(
+        "--clients",
+        type=int,
+        default=8,
+        help="Number of concurrent HTTP clients. Default is 8.",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    area_lookup = AreaLookup(load_areas(args.areas))
+    print(f"Load and index: {time.perf_counter() - start:.2f} seconds")
+    lats, lons = load_query_points()
+
+    results = [
+        benchmark_batch(area_lookup, lats, lons, batch_size, n_calls)
+        for batch_size, n_calls in [(1, args.requests), (100, 200), (10000, 10)]
+    ]
+
+    server = make_server(area_lookup, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        for batch_size in [1, 100]:
+            results.append(
+                benchmark_http(url, lats, lons, args.requests, args.clients, batch_size)
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print(pd.DataFrame(results).to_string(index=False))
+    print(f"Server-side latency: {json.dumps(server.stats.summary())}")
@@ -0,0 +1,114 @@
+"""
+Benchmark the two coastal distance methods in compute_coastal_distance.py.
+
+The "vertex" method measures the distance to the nearest coastline vertex,
+which overestimates the distance wherever the nearest part of the coastline is
+the middle of a long straight segment. The "segment" method measures the exact
+distance to the nearest coastline segment. This script times both methods
+(tree build and query separately) and reports how far the vertex distances are
+from the exact segment distances, and how many points would flip their
+`is_coastal` tag.
+
+Example usage:
+    python benchmark_coastal_distance.py
+    python benchmark_coastal_distance.py --regions alaska norway yukon
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import compute_coastal_distance as ccd
+from crs_lookup import crs_lookup
+
+
+def time_method(communities_df, projected_crs_code, method):
+    """
+    Time the tree build and the distance query for one method.
+
+    The in-process tree memos are cleared first so the build is always timed, but the on-disk vertex and segment caches are used if they exist.
+
+    Args:
+        communities_df (pd.DataFrame): DataFrame with latitude and longitude columns.
+        projected_crs_code (int): The EPSG code of the projected coordinate reference system.
+        method (str): "vertex" or "segment".
+
+    Returns:
+        tuple: (distances in km, build seconds, query seconds)
+    """
+    ccd.get_coastline_tree.cache_clear()
+    ccd.get_coastline_segment_tree.cache_clear()
+    start = time.perf_counter()
+    if method == "vertex":
+        ccd.get_coastline_tree(projected_crs_code)
+    else:
+        ccd.get_coastline_segment_tree(projected_crs_code)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    distances_km = ccd.compute_coastal_distances_km(
+        communities_df, projected_crs_code, method
+    )
+    query_seconds = time.perf_counter() - start
+    return distances_km, build_seconds, query_seconds
+
+
+def benchmark_region(region_name, coastal_distance_km_threshold=100):
+    """
+    Compare the vertex and segment methods for one region.
+
+    Args:
+        region_name (str): Region name as used in the point location CSV names and `crs_lookup`.
+        coastal_distance_km_threshold (int): The distance threshold in kilometers for the coastal tag.
+
+    Returns:
+        dict: Timing and error summary for the region.
+    """
+    csv_path = Path(f"../vector_data/point/{region_name}_point_locations.csv")
+    communities_df = pd.read_csv(csv_path)
+    projected_crs_code = crs_lookup[region_name]
+
+    vertex_km, vertex_build, vertex_query = time_method(
+        communities_df, projected_crs_code, "vertex"
+    )
+    segment_km, segment_build, segment_query = time_method(
+        communities_df, projected_crs_code, "segment"
+    )
+    # the vertex distance can only ever overestimate the exact segment distance
+    error_km = vertex_km - segment_km
+    coastal_flips = (vertex_km < coastal_distance_km_threshold) != (
+        segment_km < coastal_distance_km_threshold
+    )
+    return {
+        "region": region_name,
+        "points": len(communities_df),
+        "vertex_build_s": round(vertex_build, 3),
+        "vertex_query_s": round(vertex_query, 3),
+        "segment_build_s": round(segment_build, 3),
+        "segment_query_s": round(segment_query, 3),
+        "mean_error_km": round(float(np.mean(error_km)), 2),
+        "p95_error_km": round(float(np.percentile(error_km, 95)), 2),
+        "max_error_km": round(float(np.max(error_km)), 2),
+        "changed_points": int(np.count_nonzero(error_km)),
+        "is_coastal_flips": int(np.count_nonzero(coastal_flips)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--regions",
+        type=str,
+        nargs="+",
+        default=["alaska", "norway"],
+        help="Regions to benchmark. Default is alaska and norway.",
+    )
+    args = parser.parse_args()
+
+    results = pd.DataFrame([benchmark_region(region) for region in args.regions])
+    print(results.to_string(index=False))
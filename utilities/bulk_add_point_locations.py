@@ -0,0 +1,312 @@
+"""
+Add many point locations at once from a CSV of new locations, the bulk
+counterpart of add_point_location.py. Ids are allocated in one pass per region
+CSV, the coastal distance, nearest ocean neighbors, and tags are computed only
+for the new rows, and each region CSV is written once.
+
+The CSV of new locations needs these columns:
+
+    region: id prefix of the region CSV to add the location to, e.g. AK, QC, or
+        NO (the region postal codes of add_point_location.py)
+    name, latitude, longitude: as in the point location CSVs
+
+and can have these optional columns:
+
+    alt_name: alternate name
+    region_name: value of the region column, required for CSVs that span
+        several regions (e.g. the Norway or Russia CSVs), defaults to the
+        CSV's only region otherwise
+    country: defaults to the CSV's country
+    tags: comma separated tags, computed from tagging_rules.json if empty
+
+Coordinates are rounded to 4 decimals. The coastal distance and is_coastal are
+computed like compute_coastal_distance.py does, in the CSV's projected CRS.
+With --ocean_raster, the nearest ocean neighbors are found like
+find_nearest_raster_neighbors.py does, for CSVs that have ocean neighbor
+columns. New locations within --min_distance_m of another location are
+reported before anything is written.
+
+Example usage:
+    python bulk_add_point_locations.py new_locations.csv
+    python bulk_add_point_locations.py new_locations.csv --ocean_raster hsia_mask.tif --grid_cell_values 1 --yes
+"""
+
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from add_point_location import (
+    create_new_id,
+    get_last_id_number_in_df,
+    sort_alphabetically,
+    write_new_csv,
+    yes_no,
+)
+from compute_coastal_distance import add_coastal_tag, compute_coastal_distances_km
+from crs_lookup import crs_lookup
+from find_nearest_raster_neighbors import find_nearest_neighbors
+from geodesy import find_close_pairs
+from tag_point_locations import (
+    build_tag_matrix,
+    load_polygon_masks,
+    load_rules,
+    needs_polygon_tests,
+    serialize_tags,
+)
+
+required_columns = ["region", "name", "latitude", "longitude"]
+
+
+def get_region_paths():
+    """Map the id prefix of every point location CSV to its path.
+
+    Returns:
+        dict: Maps id prefix (e.g. "AK") to the path of the CSV
+    """
+    region_paths = {}
+    for path in sorted(glob.iglob("../vector_data/point/*.csv")):
+        # skip the backups that write_new_csv makes of the CSVs it overwrites
+        if path.endswith("_DEPRECATED.csv"):
+            continue
+        # every id of a CSV has the same prefix, so the first row is enough
+        first_id = pd.read_csv(path, usecols=["id"], nrows=1)["id"].iloc[0]
+        region_paths[first_id[:2]] = path
+    return region_paths
+
+
+def load_new_locations(path, region_paths):
+    """Read and check the CSV of new locations.
+
+    Args:
+        path (str): Path to the CSV of new locations
+        region_paths (dict): Region CSV paths from `get_region_paths`
+    Returns:
+        pd.DataFrame: The new locations with coordinates rounded to 4 decimals
+    """
+    new = pd.read_csv(path, dtype={"region": str, "tags": str})
+    missing = [column for column in required_columns if column not in new.columns]
+    if missing:
+        raise ValueError(f"{path} is missing the columns {missing}")
+    for column in ["alt_name", "region_name", "country", "tags"]:
+        if column not in new.columns:
+            # object dtype like the text columns read from the CSV, an all NaN column would be float
+            new[column] = pd.Series(np.nan, index=new.index, dtype=object)
+
+    new["region"] = new["region"].str.strip().str.upper()
+    unknown = sorted(set(new["region"]) - set(region_paths))
+    if unknown:
+        raise ValueError(
+            f"Unknown regions {unknown}, expected one of {sorted(region_paths)}"
+        )
+    out_of_range = (new["latitude"].abs() > 90) | (new["longitude"].abs() > 180)
+    out_of_range |= new[["latitude", "longitude"]].isna().any(axis=1)
+    if out_of_range.any():
+        raise ValueError(
+            f"Missing or out of range coordinates for {new.loc[out_of_range, 'name'].tolist()}"
+        )
+    new[["latitude", "longitude"]] = new[["latitude", "longitude"]].round(4)
+    return new
+
+
+def create_new_records(new, existing, prefix):
+    """Allocate ids and fill in the region and country of the new locations of one region CSV.
+
+    Args:
+        new (pd.DataFrame): New locations for this region CSV
+        existing (pd.DataFrame): The region CSV
+        prefix (str): Id prefix of the region CSV
+    Returns:
+        pd.DataFrame: New rows with the columns of the region CSV
+    """
+    last_id = get_last_id_number_in_df(existing)
+    records = new.copy()
+    records["id"] = [create_new_id(prefix, last_id + i) for i in range(len(new))]
+
+    regions = existing["region"].dropna().unique()
+    if records["region_name"].isna().any() and len(regions) != 1:
+        raise ValueError(
+            f"region_name is required for the {prefix} CSV, which has several regions"
+        )
+    records["region"] = records["region_name"].fillna(
+        regions[0] if len(regions) else ""
+    )
+    records["country"] = records["country"].fillna(existing["country"].iloc[0])
+    return records.reindex(columns=existing.columns)
+
+
+def enrich_new_records(records, file, rules, masks, args):
+    """Compute the coastal distance, ocean neighbors, and tags of new rows only.
+
+    Args:
+        records (pd.DataFrame): New rows of one region CSV from `create_new_records`
+        file (str): Name of the region CSV
+        rules (dict): Tagging rules from `load_rules`
+        masks (dict): Prepared polygon masks from `load_polygon_masks`, or None if the file needs none
+        args (argparse.Namespace): Command line arguments
+    Returns:
+        pd.DataFrame: The new rows with the computed columns filled in
+    """
+    # csv names are like newfoundland_and_labrador_point_locations.csv
+    region_name = file.split("_point_locations")[0]
+    crs = crs_lookup[region_name]
+
+    if "km_distance_to_ocean" in records.columns:
+        records["km_distance_to_ocean"] = compute_coastal_distances_km(
+            records, crs, args.method
+        )
+        records = add_coastal_tag(records)
+
+    ocean_columns = [
+        column for column in records.columns if column.startswith("ocean_")
+    ]
+    if args.ocean_raster and ocean_columns:
+        with_neighbors = find_nearest_neighbors(
+            records,
+            args.ocean_raster,
+            args.band_number,
+            args.grid_cell_values,
+            len(ocean_columns) // 2,
+            "ocean",
+            crs,
+            shared_index=args.shared_index,
+        )
+        records[ocean_columns] = with_neighbors[ocean_columns].to_numpy()
+
+    if "tags" in records.columns:
+        untagged = records["tags"].fillna("").astype(str).str.strip() == ""
+        if untagged.any():
+            tag_matrix = build_tag_matrix(records[untagged], file, masks, rules)
+            records.loc[untagged, "tags"] = serialize_tags(tag_matrix)
+    return records
+
+
+def report_close_locations(new_rows, existing, min_distance_m):
+    """Print the new locations that are within the minimum distance of another location.
+
+    Args:
+        new_rows (pd.DataFrame): Every new row
+        existing (pd.DataFrame): Every existing row of every region CSV
+        min_distance_m (float): Minimum distance between locations in meters
+    Returns:
+        int: Number of close pairs that include a new location
+    """
+    points = pd.concat(
+        [existing[["id", "name", "latitude", "longitude"]], new_rows], ignore_index=True
+    )
+    pairs, distances = find_close_pairs(
+        points["longitude"], points["latitude"], min_distance_m
+    )
+    # only pairs with a new location, the existing ones are reported by validate_point_locations.py
+    involves_new = pairs.max(axis=1) >= len(existing)
+    for (i, j), distance in zip(pairs[involves_new], distances[involves_new]):
+        print(
+            f"Warning: {points['name'].iloc[j]} ({points['id'].iloc[j]}) is {distance:.0f} m from "
+            f"{points['name'].iloc[i]} ({points['id'].iloc[i]})"
+        )
+    return int(involves_new.sum())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("new_locations", type=str, help="CSV of new locations")
+    parser.add_argument(
+        "--rules",
+        type=str,
+        default="tagging_rules.json",
+        help="Tagging rules file. Default is tagging_rules.json.",
+    )
+    parser.add_argument(
+        "--method",
+        type=str,
+        choices=["vertex", "segment", "geodesic"],
+        default="vertex",
+        help="Coastal distance method, see compute_coastal_distance.py. Default is vertex.",
+    )
+    parser.add_argument(
+        "--ocean_raster",
+        type=str,
+        default=None,
+        help="Raster for the nearest ocean neighbors, see find_nearest_raster_neighbors.py. Default is to leave them empty.",
+    )
+    parser.add_argument(
+        "--band_number",
+        type=int,
+        default=1,
+        help="Band of the ocean raster. Default is 1.",
+    )
+    parser.add_argument(
+        "--grid_cell_values",
+        type=int,
+        nargs="+",
+        default=[1],
+        help="Values of the ocean raster grid cells that count as ocean. Default is 1.",
+    )
+    parser.add_argument(
+        "--shared_index",
+        action="store_true",
+        help="Use the cached index of every ocean grid cell instead of windowed reads, see find_nearest_raster_neighbors.py.",
+    )
+    parser.add_argument(
+        "--min_distance_m",
+        type=float,
+        default=1000,
+        help="Report new locations closer than this to another location, in meters. Default is 1000.",
+    )
+    parser.add_argument(
+        "--yes",
+        action="store_true",
+        help="Write the region CSVs without asking for confirmation.",
+    )
+    args = parser.parse_args()
+
+    region_paths = get_region_paths()
+    new = load_new_locations(args.new_locations, region_paths)
+    rules = load_rules(args.rules)
+    masks = None
+
+    updated = {}
+    existing_rows = []
+    new_rows = []
+    for prefix, region_new in new.groupby("region", sort=True):
+        csv_path = region_paths[prefix]
+        file = os.path.basename(csv_path)
+        existing = pd.read_csv(csv_path)
+        records = create_new_records(region_new, existing, prefix)
+        # masks are only loaded if some CSV actually needs a polygon test
+        if masks is None and needs_polygon_tests(file, rules):
+            masks = load_polygon_masks(rules)
+        records = enrich_new_records(records, file, rules, masks, args)
+        updated[csv_path] = (existing, records)
+        existing_rows.append(existing)
+        new_rows.append(records)
+        print(f"{file}: adding {len(records)} locations")
+        print(records.to_string(index=False))
+
+    # every CSV is checked for nearby locations, not only the ones being updated
+    for path in region_paths.values():
+        if path not in updated:
+            existing_rows.append(
+                pd.read_csv(path, usecols=["id", "name", "latitude", "longitude"])
+            )
+    report_close_locations(
+        pd.concat(new_rows, ignore_index=True)[["id", "name", "latitude", "longitude"]],
+        pd.concat(existing_rows, ignore_index=True),
+        args.min_distance_m,
+    )
+
+    if args.yes or yes_no(
+        f"Do you wish to proceed with writing {len(updated)} region files (y/n)?"
+    ):
+        for csv_path, (existing, records) in updated.items():
+            write_new_csv(
+                sort_alphabetically(pd.concat([existing, records], ignore_index=True)),
+                csv_path,
+            )
+        print(f"Added {len(new)} locations to {len(updated)} region files")
+    else:
+        print("No files were written. Program exiting.")
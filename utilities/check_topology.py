@@ -0,0 +1,460 @@
+"""
+Check the polygon layers for validity and topology problems and write a JSON
+report. Each layer (every layer in the `area_layers` registry of
+create_shapefiles.py by default, or the shapefiles given with --shapefiles) is
+checked in its own worker process, and the following is reported per feature:
+
+    invalid: the geometry is not valid, with the GEOS reason (e.g. a ring
+        self-intersection) and where it is
+    overlap: two features of the layer overlap, found by querying an STRtree of
+        the layer with its own features
+    gap: a hole in the union of the layer's features that no feature covers
+        (a warning, since many holes are lakes or other areas left out on
+        purpose, with thin and small ones reported as sliver gaps)
+    sliver: a thin, small polygon part of a feature, an overlap, or a gap
+    small_polygon: a feature smaller than the ~10 km² limit of the README
+        (convert_small_polygons_to_points.py turns these into points)
+
+Overlaps and gaps are only checked for layers whose features should tile the
+map without overlapping, like boroughs, census areas, or HUCs, so they are not
+checked for the layers flagged "overlapping" in `area_layers`. Shapefiles given with
+--shapefiles are matched to their `area_layers` entry by path, and others can
+be marked as overlapping with --overlapping. A layer whose file is missing is
+reported as a missing_layer warning and counted in the summary. Areas are computed in the
+EPSG:6931 equal-area projection and locations are reported as longitude and
+latitude.
+
+The runtime of every layer is printed, saved in the report, and appended to
+topology_runtime_history.csv along with the layer's feature and vertex
+counts, to follow how the cost of the checks grows with the data.
+
+Example usage:
+    python check_topology.py
+    python check_topology.py --shapefiles ../vector_data/polygon/boundaries/boroughs/ak_boroughs.shp --workers 4
+"""
+
+import argparse
+import collections
+import csv
+import json
+import math
+import os
+import re
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+from create_shapefiles import area_layers
+from parallel import run_in_process_pool
+
+# equal-area projection covering every northern layer, so areas are in m²
+area_crs = 6931
+small_polygon_km2 = 10
+# overlaps smaller than this are floating point noise along shared edges
+min_overlap_m2 = 1
+# a polygon is a sliver if it is below this area and 4πA/P² (1 for a circle) is below this thinness
+sliver_max_km2 = 1
+sliver_thinness = 0.05
+# coordinates after the GEOS reason, e.g. "Self-intersection[-147.1 64.8]"
+reason_location_pattern = re.compile(r"\[(\S+) (\S+)\]")
+history_path = "topology_runtime_history.csv"
+
+
+def is_sliver(geoms):
+    """Check which polygons are slivers, thin and small.
+
+    Args:
+        geoms (np.ndarray): Polygons in `area_crs`
+    Returns:
+        np.ndarray: Boolean array, True for the slivers
+    """
+    areas = shapely.area(geoms)
+    perimeters = shapely.length(geoms)
+    thinness = np.divide(
+        4 * math.pi * areas,
+        perimeters**2,
+        out=np.ones_like(areas),
+        where=perimeters > 0,
+    )
+    return (areas < sliver_max_km2 * 1e6) & (thinness < sliver_thinness)
+
+
+def to_lonlat(points, crs):
+    """Convert points to (longitude, latitude) pairs rounded to 4 decimals."""
+    lonlat = gpd.GeoSeries(points, crs=crs).to_crs(4326)
+    return [
+        (round(x, 4), round(y, 4))
+        for x, y in zip(shapely.get_x(lonlat.values), shapely.get_y(lonlat.values))
+    ]
+
+
+def check_validity(gdf):
+    """Find the invalid geometries of a layer.
+
+    Validity is checked in the layer's own CRS, since reprojecting can both fix and break it.
+
+    Args:
+        gdf (gpd.GeoDataFrame): Layer as read from its file
+    Returns:
+        list: (feature index, message, location point in the layer's CRS) for each invalid geometry
+    """
+    geoms = gdf.geometry.values.to_numpy()
+    reasons = shapely.is_valid_reason(geoms)
+    invalid = []
+    for index in np.flatnonzero(reasons != "Valid Geometry"):
+        match = reason_location_pattern.search(reasons[index] or "")
+        if match:
+            location = shapely.Point(float(match[1]), float(match[2]))
+        else:
+            location = shapely.point_on_surface(geoms[index])
+        invalid.append((index, reasons[index], location))
+    return invalid
+
+
+def check_overlaps(geoms):
+    """Find the pairs of features that overlap.
+
+    Args:
+        geoms (np.ndarray): Valid polygons in `area_crs`
+    Returns:
+        tuple: ((n, 2) array of feature index pairs, their overlaps)
+    """
+    tree = shapely.STRtree(geoms)
+    # pairs whose bounding boxes intersect, each pair only once
+    left, right = tree.query(geoms)
+    keep = left < right
+    left, right = left[keep], right[keep]
+    overlaps = shapely.intersection(geoms[left], geoms[right])
+    # shared edges and corners intersect without overlapping
+    overlapping = shapely.area(overlaps) >= min_overlap_m2
+    return np.column_stack([left, right])[overlapping], overlaps[overlapping]
+
+
+def check_gaps(geoms):
+    """Find the holes in the union of the features.
+
+    Args:
+        geoms (np.ndarray): Valid polygons in `area_crs`
+    Returns:
+        np.ndarray: Gap polygons
+    """
+    union = shapely.union_all(geoms)
+    polygons = shapely.get_parts(union)
+    polygons = polygons[shapely.get_type_id(polygons) == 3]
+    gaps = [
+        shapely.Polygon(ring)
+        for polygon in polygons
+        for ring in shapely.get_interior_ring(
+            polygon, np.arange(shapely.get_num_interior_rings(polygon))
+        )
+    ]
+    return np.array(gaps, dtype=object)
+
+
+def get_layer_by_path(path, overlapping=False):
+    """Get the `area_layers` description of a shapefile path, or a new description named after the file.
+
+    Args:
+        path (str): Path to the shapefile
+        overlapping (bool): The layer's features are expected to overlap
+    Returns:
+        dict: Layer description with at least a name and a path, as in `area_layers`
+    """
+    layer = {"name": Path(path).stem, "path": path}
+    for area_layer in area_layers:
+        if os.path.realpath(area_layer["path"]) == os.path.realpath(path):
+            layer = area_layer
+            break
+    if overlapping:
+        layer = {**layer, "overlapping": True}
+    return layer
+
+
+def is_overlapping(layer):
+    """Check if a layer's features are expected to overlap, from the "overlapping" flag of its layer description."""
+    return layer.get("overlapping", False)
+
+
+def missing_layer_result(layer):
+    """Make the result of a layer whose file doesn't exist, with a single missing_layer warning."""
+    print(f"{layer['name']}: {layer['path']} does not exist")
+    return {
+        "layer": layer["name"],
+        "path": str(layer["path"]),
+        "missing": True,
+        "features": 0,
+        "vertices": 0,
+        "seconds": 0.0,
+        "check_seconds": {},
+        "issues": [
+            {
+                "check": "missing_layer",
+                "severity": "warning",
+                "layer": layer["name"],
+                "feature": [],
+                "id": None,
+                "name": None,
+                "longitude": None,
+                "latitude": None,
+                "message": f"{layer['path']} does not exist",
+            }
+        ],
+    }
+
+
+def check_layer(layer):
+    """Run every check on one layer.
+
+    Args:
+        layer (dict): Layer description with at least a name and a path, as in `area_layers`
+    Returns:
+        dict: The layer's name, feature and vertex counts, runtime per check, and issues
+    """
+    timings = {}
+    start = time.perf_counter()
+    gdf = gpd.read_file(layer["path"])
+    timings["read"] = time.perf_counter() - start
+    ids = gdf["id"].astype(str).to_numpy() if "id" in gdf.columns else None
+    names = gdf["name"].astype(str).to_numpy() if "name" in gdf.columns else None
+    issues = []
+
+    def add_issues(check, severity, indices, messages, locations, areas_m2=None):
+        """Record issues for the features at indices, with locations in `area_crs`."""
+        lonlats = to_lonlat(locations, area_crs) if len(locations) else []
+        for n, (index, message, lonlat) in enumerate(zip(indices, messages, lonlats)):
+            issue = {
+                "check": check,
+                "severity": severity,
+                "layer": layer["name"],
+                "feature": [int(i) for i in np.atleast_1d(index)],
+                "id": None if ids is None else [ids[i] for i in np.atleast_1d(index)],
+                "name": (
+                    None if names is None else [names[i] for i in np.atleast_1d(index)]
+                ),
+                "longitude": lonlat[0],
+                "latitude": lonlat[1],
+                "message": message,
+            }
+            if areas_m2 is not None:
+                issue["area_km2"] = round(float(areas_m2[n]) / 1e6, 6)
+            issues.append(issue)
+
+    start = time.perf_counter()
+    invalid = check_validity(gdf)
+    if invalid:
+        locations = gpd.GeoSeries([location for *_, location in invalid], crs=gdf.crs)
+        add_issues(
+            "invalid",
+            "error",
+            [index for index, *_ in invalid],
+            [reason for _, reason, _ in invalid],
+            locations.to_crs(area_crs).values.to_numpy(),
+        )
+    timings["validity"] = time.perf_counter() - start
+
+    # the other checks need valid geometries, so the invalid ones are repaired first
+    geoms = shapely.make_valid(gdf.to_crs(area_crs).geometry.values.to_numpy())
+    areas = shapely.area(geoms)
+
+    start = time.perf_counter()
+    small = np.flatnonzero(areas < small_polygon_km2 * 1e6)
+    add_issues(
+        "small_polygon",
+        "warning",
+        small,
+        [f"smaller than {small_polygon_km2} km²"] * len(small),
+        shapely.point_on_surface(geoms[small]),
+        areas[small],
+    )
+    parts, part_index = shapely.get_parts(geoms, return_index=True)
+    slivers = is_sliver(parts)
+    # a feature that is itself a single sliver part is reported once as a sliver
+    add_issues(
+        "sliver",
+        "warning",
+        part_index[slivers],
+        ["thin polygon part"] * int(slivers.sum()),
+        shapely.point_on_surface(parts[slivers]),
+        shapely.area(parts[slivers]),
+    )
+    timings["area"] = time.perf_counter() - start
+
+    if not is_overlapping(layer):
+        start = time.perf_counter()
+        pairs, overlaps = check_overlaps(geoms)
+        add_issues(
+            "overlap",
+            "error",
+            pairs,
+            [
+                "sliver overlap" if sliver else "overlap"
+                for sliver in is_sliver(overlaps)
+            ],
+            shapely.point_on_surface(overlaps),
+            shapely.area(overlaps),
+        )
+        timings["overlap"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        gaps = check_gaps(geoms)
+        if len(gaps):
+            # the features next to each gap
+            gap_index, feature_index = shapely.STRtree(geoms).query(
+                gaps, predicate="touches"
+            )
+            neighbors = [feature_index[gap_index == n] for n in range(len(gaps))]
+            add_issues(
+                "gap",
+                "warning",
+                neighbors,
+                ["sliver gap" if sliver else "gap" for sliver in is_sliver(gaps)],
+                shapely.point_on_surface(gaps),
+                shapely.area(gaps),
+            )
+        timings["gap"] = time.perf_counter() - start
+
+    seconds = sum(timings.values())
+    print(f"{layer['name']}: {len(issues)} issues in {seconds:.2f} s")
+    return {
+        "layer": layer["name"],
+        "path": str(layer["path"]),
+        "features": len(gdf),
+        "vertices": int(shapely.get_num_coordinates(geoms).sum()),
+        "seconds": round(seconds, 3),
+        "check_seconds": {check: round(t, 3) for check, t in timings.items()},
+        "issues": issues,
+    }
+
+
+def append_runtime_history(results):
+    """Append each layer's feature and vertex counts and runtime to `history_path`."""
+    new_file = not os.path.exists(history_path)
+    timestamp = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    with open(history_path, "a", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["timestamp", "layer", "features", "vertices", "seconds"])
+        for result in results:
+            if result.get("missing"):
+                continue
+            writer.writerow(
+                [
+                    timestamp,
+                    result["layer"],
+                    result["features"],
+                    result["vertices"],
+                    result["seconds"],
+                ]
+            )
+
+
+def check_topology(layers=area_layers, workers=None):
+    """Check every layer in a process pool.
+
+    Args:
+        layers (list): Layer descriptions with at least a name and a path, as in `area_layers`
+        workers (int): Number of worker processes, defaults to one per available core
+    Returns:
+        dict: The report, with a summary, the runtime of every layer, and the list of issues
+    """
+    found = [layer for layer in layers if os.path.exists(layer["path"])]
+    checked = iter(
+        run_in_process_pool(
+            check_layer,
+            found,
+            workers=workers,
+            labels=[layer["name"] for layer in found],
+        )
+    )
+    # missing layers are reported as warnings and counted in the summary
+    results = [
+        next(checked) if os.path.exists(layer["path"]) else missing_layer_result(layer)
+        for layer in layers
+    ]
+    issues = [issue for result in results for issue in result["issues"]]
+    counts = collections.Counter(
+        (issue["check"], issue["severity"]) for issue in issues
+    )
+    return {
+        "summary": {
+            "layers": len(results),
+            "missing_layers": sum(1 for result in results if result.get("missing")),
+            "errors": sum(
+                n for (_, severity), n in counts.items() if severity == "error"
+            ),
+            "warnings": sum(
+                n for (_, severity), n in counts.items() if severity == "warning"
+            ),
+            "issues_per_check": {check: n for (check, _), n in sorted(counts.items())},
+        },
+        "layers": [
+            {key: value for key, value in result.items() if key != "issues"}
+            for result in results
+        ],
+        "issues": issues,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--shapefiles",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Shapefiles to check. Default is every layer in area_layers of create_shapefiles.py.",
+    )
+    parser.add_argument(
+        "--overlapping",
+        action="store_true",
+        help="The features of the --shapefiles are expected to overlap, so overlaps and gaps aren't checked. "
+        "Default is to only skip them for the layers flagged overlapping in area_layers.",
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default="topology_report.json",
+        help="Path of the JSON report. Default is topology_report.json.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes. Default is one per core.",
+    )
+    args = parser.parse_args()
+
+    if args.shapefiles:
+        layers = [get_layer_by_path(path, args.overlapping) for path in args.shapefiles]
+    else:
+        layers = area_layers
+    report = check_topology(layers, args.workers)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    append_runtime_history(report["layers"])
+
+    for layer in report["layers"]:
+        if layer.get("missing"):
+            print(f"{layer['layer']}: missing ({layer['path']})")
+            continue
+        print(
+            f"{layer['layer']}: {layer['features']} features, {layer['vertices']} vertices, "
+            f"{layer['seconds']:.2f} s"
+        )
+    summary = report["summary"]
+    print(
+        f"Checked {summary['layers'] - summary['missing_layers']} of {summary['layers']} layers "
+        f"({summary['missing_layers']} missing): "
+        f"{summary['errors']} errors, {summary['warnings']} warnings"
+    )
+    for check, n in summary["issues_per_check"].items():
+        print(f"  {check}: {n}")
+    print(f"Report written to {args.report}")
+    if summary["errors"]:
+        raise SystemExit(1)
@@ -0,0 +1,180 @@
+"""
+Precompute which areas contain each community, so web apps can look up the
+areas of a community with a dictionary hit instead of a spatial join. The
+communities in every point location CSV are matched against every area layer
+in the `area_layers` registry of create_shapefiles.py, and the matches are
+written to a Parquet membership table with one row per (community, area) pair.
+
+The table is rebuilt incrementally: each CSV and each layer is hashed, and only
+the (CSV, layer) pairs where either side changed since the last run are
+recomputed. The hashes are kept in a JSON state file next to the table.
+
+Example usage:
+    python community_area_membership.py
+    python community_area_membership.py --full
+"""
+
+import argparse
+import glob
+import json
+import os
+
+import pandas as pd
+
+from area_lookup import AreaLookup
+from create_shapefiles import area_layers, load_area_layers
+from hashing import hash_files, hash_layer
+
+membership_path = "all_places/community_area_membership.parquet"
+state_path = "all_places/community_area_membership_state.json"
+
+membership_columns = [
+    "community_id",
+    "type",
+    "area_type",
+    "area_id",
+    "area_name",
+    "source_file",
+    "layer",
+]
+
+
+def load_state():
+    """Load the CSV and layer hashes from the last run, or empty ones if there is none."""
+    if not os.path.exists(state_path) or not os.path.exists(membership_path):
+        return {"csvs": {}, "layers": {}}
+    with open(state_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_membership():
+    """Load the membership table from the last run, or an empty table if there is none."""
+    if not os.path.exists(membership_path):
+        return pd.DataFrame(columns=membership_columns)
+    return pd.read_parquet(membership_path)
+
+
+def compute_memberships(communities, file, layer_name, layer_gdf):
+    """Match the communities from one CSV against one area layer.
+
+    Args:
+        communities (pd.DataFrame): Point locations from one CSV
+        file (str): Name of the CSV file
+        layer_name (str): Name of the layer in `area_layers`
+        layer_gdf (gpd.GeoDataFrame): Prepared layer from `load_area_layer`
+    Returns:
+        pd.DataFrame: One row per (community, area) match with `membership_columns`
+    """
+    matches = AreaLookup(layer_gdf).lookup(
+        communities["latitude"], communities["longitude"]
+    )
+    return pd.DataFrame(
+        {
+            "community_id": communities["id"].to_numpy()[matches["point_index"]],
+            "type": matches["type"],
+            "area_type": matches["area_type"],
+            "area_id": matches["id"],
+            "area_name": matches["name"],
+            "source_file": file,
+            "layer": layer_name,
+        }
+    )
+
+
+def update_membership(layers=area_layers, full=False):
+    """Recompute the memberships of every (CSV, layer) pair that changed and write the membership table.
+
+    Args:
+        layers (list): Layer descriptions from `area_layers`
+        full (bool): Recompute every pair, ignoring the previous run
+    Returns:
+        pd.DataFrame: The full membership table
+    """
+    previous_state = {"csvs": {}, "layers": {}} if full else load_state()
+    csv_paths = {
+        os.path.basename(path): path
+        for path in sorted(glob.iglob("../vector_data/point/*.csv"))
+    }
+    state = {
+        "csvs": {file: hash_files([path]) for file, path in csv_paths.items()},
+        "layers": {layer["name"]: hash_layer(layer) for layer in layers},
+    }
+    changed_csvs = {
+        file
+        for file, file_hash in state["csvs"].items()
+        if previous_state["csvs"].get(file) != file_hash
+    }
+    changed_layers = {
+        name
+        for name, layer_hash in state["layers"].items()
+        if previous_state["layers"].get(name) != layer_hash
+    }
+
+    # keep the rows of pairs where neither side changed, and drop the rows of removed CSVs and layers
+    membership = load_membership()
+    keep = membership["source_file"].isin(
+        state["csvs"].keys() - changed_csvs
+    ) & membership["layer"].isin(state["layers"].keys() - changed_layers)
+    parts = [membership[keep]]
+
+    # a changed CSV needs every layer, otherwise only the changed layers are loaded
+    layers_to_load = [
+        layer for layer in layers if changed_csvs or layer["name"] in changed_layers
+    ]
+    communities = {}
+    for layer, layer_gdf in zip(layers_to_load, load_area_layers(layers_to_load)):
+        files = csv_paths if layer["name"] in changed_layers else sorted(changed_csvs)
+        for file in files:
+            if file not in communities:
+                communities[file] = pd.read_csv(
+                    csv_paths[file], usecols=["id", "latitude", "longitude"]
+                )
+            parts.append(
+                compute_memberships(communities[file], file, layer["name"], layer_gdf)
+            )
+        print(f"{layer['name']}: recomputed memberships for {len(files)} CSVs")
+
+    membership = (
+        pd.concat(parts, ignore_index=True)[membership_columns]
+        .sort_values(["community_id", "type", "area_type", "area_id"], kind="stable")
+        .reset_index(drop=True)
+    )
+    os.makedirs(os.path.dirname(membership_path), exist_ok=True)
+    membership.to_parquet(membership_path, index=False)
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    return membership
+
+
+def membership_lookup(path=membership_path):
+    """Load the membership table as a dictionary for constant time lookups.
+
+    Args:
+        path (str): Path to the membership table
+    Returns:
+        dict: Maps community id to a dict that maps area type to a list of area ids
+    """
+    membership = pd.read_parquet(path, columns=["community_id", "type", "area_id"])
+    lookup = {}
+    for community_id, area_type, area_id in membership.itertuples(
+        index=False, name=None
+    ):
+        lookup.setdefault(community_id, {}).setdefault(area_type, []).append(area_id)
+    return lookup
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Recompute every membership instead of only those of changed CSVs and layers.",
+    )
+    args = parser.parse_args()
+
+    membership = update_membership(full=args.full)
+    print(
+        f"Wrote {len(membership)} memberships of {membership['community_id'].nunique()} communities to {membership_path}"
+    )
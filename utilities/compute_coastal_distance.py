@@ -1,56 +1,320 @@
+import argparse
+import functools
+import hashlib
+import os
 from pathlib import Path
 
 import geopandas as gpd
 import pandas as pd
 import numpy as np
+import shapely
 from scipy.spatial import cKDTree
 
 from crs_lookup import crs_lookup
+from geodesy import ecef_to_lonlat, geodesic_distance_m, lonlat_to_ecef
+from parallel import run_in_process_pool
 
+coastline_path = Path(
+    "../vector_data/polygon/boundaries/natural_earth_global_coastlines/ne_10m_coastline.shp"
+)
 
-def calculate_coastal_distances(point_locations_path, projected_crs_code):
-    """
-    Calculate the distance of each point to the nearest coastline in kilometers.
+# flattened, projected coastline vertices are cached here as .npy files
+coastline_cache_dir = Path("coastline_cache")
 
-    Args:
-        point_locations_path (str): Path to the CSV file containing point locations.
-        projected_crs_code (int): The EPSG code of the projected coordinate reference system to use for the distance calculation.
+
+@functools.lru_cache(maxsize=None)
+def hash_coastline_file():
+    """
+    Hash the coastline shapefile so cached vertex arrays are rebuilt when the source changes.
 
     Returns:
-        pd.DataFrame: A DataFrame with the original data and a new or updated column for the distance to the coastline.
+        str: Hex digest of the coastline .shp file.
     """
-    communities_df = pd.read_csv(Path(point_locations_path))
-    geometry = gpd.points_from_xy(communities_df.longitude, communities_df.latitude)
-    communities_gdf = gpd.GeoDataFrame(
-        communities_df, geometry=geometry, crs="EPSG:4326"
-    )
-    # reproject to compute distances in projected space
-    projected_crs = f"EPSG:{projected_crs_code}"
-    communities_gdf = communities_gdf.to_crs(projected_crs)
+    digest = hashlib.sha256()
+    with open(coastline_path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    coast_gdf = gpd.read_file(
-        Path(
-            "../vector_data/polygon/boundaries/natural_earth_global_coastlines/ne_10m_coastline.shp"
-        )
-    )
+
+@functools.lru_cache(maxsize=None)
+def load_coastline():
+    """
+    Load the coastline and crop it to only include features between 40°N and 84°N.
+
+    Returns:
+        gpd.GeoDataFrame: The cropped coastline in EPSG:4326.
+    """
+    coast_gdf = gpd.read_file(coastline_path)
     # crop coastline to only include features between 40°N and 84°N, this is not strictly necessary but it does reduce the search space
     coast_gdf = coast_gdf[
         (coast_gdf.geometry.bounds.miny >= 40) & (coast_gdf.geometry.bounds.maxy <= 84)
     ]
-    coast_gdf = coast_gdf.to_crs(projected_crs)
+    return coast_gdf
+
 
+def get_cached_coastline_array(kind, projected_crs_code, build):
+    """
+    Get a coastline array in a projected CRS from the cache, building and caching it if needed.
+
+    Args:
+        kind (str): Name of the array, used in the cache file name (e.g. "vertices").
+        projected_crs_code (int): The EPSG code of the projected coordinate reference system.
+        build (callable): Function that takes the projected coastline GeoDataFrame and returns the array.
+
+    Returns:
+        np.ndarray: The cached array.
+    """
+    cache_path = (
+        coastline_cache_dir
+        / f"{coastline_path.stem}_{kind}_{projected_crs_code}_{hash_coastline_file()[:16]}.npy"
+    )
+    if cache_path.exists():
+        return np.load(cache_path)
+
+    coast_gdf = load_coastline().to_crs(f"EPSG:{projected_crs_code}")
+    array = build(coast_gdf)
+
+    os.makedirs(coastline_cache_dir, exist_ok=True)
+    # write to a temporary file first so an interrupted run never leaves a truncated cache file behind
+    tmp_path = cache_path.with_suffix(".tmp.npy")
+    np.save(tmp_path, array)
+    os.replace(tmp_path, cache_path)
+    return array
+
+
+def flatten_coastline_vertices(coast_gdf):
+    """
+    Flatten coastline geometries to an array of vertex coordinates.
+
+    Args:
+        coast_gdf (gpd.GeoDataFrame): Projected coastline.
+
+    Returns:
+        np.ndarray: Array of shape (n, 2) with the vertex coordinates.
+    """
     # convert coastline LineString geometries to array of coordinates, each LineString has numerous individual xy coordinates
-    coast_coords = coast_gdf.geometry.apply(lambda x: list(x.coords))
-    coast_coords = np.array([coord for coords in coast_coords for coord in coords])
-    coast_coords = np.array(list(coast_coords))
+    return shapely.get_coordinates(coast_gdf.geometry.values)
+
+
+def flatten_coastline_line_vertices(coast_gdf):
+    """
+    Flatten coastline geometries to an array of vertex coordinates with the index of the line each vertex belongs to.
+
+    Args:
+        coast_gdf (gpd.GeoDataFrame): Coastline.
+
+    Returns:
+        np.ndarray: Array of shape (n, 3) with the vertex coordinates and line index, consecutive vertices of the same line form a segment.
+    """
+    # explode so each part of a MultiLineString gets its own index and segments never bridge two parts
+    lines = coast_gdf.geometry.explode(index_parts=False).values
+    coords, line_index = shapely.get_coordinates(lines, return_index=True)
+    return np.column_stack([coords, line_index])
+
+
+def split_coastline_segments(coast_gdf):
+    """
+    Split coastline geometries into their individual two-vertex segments.
+
+    Args:
+        coast_gdf (gpd.GeoDataFrame): Projected coastline.
+
+    Returns:
+        np.ndarray: Array of shape (n, 4) with the (x0, y0, x1, y1) coordinates of each segment.
+    """
+    # explode so each part of a MultiLineString gets its own index and segments never bridge two parts
+    lines = coast_gdf.geometry.explode(index_parts=False).values
+    coords, line_index = shapely.get_coordinates(lines, return_index=True)
+    # consecutive vertices only form a segment if they belong to the same line
+    same_line = line_index[:-1] == line_index[1:]
+    return np.column_stack([coords[:-1][same_line], coords[1:][same_line]])
+
+
+def get_coastline_vertices(projected_crs_code):
+    """
+    Get the flattened coastline vertex coordinates in a projected CRS, reading them from the cache if possible.
+
+    Args:
+        projected_crs_code (int): The EPSG code of the projected coordinate reference system.
+
+    Returns:
+        np.ndarray: Array of shape (n, 2) with the projected coastline vertex coordinates.
+    """
+    return get_cached_coastline_array(
+        "vertices", projected_crs_code, flatten_coastline_vertices
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_coastline_tree(projected_crs_code):
+    """
+    Get the k-d tree of coastline vertices for a projected CRS, built once per process for each CRS.
+
+    Args:
+        projected_crs_code (int): The EPSG code of the projected coordinate reference system.
+
+    Returns:
+        scipy.spatial.cKDTree: Tree of the projected coastline vertex coordinates.
+    """
+    return cKDTree(get_coastline_vertices(projected_crs_code))
+
+
+@functools.lru_cache(maxsize=None)
+def get_coastline_segment_tree(projected_crs_code):
+    """
+    Get the STRtree of coastline segments for a projected CRS, built once per process for each CRS.
 
-    tree = cKDTree(coast_coords)
-    community_coords = np.array([(p.x, p.y) for p in communities_gdf.geometry])
-    # compute distances in meters and convert to km
-    distances, _ = tree.query(community_coords)
-    distances_km = (distances / 1000).round(1)
+    Each segment gets its own small bounding box, which prunes the nearest search far better than indexing whole coastline features.
 
-    communities_df["km_distance_to_ocean"] = distances_km
+    Args:
+        projected_crs_code (int): The EPSG code of the projected coordinate reference system.
+
+    Returns:
+        shapely.STRtree: Tree of the projected two-vertex coastline segments.
+    """
+    segments = get_cached_coastline_array(
+        "segments", projected_crs_code, split_coastline_segments
+    )
+    return shapely.STRtree(shapely.linestrings(segments.reshape(-1, 2, 2)))
+
+
+@functools.lru_cache(maxsize=None)
+def get_coastline_ecef_tree():
+    """
+    Get the k-d tree of coastline vertices in ECEF coordinates, built once per process.
+
+    This tree does not depend on a projected CRS, so a single tree serves every region.
+
+    Returns:
+        tuple: (scipy.spatial.cKDTree of the ECEF vertex coordinates, np.ndarray of shape (n, 3) with the ECEF vertex coordinates, np.ndarray with the line index of each vertex)
+    """
+    vertices = get_cached_coastline_array(
+        "line_vertices", 4326, flatten_coastline_line_vertices
+    )
+    ecef = lonlat_to_ecef(vertices[:, 0], vertices[:, 1])
+    return cKDTree(ecef), ecef, vertices[:, 2].astype("int64")
+
+
+def compute_geodesic_distances_m(communities_df, n_candidates=8):
+    """
+    Compute the ellipsoidal distance of each point to the nearest coastline segment in meters.
+
+    The nearest `n_candidates` vertices by straight-line ECEF distance are found with a k-d tree. The nearest point of each segment next to a candidate vertex is found on
+    the straight ECEF chord between its two vertices and moved to the ellipsoid surface, so sparse vertices along long segments don't overestimate the distance like the
+    vertex method does. The ellipsoidal distances to those points are computed for all points and candidates in a single batch. Like the segment method, only segments
+    that end at one of the nearest vertices are considered.
+
+    Args:
+        communities_df (pd.DataFrame): DataFrame with latitude and longitude columns.
+        n_candidates (int): Number of candidate vertices to refine for each point.
+
+    Returns:
+        np.ndarray: Distances in meters.
+    """
+    tree, coast_ecef, line_index = get_coastline_ecef_tree()
+    lons = communities_df.longitude.to_numpy(dtype="float64")
+    lats = communities_df.latitude.to_numpy(dtype="float64")
+    points = lonlat_to_ecef(lons, lats)
+    n_candidates = min(n_candidates, tree.n)
+    # passing k as a list keeps the output 2D even when k is 1
+    _, candidates = tree.query(points, k=list(range(1, n_candidates + 1)))
+
+    # the previous and next vertex of each candidate on the same line, or the candidate itself at the end of a line
+    ends = np.stack([candidates - 1, candidates + 1], axis=-1).clip(0, tree.n - 1)
+    ends = np.where(
+        line_index[ends] == line_index[candidates][..., None],
+        ends,
+        candidates[..., None],
+    )
+    # nearest point of each (candidate, end) segment, with the segments of shape (points, candidates, 2, 3)
+    start = coast_ecef[candidates][:, :, None, :]
+    segment = coast_ecef[ends] - start
+    offset = points[:, None, None, :] - start
+    length2 = (segment**2).sum(axis=-1)
+    fraction = np.divide(
+        (offset * segment).sum(axis=-1),
+        length2,
+        out=np.zeros_like(length2),
+        where=length2 > 0,
+    ).clip(0, 1)
+    nearest_lons, nearest_lats = ecef_to_lonlat(start + fraction[..., None] * segment)
+    distances = geodesic_distance_m(
+        lons[:, None, None], lats[:, None, None], nearest_lons, nearest_lats
+    )
+    return distances.min(axis=(1, 2))
+
+
+def project_community_coords(communities_df, projected_crs_code):
+    """
+    Project community latitudes and longitudes in a single call.
+
+    Args:
+        communities_df (pd.DataFrame): DataFrame with latitude and longitude columns.
+        projected_crs_code (int): The EPSG code of the projected coordinate reference system.
+
+    Returns:
+        np.ndarray: Array of shape (n, 2) with the projected coordinates.
+    """
+    geometry = gpd.points_from_xy(
+        communities_df.longitude, communities_df.latitude, crs="EPSG:4326"
+    )
+    return shapely.get_coordinates(geometry.to_crs(f"EPSG:{projected_crs_code}"))
+
+
+def compute_coastal_distances_km(communities_df, projected_crs_code, method="vertex"):
+    """
+    Compute the distance of each point to the nearest coastline in kilometers.
+
+    Args:
+        communities_df (pd.DataFrame): DataFrame with latitude and longitude columns.
+        projected_crs_code (int): The EPSG code of the projected coordinate reference system to use for the distance calculation.
+        method (str): "vertex" for the distance to the nearest coastline vertex, "segment" for the exact distance to the nearest coastline segment, or "geodesic" for the ellipsoidal distance to the nearest coastline segment (the projected CRS is not used).
+
+    Returns:
+        np.ndarray: Distances in kilometers rounded to one decimal place.
+    """
+    if method == "geodesic":
+        distances = compute_geodesic_distances_m(communities_df)
+        return (distances / 1000).round(1)
+
+    community_coords = project_community_coords(communities_df, projected_crs_code)
+    if method == "vertex":
+        tree = get_coastline_tree(projected_crs_code)
+        # compute distances in meters and convert to km
+        distances, _ = tree.query(community_coords)
+    elif method == "segment":
+        tree = get_coastline_segment_tree(projected_crs_code)
+        points = shapely.points(community_coords)
+        # exact point-to-segment distances for every point in one batch
+        (point_indices, _), segment_distances = tree.query_nearest(
+            points, return_distance=True, all_matches=False
+        )
+        distances = np.full(len(points), np.inf)
+        distances[point_indices] = segment_distances
+    else:
+        raise ValueError(f"Unknown coastal distance method: {method}")
+    return (distances / 1000).round(1)
+
+
+def calculate_coastal_distances(
+    point_locations_path, projected_crs_code, method="vertex"
+):
+    """
+    Calculate the distance of each point to the nearest coastline in kilometers.
+
+    Args:
+        point_locations_path (str): Path to the CSV file containing point locations.
+        projected_crs_code (int): The EPSG code of the projected coordinate reference system to use for the distance calculation.
+        method (str): "vertex", "segment", or "geodesic", see `compute_coastal_distances_km`.
+
+    Returns:
+        pd.DataFrame: A DataFrame with the original data and a new or updated column for the distance to the coastline.
+    """
+    communities_df = pd.read_csv(Path(point_locations_path))
+    communities_df["km_distance_to_ocean"] = compute_coastal_distances_km(
+        communities_df, projected_crs_code, method
+    )
     return communities_df
 
 
@@ -80,14 +344,61 @@ def write_to_csv(community_df, output_path):
     community_df.to_csv(output_path, index=False)
 
 
+def process_region(point_locations_path, method="vertex"):
+    """
+    Compute coastal distances and tags for one point location CSV and write it back in place.
+
+    Args:
+        point_locations_path (pathlib.Path): Path to the point location CSV.
+        method (str): "vertex", "segment", or "geodesic", see `compute_coastal_distances_km`.
+    """
+    # csv names are like newfoundland_and_labrador_point_locations.csv
+    region_name = point_locations_path.name.split("_point_locations")[0]
+    print(f"Processing {region_name}...")
+    communities_df = calculate_coastal_distances(
+        point_locations_path, crs_lookup[region_name], method
+    )
+    communities_df = add_coastal_tag(communities_df)
+    write_to_csv(communities_df, point_locations_path)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compute the distance to the nearest coastline and the coastal tag for every point location CSV."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of regions to process at the same time. Default is one per available core.",
+    )
+    parser.add_argument(
+        "--method",
+        type=str,
+        choices=["vertex", "segment", "geodesic"],
+        default="vertex",
+        help="Measure the distance to the nearest coastline vertex or the exact distance to the nearest coastline segment in each region's projected CRS, or the ellipsoidal distance to the nearest coastline segment without any projection. Default is vertex.",
+    )
+    args = parser.parse_args()
 
-    for point_locations_path in Path("../vector_data/point").glob("*.csv"):
-        # csv names are like newfoundland_and_labrador_point_locations.csv
-        region_name = point_locations_path.name.split("_point_locations")[0]
-        print(f"Processing {region_name}...")
-        communities_df = calculate_coastal_distances(
-            point_locations_path, crs_lookup[region_name]
-        )
-        communities_df = add_coastal_tag(communities_df)
-        write_to_csv(communities_df, point_locations_path)
+    point_locations_paths = sorted(Path("../vector_data/point").glob("*.csv"))
+    # build the coastline tree once per CRS up front, workers inherit the trees instead of rebuilding them for every region
+    if args.method == "geodesic":
+        # the geodesic method needs only one tree for every region
+        get_coastline_ecef_tree()
+    for projected_crs_code in sorted(
+        {
+            crs_lookup[path.name.split("_point_locations")[0]]
+            for path in point_locations_paths
+        }
+    ):
+        if args.method == "vertex":
+            get_coastline_tree(projected_crs_code)
+        elif args.method == "segment":
+            get_coastline_segment_tree(projected_crs_code)
+    run_in_process_pool(
+        functools.partial(process_region, method=args.method),
+        point_locations_paths,
+        workers=args.workers,
+        labels=[path.name for path in point_locations_paths],
+    )
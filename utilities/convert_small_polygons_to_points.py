@@ -2,23 +2,40 @@
 This script converts polygons smaller than 10 km² to points and adds them 
 to a points CSV file. This script exists because doing zonal statistics with small polygons and gridded datasets with coarse spatial resolutions is not useful. For example, if the grid spatial resolution is 4 km², then a 10 km² polygon will have a zonal mean computed from ~2 grid cell values. Instead, it is better to track these small polygons as points so they can be included in point queries.
 
+Areas are computed in the EPSG:6931 equal-area projection, and each small
+polygon becomes its representative point, which is always inside the polygon
+(a centroid can fall outside of concave or multipart polygons).
+
+Any number of polygon layers can be converted in one run. Without --points,
+the new points of a layer go to the points CSV of the layer's region, from the
+postal code prefix of the layer's file name (e.g. ak_protected_areas.shp goes
+to the CSV whose ids start with AK, yt_protected_areas.shp to the YT one).
+Layers without such a prefix need --points, and a CSV with points of more than
+one region (e.g. Norway) is never picked from a prefix, since the new points
+would all get the region of its first row. Nothing is written if any layer
+can't be routed. Each points CSV and each polygon layer is written only once.
+
 Example usage:
     python convert_small_polygons_to_points.py \
         --polygons ../vector_data/polygon/boundaries/protected_areas/bc_protected_areas/bc_protected_areas.shp \
         --points ../vector_data/point/british_columbia_point_locations.csv \
+
+    python convert_small_polygons_to_points.py \
+        --polygons ../vector_data/polygon/boundaries/protected_areas/*/*.shp
 """
 
 import argparse
+import glob
 from pathlib import Path
 
 import geopandas as gpd
 import pandas as pd
 
 # we want to import from add_point_location to make sure we have integrity with how points should be added
-from add_point_location import get_last_id_number_in_df, create_new_id, postal_di
-from crs_lookup import crs_lookup
-# reverse keys and values in postal_di
-postal_di = {v: k for k, v in postal_di.items()}
+from add_point_location import get_last_id_number_in_df, create_new_id
+
+# equal-area projection covering every region, so areas are in m² everywhere
+equal_area_crs = 6931
 
 
 def parse_arguments():
@@ -27,14 +44,15 @@ def parse_arguments():
     parser.add_argument(
         "--polygons",
         type=str,
+        nargs="+",
         required=True,
-        help="Path to input shapefile containing polygons",
+        help="Paths to input shapefiles containing polygons",
     )
     parser.add_argument(
         "--points",
         type=str,
-        required=True,
-        help="Path to points CSV to add new points to",
+        default=None,
+        help="Path to points CSV to add new points to (default: the CSV of each layer's region, from the prefix of its file name)",
     )
     parser.add_argument(
         "--max-area",
@@ -45,13 +63,9 @@ def parse_arguments():
     return parser.parse_args()
 
 
-def load_polygons(shapefile_path, proj_epsg):
-    """Load polygons from shapefile and ensure proper projection."""
-    gdf = gpd.read_file(shapefile_path)
-    # projected space for area calculation
-    if gdf.crs.is_geographic or gdf.crs.to_epsg() != proj_epsg:
-        gdf = gdf.to_crs(f"EPSG:{proj_epsg}")
-    return gdf
+def load_polygons(shapefile_path):
+    """Load polygons from shapefile, in their own CRS so the shapefile can be written back as it was."""
+    return gpd.read_file(shapefile_path)
 
 
 def load_points(csv_path):
@@ -60,64 +74,102 @@ def load_points(csv_path):
 
 
 def calculate_areas_and_filter(gdf, max_area_km2=10):
-    """Calculate areas and filter for polygons smaller than max_area_km2."""
-    # Add area calculation as a temporary column
-    gdf["_area_km2"] = gdf.geometry.area / 1_000_000  # Convert m² to km²
+    """Calculate areas in an equal-area projection and filter for polygons smaller than max_area_km2."""
+    areas_km2 = gdf.geometry.to_crs(equal_area_crs).area / 1_000_000  # Convert m² to km²
 
     # Filter but preserve all original columns
-    small_polygons = gdf[gdf["_area_km2"] < max_area_km2].copy()
-    large_polygons = gdf[gdf["_area_km2"] >= max_area_km2].copy()
-
-    # Remove temporary area column
-    small_polygons = small_polygons.drop(columns=["_area_km2"])
-    large_polygons = large_polygons.drop(columns=["_area_km2"])
+    small_polygons = gdf[areas_km2 < max_area_km2].copy()
+    large_polygons = gdf[areas_km2 >= max_area_km2].copy()
 
     return small_polygons, large_polygons
 
 
 def convert_to_points(small_polygons):
-    """Convert polygons to points using centroids."""
+    """Convert polygons to points using representative points, which are always inside the polygon."""
     points = small_polygons.copy()
-    points.geometry = points.geometry.centroid
+    points.geometry = points.geometry.representative_point()
     # Convert to WGS84 for lat/lon coordinates
     points = points.to_crs("EPSG:4326")
     return points
 
 
-def create_new_records(points_gdf, points_df):
+def load_all_points():
+    """Load the id and region of every point in every points CSV, with the CSV path in a file column."""
+    return pd.concat(
+        [
+            pd.read_csv(path, usecols=["id", "region"]).assign(file=path)
+            for path in sorted(glob.iglob("../vector_data/point/*.csv"))
+            # skip the backups that write_new_csv makes of the CSVs it overwrites
+            if not path.endswith("_DEPRECATED.csv")
+        ],
+        ignore_index=True,
+    )
+
 
+def get_layer_points_csv(polygons_path, all_points):
+    """Get the points CSV of a layer's region from the postal code prefix of its file name.
+
+    Args:
+        polygons_path (str): Path to the polygon layer, e.g. .../ak_protected_areas.shp
+        all_points (pd.DataFrame): Existing points from `load_all_points`
+    Returns:
+        str: Path to the points CSV whose ids start with the prefix
+    Raises:
+        ValueError: If no points CSV has the prefix, or the CSV has points of more than one region
+    """
+    prefix = Path(polygons_path).stem.split("_")[0].upper()
+    # every id of a points CSV has the same prefix
+    prefixes = all_points.groupby("file")["id"].first().str[:2]
+    files = prefixes.index[prefixes == prefix]
+    if not len(files):
+        raise ValueError(f"{polygons_path}: no points CSV has ids starting with {prefix}, pass --points")
+    regions = all_points.loc[all_points["file"] == files[0], "region"].unique()
+    # new points take the region of the first row, which is only right if every row has it
+    if len(regions) > 1:
+        raise ValueError(
+            f"{polygons_path}: {files[0]} has points of {len(regions)} regions ({', '.join(sorted(map(str, regions)))}), pass --points"
+        )
+    return files[0]
+
+
+def create_new_records(points_gdf, points_df):
+    """Create new point records as whole columns.
+
+    Args:
+        points_gdf (gpd.GeoDataFrame): New points in EPSG:4326 with a name column
+        points_df (pd.DataFrame): The points CSV the new points are added to
+    Returns:
+        pd.DataFrame: The new records
+    """
     # get the last ID number to start incrementing from, this is important so we don't muck up the existing IDs
     last_id = get_last_id_number_in_df(points_df)
 
     # point files are split by region and country, so we can just grab the first record
     region = points_df["region"].iloc[0]
     country = points_df["country"].iloc[0]
-    id_prefix = postal_di[region]
-
-    # create new records
-    new_records = []
-    for idx, row in points_gdf.iterrows():
-        new_id = create_new_id(id_prefix, last_id)
-
-        new_record = {
-            "id": new_id,
-            "name": row["name"],
+    # every id of a points CSV has the same prefix
+    id_prefix = points_df["id"].iloc[0][:2]
+
+    n_points = len(points_gdf)
+    new_df = pd.DataFrame(
+        {
+            "id": [create_new_id(id_prefix, last_id + i) for i in range(n_points)],
+            "name": points_gdf["name"].to_numpy(),
             "alt_name": None, # add manually on ad hoc basis later if needed
             "region": region,
             "country": country,
-            "latitude": round(row.geometry.y, 4),
-            "longitude": round(row.geometry.x, 4),
+            "latitude": points_gdf.geometry.y.round(4).to_numpy(),
+            "longitude": points_gdf.geometry.x.round(4).to_numpy(),
             "tags": None, # will be populated in tagging script
             "km_distance_to_ocean": None, # will be populated in coastal script
             "is_coastal": None, # will be populated in coastal script
             "ocean_lat1": None, # ocean coords will be populated in neighbor script
             "ocean_lon1": None, # ocean coords will be populated in neighbor script
-        }
-        new_records.append(new_record)
-        print(f"Adding {new_record['name']} as {new_id}")
-        last_id += 1
-
-    new_df = pd.DataFrame(new_records)
+        },
+        index=range(n_points),
+    )
+    for name, new_id in zip(new_df["name"], new_df["id"]):
+        print(f"Adding {name} as {new_id}")
     return new_df
 
 def merge_existing_and_new_points(existing_points, new_points):
@@ -144,23 +196,48 @@ def update_shapefile(filtered_polygons, shapefile_path):
 
 def main():
     args = parse_arguments()
-    
-    region_name = Path(args.points).name.split("_point_locations")[0]
-    existing_points = load_points(args.points)
-    proj_crs = crs_lookup[region_name]
-    polygons = load_polygons(args.polygons, proj_crs)
-
-    small_polygons, large_polygons = calculate_areas_and_filter(polygons, args.max_area)
-    
-    new_points = convert_to_points(small_polygons)
-    new_records = create_new_records(new_points, existing_points)
-    merged = merge_existing_and_new_points(existing_points, new_records)
-    
-    updated_polys = drop_small_polygons(polygons, small_polygons)
-    
-    write_new_csv(merged, args.points)
-    
-    update_shapefile(updated_polys, args.polygons)
+
+    # every layer is routed before anything is read or written, so an unroutable layer leaves all files as they were
+    if args.points:
+        routes = {polygons_path: args.points for polygons_path in args.polygons}
+    else:
+        all_points = load_all_points()
+        routes = {}
+        errors = []
+        for polygons_path in args.polygons:
+            try:
+                routes[polygons_path] = get_layer_points_csv(polygons_path, all_points)
+            except ValueError as e:
+                errors.append(str(e))
+        if errors:
+            print("\n".join(errors))
+            raise SystemExit("No files were written. Program exiting.")
+
+    # every layer is read and split once, the new points of all layers are added together
+    layers = {}
+    new_points = []
+    for polygons_path in args.polygons:
+        polygons = load_polygons(polygons_path)
+        small_polygons, large_polygons = calculate_areas_and_filter(polygons, args.max_area)
+        layers[polygons_path] = (polygons, small_polygons)
+        layer_points = convert_to_points(small_polygons)[["name", "geometry"]]
+        layer_points["file"] = routes[polygons_path]
+        new_points.append(layer_points)
+        print(f"{polygons_path}: {len(small_polygons)} of {len(polygons)} polygons are smaller than {args.max_area} km²")
+    new_points = pd.concat(new_points, ignore_index=True)
+
+    # each points CSV is read and written once, so ids are allocated in one pass per CSV
+    for csv_path, file_points in new_points.groupby("file", sort=True):
+        existing_points = load_points(csv_path)
+        new_records = create_new_records(file_points, existing_points)
+        merged = merge_existing_and_new_points(existing_points, new_records)
+        write_new_csv(merged, csv_path)
+        print(f"{csv_path}: added {len(new_records)} points")
+
+    for polygons_path, (polygons, small_polygons) in layers.items():
+        if len(small_polygons):
+            updated_polys = drop_small_polygons(polygons, small_polygons)
+            update_shapefile(updated_polys, polygons_path)
 
     print(f"Converted {len(new_points)} small polygons to points")
 
@@ -2,41 +2,146 @@
 # This script creates new versions of the GeoServer shapefiles called
 # 'all_boundaries:all_communities' and 'all_boundaries:all_areas' on
 # https://gs.mapventure.org/geoserver.
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import Point
-from pathlib import Path
+
+from masks import load_mask
 import glob
 import os
 
-# Load the IEM AOI mask
-mask_gdf = gpd.read_file(
+# IEM AOI mask used to filter the layers flagged with "within_mask"
+mask_path = (
     "../vector_data/polygon/boundaries/iem_with_ak_aleutians/iem_with_ak_aleutians.shp"
 )
-mask_gdf.to_crs(4326, inplace=True)
 
-# Load community point geometries and set CRS
-communities = pd.concat(
-    [pd.read_csv(csv) for csv in glob.iglob("../vector_data/point/*.csv")]
-)
-community_geometries = [
-    Point(xy) for xy in zip(communities["longitude"], communities["latitude"])
+# Polygon layers merged into all_areas, in output order. Each layer gets a
+# "type" column, and an "area_type" column if one is given here. Layers with
+# "within_mask" only keep the features within the IEM AOI. Layers with
+# "overlapping" have features that are expected to overlap, so they are not
+# treated as a polygon coverage. The "drop_columns" of a layer default to the
+# module level drop_columns.
+area_layers = [
+    {
+        "name": "huc8s",
+        "path": "../vector_data/polygon/boundaries/alaska_hucs/ak_huc8s.shp",
+        "type": "huc",
+        "area_type": "HUC8",
+    },
+    {
+        "name": "huc10s",
+        "path": "../vector_data/polygon/boundaries/alaska_hucs/ak_huc10s.shp",
+        "type": "huc",
+        "area_type": "HUC10",
+    },
+    {
+        "name": "huc12s",
+        "path": "../vector_data/polygon/boundaries/alaska_hucs/ak_huc12s.shp",
+        "type": "huc",
+        "area_type": "HUC12",
+    },
+    {
+        "name": "yt_watersheds",
+        "path": "../vector_data/polygon/boundaries/yt_watersheds/yt_watersheds4326.shp",
+        "type": "yt_watershed",
+        "area_type": "Yukon Watershed",
+    },
+    {
+        "name": "boroughs",
+        "path": "../vector_data/polygon/boundaries/boroughs/ak_boroughs.shp",
+        "type": "borough",
+    },
+    {
+        "name": "census",
+        "path": "../vector_data/polygon/boundaries/census_areas/ak_census_areas.shp",
+        "type": "census_area",
+    },
+    {
+        "name": "climdiv",
+        "path": "../vector_data/polygon/boundaries/climate_divisions/ak_climate_divisions.shp",
+        "type": "climate_division",
+    },
+    {
+        "name": "corp",
+        "path": "../vector_data/polygon/boundaries/corporation/ak_native_corporations.shp",
+        "type": "corporation",
+    },
+    {
+        "name": "ethno",
+        "path": "../vector_data/polygon/boundaries/ethnolinguistic/ethnolinguistic_regions.shp",
+        "type": "ethnolinguistic_region",
+    },
+    {
+        "name": "ak_fire",
+        "path": "../vector_data/polygon/boundaries/fire/ak_fire_mgmt/ak_fire_management.shp",
+        "type": "fire_zone",
+    },
+    {
+        "name": "yt_fire",
+        "path": "../vector_data/polygon/boundaries/fire/yt_fire_mgmt/yt_fire_management_4326.shp",
+        "type": "yt_fire_district",
+        "area_type": "Yukon Fire District",
+    },
+    {
+        "name": "first_nations",
+        "path": "../vector_data/polygon/boundaries/first_nations/first_nation_traditional_territories.shp",
+        "type": "first_nation",
+        "overlapping": True,
+    },
+    {
+        "name": "ak_gmu",
+        "path": "../vector_data/polygon/boundaries/game_management_units/ak_gmus/ak_gmu.shp",
+        "type": "game_management_unit",
+    },
+    {
+        "name": "yt_gmsz",
+        "path": "../vector_data/polygon/boundaries/game_management_units/yt_gmzs/yt_game_management_zones4326.shp",
+        "type": "yt_game_management_subzone",
+        "area_type": "Yukon Game Management Subzone",
+    },
+    {
+        "name": "ak_protected_areas",
+        "path": "../vector_data/polygon/boundaries/protected_areas/ak_protected_areas/ak_protected_areas.shp",
+        "type": "protected_area",
+        "overlapping": True,
+    },
+    # Only keep British Columbia & Yukon Territory protected areas
+    # within the IEM AOI.
+    {
+        "name": "bc_protected_areas",
+        "path": "../vector_data/polygon/boundaries/protected_areas/bc_protected_areas/bc_protected_areas.shp",
+        "type": "protected_area",
+        "within_mask": True,
+        "overlapping": True,
+    },
+    {
+        "name": "yt_protected_areas",
+        "path": "../vector_data/polygon/boundaries/protected_areas/yt_protected_areas/yt_protected_areas.shp",
+        "type": "protected_area",
+        "within_mask": True,
+        "overlapping": True,
+    },
+    {
+        "name": "ecoregions",
+        "path": "../vector_data/polygon/boundaries/ecoregions/ecoregions.shp",
+        "type": "ecoregion",
+    },
 ]
-communities = gpd.GeoDataFrame(communities, geometry=community_geometries)
-communities["type"] = "community"
 
-# Reindex combined CSV dataframe so each row has a unique index. This is
-# necessary so that dropping a row doesn't accidentally drop other rows.
-communities = communities.reset_index(drop=True)
+# Unused metadata dropped from the area layers
+drop_columns = ["region", "country", "states", "FIPS", "agency", "subunit", "sublabel"]
 
-# Remove Attu as it wraps over dateline and has no relevant data
-attu = communities.loc[communities["name"] == "Attu"]
-communities = communities.drop(attu.index)
+# Output formats written by --formats. GeoParquet and FlatGeobuf keep the full
+# column names and support bbox-filtered reads.
+output_formats = {"shp": ".shp", "parquet": ".parquet", "fgb": ".fgb"}
 
-# Renames column because ESRI Shapefiles have a hard limit of 10 characters
-# for column names.
-communities = communities.rename(columns={"km_distance_to_ocean": "km2ocean"})
-communities.set_crs(4326, inplace=True)
+# GeoParquet rows are sorted along a Hilbert curve and written in small row
+# groups, so each row group's bbox statistics cover a compact area and readers
+# can skip the row groups outside of a query bbox.
+parquet_row_group_size = 1024
 
 schema = {
     "geometry": "Point",
@@ -59,161 +164,171 @@ schema = {
     "X_PRECISION": 4,
 }
 
-# Write result to shapefile
-os.makedirs("all_places", exist_ok=True)
-communities.to_file(
-    "all_places/all_communities.shp",
-    engine="fiona",
-    driver="ESRI Shapefile",
-    encoding="utf-8",
-    schema=schema,
-)
 
-# Generate concatenated multipolygon shapefile for all other areas
-huc8s = gpd.read_file("../vector_data/polygon/boundaries/alaska_hucs/ak_huc8s.shp")
-huc8s["type"] = "huc"
-huc8s["area_type"] = "HUC8"
+def load_communities():
+    """Load community point geometries from every point location CSV.
 
-huc10s = gpd.read_file("../vector_data/polygon/boundaries/alaska_hucs/ak_huc10s.shp")
-huc10s["type"] = "huc"
-huc10s["area_type"] = "HUC10"
+    Returns:
+        gpd.GeoDataFrame: All communities except Attu, in EPSG:4326.
+    """
+    communities = pd.concat(
+        [pd.read_csv(csv) for csv in glob.iglob("../vector_data/point/*.csv")]
+    )
+    community_geometries = [
+        Point(xy) for xy in zip(communities["longitude"], communities["latitude"])
+    ]
+    communities = gpd.GeoDataFrame(communities, geometry=community_geometries)
+    communities["type"] = "community"
 
-huc12s = gpd.read_file("../vector_data/polygon/boundaries/alaska_hucs/ak_huc12s.shp")
-huc12s["type"] = "huc"
-huc12s["area_type"] = "HUC12"
+    # Reindex combined CSV dataframe so each row has a unique index. This is
+    # necessary so that dropping a row doesn't accidentally drop other rows.
+    communities = communities.reset_index(drop=True)
 
-yt_watersheds = gpd.read_file(
-    "../vector_data/polygon/boundaries/yt_watersheds/yt_watersheds4326.shp"
-)
-yt_watersheds["type"] = "yt_watershed"
-yt_watersheds["area_type"] = "Yukon Watershed"
+    # Remove Attu as it wraps over dateline and has no relevant data
+    attu = communities.loc[communities["name"] == "Attu"]
+    communities = communities.drop(attu.index)
+    communities.set_crs(4326, inplace=True)
+    return communities
 
-boroughs = gpd.read_file("../vector_data/polygon/boundaries/boroughs/ak_boroughs.shp")
-boroughs["type"] = "borough"
 
-census = gpd.read_file(
-    "../vector_data/polygon/boundaries/census_areas/ak_census_areas.shp"
-)
-census["type"] = "census_area"
+def write_communities_shapefile(communities):
+    """Write the communities to all_places/all_communities.shp."""
+    # Renames column because ESRI Shapefiles have a hard limit of 10 characters
+    # for column names.
+    communities = communities.rename(columns={"km_distance_to_ocean": "km2ocean"})
+    os.makedirs("all_places", exist_ok=True)
+    communities.to_file(
+        "all_places/all_communities.shp",
+        engine="fiona",
+        driver="ESRI Shapefile",
+        encoding="utf-8",
+        schema=schema,
+    )
 
-climdiv = gpd.read_file(
-    "../vector_data/polygon/boundaries/climate_divisions/ak_climate_divisions.shp"
-)
-climdiv["type"] = "climate_division"
 
-corp = gpd.read_file(
-    "../vector_data/polygon/boundaries/corporation/ak_native_corporations.shp"
-)
-corp["type"] = "corporation"
+def write_geoparquet(gdf, path):
+    """Write a GeoDataFrame to GeoParquet with a bbox covering column and Hilbert sorted row groups.
 
-ethno = gpd.read_file(
-    "../vector_data/polygon/boundaries/ethnolinguistic/ethnolinguistic_regions.shp"
-)
-ethno["type"] = "ethnolinguistic_region"
+    Args:
+        gdf (gpd.GeoDataFrame): Features to write
+        path (str): Output .parquet path
+    """
+    gdf = gdf.iloc[gdf.geometry.hilbert_distance().argsort(kind="stable")]
+    gdf.to_parquet(
+        path,
+        index=False,
+        write_covering_bbox=True,
+        row_group_size=parquet_row_group_size,
+    )
 
-ak_fire = gpd.read_file(
-    "../vector_data/polygon/boundaries/fire/ak_fire_mgmt/ak_fire_management.shp"
-)
-ak_fire["type"] = "fire_zone"
 
-yt_fire = gpd.read_file(
-    "../vector_data/polygon/boundaries/fire/yt_fire_mgmt/yt_fire_management_4326.shp"
-)
-yt_fire["type"] = "yt_fire_district"
-yt_fire["area_type"] = "Yukon Fire District"
+def write_flatgeobuf(gdf, path):
+    """Write a GeoDataFrame to FlatGeobuf with its packed Hilbert R-tree spatial index.
 
-first_nations = gpd.read_file(
-    "../vector_data/polygon/boundaries/first_nations/first_nation_traditional_territories.shp"
-)
-first_nations["type"] = "first_nation"
+    Args:
+        gdf (gpd.GeoDataFrame): Features to write
+        path (str): Output .fgb path
+    """
+    gdf.to_file(
+        path,
+        driver="FlatGeobuf",
+        engine="pyogrio",
+        index=False,
+        SPATIAL_INDEX="YES",
+    )
 
-ak_gmu = gpd.read_file(
-    "../vector_data/polygon/boundaries/game_management_units/ak_gmus/ak_gmu.shp"
-)
-ak_gmu["type"] = "game_management_unit"
 
-yt_gmsz = gpd.read_file(
-    "../vector_data/polygon/boundaries/game_management_units/yt_gmzs/yt_game_management_zones4326.shp"
-)
-yt_gmsz["type"] = "yt_game_management_subzone"
-yt_gmsz["area_type"] = "Yukon Game Management Subzone"
+def write_outputs(gdf, name, write_shapefile, formats):
+    """Write a GeoDataFrame to all_places/<name> in every requested format.
 
-ak_protected_areas = gpd.read_file(
-    "../vector_data/polygon/boundaries/protected_areas/ak_protected_areas/ak_protected_areas.shp"
-)
-ak_protected_areas["type"] = "protected_area"
-bc_protected_areas = gpd.read_file(
-    "../vector_data/polygon/boundaries/protected_areas/bc_protected_areas/bc_protected_areas.shp"
-)
-bc_protected_areas["type"] = "protected_area"
-yt_protected_areas = gpd.read_file(
-    "../vector_data/polygon/boundaries/protected_areas/yt_protected_areas/yt_protected_areas.shp"
-)
-yt_protected_areas["type"] = "protected_area"
-ecoregions = gpd.read_file(
-    "../vector_data/polygon/boundaries/ecoregions/ecoregions.shp"
-)
-ecoregions["type"] = "ecoregion"
-
-for gdf in [
-    huc8s,
-    huc10s,
-    huc12s,
-    yt_watersheds,
-    boroughs,
-    census,
-    climdiv,
-    corp,
-    ethno,
-    ak_fire,
-    yt_fire,
-    first_nations,
-    ak_gmu,
-    yt_gmsz,
-    ak_protected_areas,
-    bc_protected_areas,
-    yt_protected_areas,
-    ecoregions,
-]:
+    Args:
+        gdf (gpd.GeoDataFrame): Features to write
+        name (str): Output file name without extension
+        write_shapefile (callable): Function that writes gdf to the GeoServer shapefile
+        formats (list): Keys of `output_formats`
+    """
+    os.makedirs("all_places", exist_ok=True)
+    for output_format in formats:
+        if output_format == "shp":
+            write_shapefile(gdf)
+        elif output_format == "parquet":
+            write_geoparquet(gdf, f"all_places/{name}.parquet")
+        elif output_format == "fgb":
+            write_flatgeobuf(gdf, f"all_places/{name}.fgb")
+
+
+def load_area_layer(layer, mask=None):
+    """Read one area layer, tag it with its type, and reproject it to EPSG:4326.
+
+    Args:
+        layer (dict): Layer description from `area_layers`
+        mask (masks.Mask): IEM AOI mask in EPSG:4326, required for layers with "within_mask"
+    Returns:
+        gpd.GeoDataFrame: The prepared layer
+    """
+    gdf = gpd.read_file(layer["path"])
+    gdf["type"] = layer["type"]
+    if "area_type" in layer:
+        gdf["area_type"] = layer["area_type"]
     if gdf.crs != "EPSG:4326":
         gdf.to_crs(4326, inplace=True)
+    if layer.get("within_mask"):
+        gdf = gdf[mask.within(gdf.geometry.values)]
+    columns = layer.get("drop_columns", drop_columns)
+    return gdf.drop(columns=[col for col in columns if col in gdf.columns])
 
-# Only keep British Columbia & Yukon Territory protected areas
-# within the IEM AOI.
-bc_protected_areas = bc_protected_areas[
-    bc_protected_areas.within(mask_gdf.geometry.unary_union)
-]
-yt_protected_areas = yt_protected_areas[
-    yt_protected_areas.within(mask_gdf.geometry.unary_union)
-]
 
-# Merge all of the areas into a single Pandas data frame
-merged = pd.concat(
-    [
-        huc8s,
-        huc10s,
-        huc12s,
-        yt_watersheds,
-        boroughs,
-        census,
-        climdiv,
-        corp,
-        ethno,
-        ak_fire,
-        yt_fire,
-        first_nations,
-        ak_gmu,
-        yt_gmsz,
-        ak_protected_areas,
-        bc_protected_areas,
-        yt_protected_areas,
-        ecoregions,
-    ]
-)
+def load_area_layers(layers=area_layers, workers=None):
+    """Read area layers concurrently, each worker reprojecting its own layer.
 
-# Drops all unused metadata from the areas
-merged = merged.drop(
-    columns=["region", "country", "states", "FIPS", "agency", "subunit", "sublabel"]
-)
+    Reading and reprojecting mostly happen outside of the GIL, so threads are enough to overlap them and the wall time is bounded by the largest layer rather than the sum of all of them.
+
+    Args:
+        layers (list): Layer descriptions from `area_layers`
+        workers (int): Number of layers to load at the same time, defaults to one per layer
+    Returns:
+        list: Prepared GeoDataFrames in the same order as layers
+    """
+    # the mask is only read and unioned once, and shared by every layer that needs it
+    mask = None
+    if any(layer.get("within_mask") for layer in layers):
+        mask = load_mask(mask_path)
+    with ThreadPoolExecutor(max_workers=workers or max(len(layers), 1)) as executor:
+        return list(executor.map(lambda layer: load_area_layer(layer, mask), layers))
+
+
+def write_areas_shapefile(merged):
+    """Write the merged areas to all_places/all_areas.shp."""
+    os.makedirs("all_places", exist_ok=True)
+    merged.to_file("all_places/all_areas.shp", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Create the all_communities and all_areas shapefiles for GeoServer."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of area layers to read at the same time. Default is all of them.",
+    )
+    parser.add_argument(
+        "--formats",
+        type=str,
+        nargs="+",
+        choices=list(output_formats),
+        default=["shp"],
+        help="Output formats to write to all_places. Default is shp (the GeoServer shapefiles).",
+    )
+    args = parser.parse_args()
+
+    # Write result to shapefile
+    write_outputs(
+        load_communities(), "all_communities", write_communities_shapefile, args.formats
+    )
 
-merged.to_file("all_places/all_areas.shp", encoding="utf-8")
+    # Generate concatenated multipolygon shapefile for all other areas
+    # Merge all of the areas into a single Pandas data frame
+    merged = pd.concat(load_area_layers(workers=args.workers))
+    write_outputs(merged, "all_areas", write_areas_shapefile, args.formats)
@@ -0,0 +1,396 @@
+"""
+Pre-cut Mapbox Vector Tiles (MVT) of the communities and of every layer in the
+`area_layers` registry of create_shapefiles.py, and pack them into a single
+MBTiles archive, so web maps can fetch static tiles instead of having
+GeoServer rasterize and clip all_areas on every request.
+
+Each source (the communities, and each area layer) is cut into its own set of
+uncompressed tiles with GDAL's MVT driver, across a process pool, and cached in
+tile_cache under a hash of the source files and the zoom range. Only sources
+that changed since the last run are cut again. The tiles of every source are
+then merged per tile (MVT tiles concatenate into a valid multi-layer tile),
+gzipped, and written to the archive, one MVT layer per source. Tiles whose
+contributing sources didn't change are left as they are in the archive.
+
+Run with --verify to decode every layer back from the archive at its maximum
+zoom and check that every feature id of its source made it into the tiles, and
+that the extent of each decoded feature matches the extent of its source
+feature within the precision of the tiles (two tile pixels at the maximum
+zoom).
+
+Example usage:
+    python create_vector_tiles.py
+    python create_vector_tiles.py --minzoom 0 --maxzoom 10 --workers 8 --verify
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pyogrio
+
+from create_shapefiles import area_layers, load_area_layer, load_communities, mask_path
+from hashing import hash_files, hash_layer
+from masks import load_mask
+from parallel import run_in_process_pool
+
+tile_cache_dir = Path("tile_cache")
+archive_path = "all_places/all_boundaries.mbtiles"
+# width of the web mercator world in meters, and the number of pixels across an MVT tile written by GDAL
+web_mercator_width_m = 2 * np.pi * 6378137
+tile_extent = 4096
+# decoded extents can differ from the source by this many tile pixels, from the coordinate quantization
+extent_tolerance_pixels = 2
+
+
+def get_tile_sources(layers=area_layers):
+    """List the tile sources, the communities followed by every area layer.
+
+    Args:
+        layers (list): Layer descriptions from `area_layers`
+    Returns:
+        list: Dicts with the MVT layer "name", the registry "layer" (None for the communities), and a "hash" of the source files
+    """
+    community_csvs = sorted(Path("../vector_data/point").glob("*.csv"))
+    sources = [
+        {"name": "communities", "layer": None, "hash": hash_files(community_csvs)}
+    ]
+    for layer in layers:
+        sources.append(
+            {"name": layer["name"], "layer": layer, "hash": hash_layer(layer)}
+        )
+    return sources
+
+
+def get_tile_dir(source, minzoom, maxzoom):
+    """Get the cache directory of a source's tiles for a zoom range."""
+    return tile_cache_dir / f"{source['name']}_z{minzoom}-{maxzoom}_{source['hash']}"
+
+
+def cut_tiles(job):
+    """Cut one source into uncompressed MVT tiles in its cache directory.
+
+    Args:
+        job (dict): Tile source from `get_tile_sources` with "minzoom" and "maxzoom"
+    """
+    if job["layer"] is None:
+        gdf = load_communities()
+    else:
+        mask = load_mask(mask_path) if job["layer"].get("within_mask") else None
+        gdf = load_area_layer(job["layer"], mask)
+
+    tile_dir = get_tile_dir(job, job["minzoom"], job["maxzoom"])
+    # cut into a temporary directory first so an interrupted run never leaves a partial tile set behind
+    tmp_dir = tile_dir.with_name(tile_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.parent.mkdir(parents=True, exist_ok=True)
+    pyogrio.write_dataframe(
+        gdf,
+        str(tmp_dir),
+        driver="MVT",
+        layer=job["name"],
+        dataset_options={
+            "NAME": job["name"],
+            "MINZOOM": job["minzoom"],
+            "MAXZOOM": job["maxzoom"],
+            "FORMAT": "DIRECTORY",
+            # tiles are gzipped once they are merged into the archive
+            "COMPRESS": "NO",
+        },
+    )
+    # the source ids and extents are kept to check the decoded tiles against with --verify
+    with open(tmp_dir / "ids.json", "w", encoding="utf-8") as f:
+        json.dump(sorted(gdf["id"].astype(str).unique().tolist()), f)
+    with open(tmp_dir / "extents.json", "w", encoding="utf-8") as f:
+        json.dump(get_extents(gdf.to_crs(3857)), f)
+    os.replace(tmp_dir, tile_dir)
+    print(f"Cut {sum(1 for _ in tile_dir.glob('*/*/*.pbf'))} tiles")
+
+
+def get_extents(gdf):
+    """Get the extent of the features of every id.
+
+    Args:
+        gdf (gpd.GeoDataFrame): Features with an id column, features split over several tiles share their id
+    Returns:
+        dict: Maps each id to its [minx, miny, maxx, maxy] in the CRS of gdf
+    """
+    bounds = gdf.geometry.bounds.groupby(gdf["id"].astype(str).to_numpy())
+    extents = bounds.agg({"minx": "min", "miny": "min", "maxx": "max", "maxy": "max"})
+    return {
+        feature_id: [float(value) for value in row]
+        for feature_id, row in zip(extents.index, extents.to_numpy())
+    }
+
+
+def verify_extents(source_extents, decoded_extents, maxzoom):
+    """Find the ids whose decoded extent differs from their source extent by more than `extent_tolerance_pixels`.
+
+    Args:
+        source_extents (dict): Extents of the source features in EPSG:3857, from `get_extents`
+        decoded_extents (dict): Extents of the decoded features in EPSG:3857, from `get_extents`
+        maxzoom (int): Zoom level the features were decoded at
+    Returns:
+        list: Ids whose extents differ, sorted
+    """
+    tolerance = (
+        extent_tolerance_pixels * web_mercator_width_m / 2**maxzoom / tile_extent
+    )
+    ids = sorted(set(source_extents) & set(decoded_extents))
+    if not ids:
+        return []
+    source = np.array([source_extents[feature_id] for feature_id in ids])
+    decoded = np.array([decoded_extents[feature_id] for feature_id in ids])
+    differs = (np.abs(source - decoded) > tolerance).any(axis=1)
+    return [feature_id for feature_id, bad in zip(ids, differs) if bad]
+
+
+def list_tiles(tile_dir):
+    """Map each (zoom, x, y) tile in a cache directory to its file."""
+    tiles = {}
+    for path in tile_dir.glob("*/*/*.pbf"):
+        tiles[(int(path.parent.parent.name), int(path.parent.name), int(path.stem))] = (
+            path
+        )
+    return tiles
+
+
+def open_archive(path, minzoom, maxzoom):
+    """Open the MBTiles archive, starting a new one if there is none or it has a different zoom range.
+
+    Besides the standard metadata and tiles tables, the archive has a tile_sources table with the cache directories that each tile was merged from, so unchanged tiles can be skipped on later runs.
+
+    Args:
+        path (str): Path to the .mbtiles archive
+        minzoom (int): Minimum zoom level
+        maxzoom (int): Maximum zoom level
+    Returns:
+        sqlite3.Connection: Connection to the archive
+    """
+    if os.path.exists(path):
+        connection = sqlite3.connect(path)
+        zooms = dict(
+            connection.execute(
+                "SELECT name, value FROM metadata WHERE name IN ('minzoom', 'maxzoom')"
+            ).fetchall()
+        )
+        if zooms == {"minzoom": str(minzoom), "maxzoom": str(maxzoom)}:
+            return connection
+        connection.close()
+        os.remove(path)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE metadata (name TEXT, value TEXT);
+        CREATE UNIQUE INDEX metadata_index ON metadata (name);
+        CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+        CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+        CREATE TABLE tile_sources (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, sources TEXT);
+        CREATE UNIQUE INDEX tile_sources_index ON tile_sources (zoom_level, tile_column, tile_row);
+        """)
+    return connection
+
+
+def build_metadata(tile_dirs, minzoom, maxzoom):
+    """Merge the GDAL metadata.json of every source into the MBTiles metadata.
+
+    Args:
+        tile_dirs (list): Cache directories of every source
+        minzoom (int): Minimum zoom level
+        maxzoom (int): Maximum zoom level
+    Returns:
+        dict: MBTiles metadata names and values
+    """
+    vector_layers = []
+    bounds = [180.0, 90.0, -180.0, -90.0]
+    for tile_dir in tile_dirs:
+        with open(tile_dir / "metadata.json", encoding="utf-8") as f:
+            metadata = json.load(f)
+        vector_layers.extend(json.loads(metadata["json"])["vector_layers"])
+        west, south, east, north = map(float, metadata["bounds"].split(","))
+        bounds = [
+            min(bounds[0], west),
+            min(bounds[1], south),
+            max(bounds[2], east),
+            max(bounds[3], north),
+        ]
+    return {
+        "name": "all_boundaries",
+        "description": "SNAP communities and areas",
+        "type": "overlay",
+        "version": "1",
+        "format": "pbf",
+        "minzoom": str(minzoom),
+        "maxzoom": str(maxzoom),
+        "bounds": ",".join(f"{b:.6f}" for b in bounds),
+        "center": f"{(bounds[0] + bounds[2]) / 2:.6f},{(bounds[1] + bounds[3]) / 2:.6f},{minzoom}",
+        "json": json.dumps({"vector_layers": vector_layers}),
+    }
+
+
+def write_archive(tile_dirs, minzoom, maxzoom, path=archive_path):
+    """Merge the cached tiles of every source into the MBTiles archive, only rewriting tiles whose sources changed.
+
+    Args:
+        tile_dirs (list): Cache directories of every source, in MVT layer order
+        minzoom (int): Minimum zoom level
+        maxzoom (int): Maximum zoom level
+        path (str): Path to the .mbtiles archive
+    Returns:
+        tuple: (number of tiles written or deleted, total number of tiles)
+    """
+    tiles_per_dir = [list_tiles(tile_dir) for tile_dir in tile_dirs]
+    sources = {}
+    for tile_dir, tiles in zip(tile_dirs, tiles_per_dir):
+        for key in tiles:
+            sources.setdefault(key, []).append(tile_dir.name)
+
+    connection = open_archive(path, minzoom, maxzoom)
+    previous = {
+        # MBTiles rows are numbered from the bottom (TMS), the cache directories from the top (XYZ)
+        (z, x, (1 << z) - 1 - row): value
+        for z, x, row, value in connection.execute(
+            "SELECT zoom_level, tile_column, tile_row, sources FROM tile_sources"
+        )
+    }
+    changed = 0
+    with connection:
+        for key in previous.keys() - sources.keys():
+            z, x, y = key
+            for table in ["tiles", "tile_sources"]:
+                connection.execute(
+                    f"DELETE FROM {table} WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                    (z, x, (1 << z) - 1 - y),
+                )
+            changed += 1
+        for key, names in sources.items():
+            value = ",".join(names)
+            if previous.get(key) == value:
+                continue
+            z, x, y = key
+            # MVT is a protobuf message with a repeated layers field, so the tiles of the sources concatenate into one tile with all of their layers
+            data = b"".join(
+                tiles[key].read_bytes() for tiles in tiles_per_dir if key in tiles
+            )
+            row = (z, x, (1 << z) - 1 - y)
+            connection.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                row + (gzip.compress(data),),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO tile_sources VALUES (?, ?, ?, ?)",
+                row + (value,),
+            )
+            changed += 1
+        for name, value in build_metadata(tile_dirs, minzoom, maxzoom).items():
+            connection.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?)", (name, value)
+            )
+    connection.close()
+    return changed, len(sources)
+
+
+def remove_stale_tile_dirs(tile_dirs):
+    """Remove cached tile sets of the same sources that were cut from older versions or for other zoom ranges."""
+    current = {tile_dir.name for tile_dir in tile_dirs}
+    names = {tile_dir.name.rsplit("_z", 1)[0] for tile_dir in tile_dirs}
+    for tile_dir in tile_cache_dir.iterdir():
+        if tile_dir.name not in current and tile_dir.name.rsplit("_z", 1)[0] in names:
+            shutil.rmtree(tile_dir)
+
+
+def verify_archive(tile_dirs, path=archive_path):
+    """Decode every layer from the archive at its maximum zoom and check it against its source.
+
+    Every id of the source must be decoded, and the extent of each decoded feature must match its source extent within `extent_tolerance_pixels`.
+
+    Args:
+        tile_dirs (list): Cache directories of every source
+        path (str): Path to the .mbtiles archive
+    Returns:
+        bool: True if every layer has every id of its source, with matching extents
+    """
+    layers = {name for name, _ in pyogrio.list_layers(path)}
+    with sqlite3.connect(path) as connection:
+        maxzoom = int(
+            connection.execute(
+                "SELECT value FROM metadata WHERE name = 'maxzoom'"
+            ).fetchone()[0]
+        )
+    ok = True
+    for tile_dir in tile_dirs:
+        name = tile_dir.name.rsplit("_z", 1)[0]
+        with open(tile_dir / "ids.json", encoding="utf-8") as f:
+            source_ids = set(json.load(f))
+        decoded_extents = {}
+        if name in layers:
+            # GDAL reads an MBTiles layer at the archive's maximum zoom
+            decoded = pyogrio.read_dataframe(path, layer=name)
+            decoded_extents = get_extents(decoded.to_crs(3857))
+        decoded_ids = set(decoded_extents)
+        missing = source_ids - decoded_ids
+        message = f"{name}: decoded {len(decoded_ids)} of {len(source_ids)} ids" + (
+            f", missing {sorted(missing)[:10]}" if missing else ""
+        )
+        extents_path = tile_dir / "extents.json"
+        differs = []
+        if extents_path.exists():
+            with open(extents_path, encoding="utf-8") as f:
+                differs = verify_extents(json.load(f), decoded_extents, maxzoom)
+            message += (
+                f", {len(differs)} extents differ {differs[:10]}"
+                if differs
+                else ", extents match"
+            )
+        else:
+            # tile sets cut before the extents were saved
+            message += ", no source extents to check"
+        print(message)
+        ok = ok and not missing and not differs
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--minzoom", type=int, default=0, help="Default is 0.")
+    parser.add_argument("--maxzoom", type=int, default=8, help="Default is 8.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes used to cut tiles. Default is one per core.",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Decode every layer back from the archive and check it against its source.",
+    )
+    args = parser.parse_args()
+
+    sources = get_tile_sources()
+    tile_dirs = [get_tile_dir(source, args.minzoom, args.maxzoom) for source in sources]
+    jobs = [
+        {**source, "minzoom": args.minzoom, "maxzoom": args.maxzoom}
+        for source, tile_dir in zip(sources, tile_dirs)
+        if not tile_dir.exists()
+    ]
+    print(f"Cutting tiles for {len(jobs)} of {len(sources)} sources")
+    if jobs:
+        run_in_process_pool(
+            cut_tiles, jobs, args.workers, labels=[job["name"] for job in jobs]
+        )
+    remove_stale_tile_dirs(tile_dirs)
+
+    changed, total = write_archive(tile_dirs, args.minzoom, args.maxzoom)
+    print(f"Wrote {changed} of {total} tiles to {archive_path}")
+
+    if args.verify and not verify_archive(tile_dirs):
+        raise SystemExit("Some features are missing from the tiles")
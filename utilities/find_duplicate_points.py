@@ -0,0 +1,172 @@
+"""
+Find duplicate and near-duplicate point locations across all region CSVs.
+
+The per-region workflows (e.g. the projected CRS of each region in crs_lookup)
+never see two region files together, so a community near a border, such as
+Yukon/Alaska or Quebec/Newfoundland and Labrador, can end up in both CSVs. This
+script indexes every point of every CSV in one k-d tree of Earth-centered
+(ECEF) coordinates, reports every pair of points within a distance, and scores
+how similar the names of each pair are. Pairs that are close and have similar
+names are flagged as likely duplicates.
+
+Example usage:
+    python find_duplicate_points.py
+    python find_duplicate_points.py --max_distance_m 5000 --name_threshold 0.85 --cross_region_only
+"""
+
+import argparse
+import difflib
+import glob
+import os
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from geodesy import find_close_pairs
+
+point_columns = ["id", "name", "alt_name", "latitude", "longitude"]
+
+
+def load_all_points():
+    """Load the id, names, and coordinates of the points in every CSV, with the CSV file name in a file column."""
+    return pd.concat(
+        [
+            pd.read_csv(path, usecols=point_columns, dtype={"id": str}).assign(
+                file=os.path.basename(path)
+            )
+            for path in sorted(glob.iglob("../vector_data/point/*.csv"))
+        ],
+        ignore_index=True,
+    )
+
+
+def normalize_name(name):
+    """Normalize a place name for fuzzy matching, ignoring case, diacritics, and punctuation.
+
+    Args:
+        name (str): Place name, or NaN for a missing alternate name
+    Returns:
+        str: Normalized name, empty for a missing name
+    """
+    if not isinstance(name, str):
+        return ""
+    name = unicodedata.normalize("NFKD", name.casefold())
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", " ", name).split())
+
+
+def name_similarity(names1, names2):
+    """Score how similar two places' names are, as the best match among their names and alternate names.
+
+    Args:
+        names1 (list): Normalized names of the first place
+        names2 (list): Normalized names of the second place
+    Returns:
+        float: Similarity from 0 (nothing in common) to 1 (identical)
+    """
+    return max(
+        (
+            difflib.SequenceMatcher(None, name1, name2).ratio()
+            for name1 in names1
+            if name1
+            for name2 in names2
+            if name2
+        ),
+        default=0.0,
+    )
+
+
+def find_duplicate_points(
+    points, max_distance_m=2000, name_threshold=0.85, cross_region_only=False
+):
+    """Find pairs of points within a distance of each other and score their name similarity.
+
+    Args:
+        points (pd.DataFrame): Points from `load_all_points`
+        max_distance_m (float): Maximum distance between the points of a pair in meters
+        name_threshold (float): Minimum name similarity of a likely duplicate
+        cross_region_only (bool): Only report pairs of points from different CSVs
+    Returns:
+        pd.DataFrame: One row per pair, sorted with the likely duplicates first and then by distance
+    """
+    pairs, distances = find_close_pairs(
+        points["longitude"], points["latitude"], max_distance_m
+    )
+    files = points["file"].to_numpy()
+    cross_region = files[pairs[:, 0]] != files[pairs[:, 1]]
+    if cross_region_only:
+        pairs, distances = pairs[cross_region], distances[cross_region]
+        cross_region = cross_region[cross_region]
+
+    # names are normalized once per point rather than once per pair
+    names = list(
+        zip(points["name"].map(normalize_name), points["alt_name"].map(normalize_name))
+    )
+    similarity = np.array(
+        [name_similarity(names[i], names[j]) for i, j in pairs], dtype="float64"
+    )
+
+    first = points.iloc[pairs[:, 0]]
+    second = points.iloc[pairs[:, 1]]
+    duplicates = pd.DataFrame(
+        {
+            "id1": first["id"].to_numpy(),
+            "name1": first["name"].to_numpy(),
+            "file1": first["file"].to_numpy(),
+            "id2": second["id"].to_numpy(),
+            "name2": second["name"].to_numpy(),
+            "file2": second["file"].to_numpy(),
+            "distance_m": np.round(distances, 1),
+            "name_similarity": np.round(similarity, 3),
+            "cross_region": cross_region,
+            "likely_duplicate": similarity >= name_threshold,
+        }
+    )
+    return duplicates.sort_values(
+        ["likely_duplicate", "distance_m"], ascending=[False, True], ignore_index=True
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--max_distance_m",
+        type=float,
+        default=2000,
+        help="Maximum distance between the points of a pair in meters. Default is 2000.",
+    )
+    parser.add_argument(
+        "--name_threshold",
+        type=float,
+        default=0.85,
+        help="Minimum name similarity (0 to 1) of a likely duplicate. Default is 0.85.",
+    )
+    parser.add_argument(
+        "--cross_region_only",
+        action="store_true",
+        help="Only report pairs of points from different region CSVs.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="duplicate_points.csv",
+        help="Path of the CSV report. Default is duplicate_points.csv.",
+    )
+    args = parser.parse_args()
+
+    points = load_all_points()
+    duplicates = find_duplicate_points(
+        points, args.max_distance_m, args.name_threshold, args.cross_region_only
+    )
+    duplicates.to_csv(args.output, index=False)
+    print(
+        f"Found {len(duplicates)} pairs of points within {args.max_distance_m:g} m among {len(points)} points, "
+        f"{duplicates['cross_region'].sum()} across regions, "
+        f"{duplicates['likely_duplicate'].sum()} likely duplicates"
+    )
+    print(duplicates[duplicates["likely_duplicate"]].head(20).to_string(index=False))
+    print(f"Report written to {args.output}")
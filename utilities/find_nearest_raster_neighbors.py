@@ -1,5 +1,8 @@
 import argparse
+import hashlib
+import json
 import os
+import pickle
 import subprocess
 from pathlib import Path
 
@@ -9,9 +12,12 @@ import numpy as np
 import geopandas as gpd
 from scipy.spatial import cKDTree
 from rasterio.warp import transform
-from shapely.geometry import Point
 
 from crs_lookup import crs_lookup
+from parallel import run_in_process_pool
+
+# set from the --DEBUG command line flag
+DEBUG = False
 
 
 def load_community_data(csv_path):
@@ -27,37 +33,71 @@ def load_community_data(csv_path):
     return df
 
 
-def transform_row_col_to_latlon(affine_transform, row, col, crs):
-    """Transform raster row/col to latitude and longitude.
+def transform_row_col_to_projected_xy(affine_transform, rows, cols):
+    """Transform raster rows/cols to pixel center x and y coordinates.
 
     Args:
         affine_transform (Affine): Affine transform object
-        row (int): Raster row
-        col (int): Raster column
-        crs (int): EPSG code of the projected CRS to transform from
+        rows (int or array-like): Raster row(s)
+        cols (int or array-like): Raster column(s)
     Returns:
-        tuple: (latitude, longitude)
+        np.ndarray: Array of shape (n, 2) with the projected (x, y) coordinates of each pixel center
     """
-    # first go from row to col to pixel center coordinates for 3338
-    x, y = rio.transform.xy(affine_transform, row, col, offset="center")
-    # then go from 3338 to 4326
-    lon, lat = transform(f"EPSG:{crs}", "EPSG:4326", [x], [y])
-    return lat[0], lon[0]
+    # apply the affine math to all pixels at once instead of one rio.transform.xy call per pixel
+    rows = np.atleast_1d(np.asarray(rows, dtype="float64")) + 0.5
+    cols = np.atleast_1d(np.asarray(cols, dtype="float64")) + 0.5
+    a, b, c, d, e, f = affine_transform[:6]
+    xs = a * cols + b * rows + c
+    ys = d * cols + e * rows + f
+    return np.column_stack([xs, ys])
 
 
-def transform_row_col_to_projected_xy(affine_transform, row, col):
-    """Transform raster row/col to x and y.
+def transform_latlon_to_projected_xy(latitudes, longitudes, crs):
+    """Transform latitudes and longitudes to projected x and y in a single call.
 
     Args:
-        affine_transform (Affine): Affine transform object
-        row (int): Raster row
-        col (int): Raster column
+        latitudes (array-like): Latitudes of the point locations
+        longitudes (array-like): Longitudes of the point locations
+        crs (int): EPSG code of the projected CRS to transform to
     Returns:
-        tuple: (projected x coord, projected y coord)
+        tuple: (np.ndarray of projected x coords, np.ndarray of projected y coords)
     """
-    # first go from row to col to pixel center coordinates for 3338
-    x, y = rio.transform.xy(affine_transform, row, col, offset="center")
-    return x, y
+    xs, ys = transform("EPSG:4326", f"EPSG:{crs}", list(longitudes), list(latitudes))
+    return np.asarray(xs), np.asarray(ys)
+
+
+def neighbors_to_latlon_df(neighbor_xy, crs, label_prefix):
+    """Reproject all nearest neighbor coordinates to lat/lon in a single call.
+
+    Args:
+        neighbor_xy (np.ndarray): Array of shape (n_communities, k, 2) with projected neighbor coordinates, NaN where no neighbor was found
+        crs (int): EPSG code of the projected CRS the neighbor coordinates are in
+        label_prefix (str): Prefix to add to the column names for the nearest neighbor latitudes and longitudes
+    Returns:
+        pd.DataFrame: DataFrame with a latitude and longitude column for each of the k nearest neighbors
+    """
+    n_communities, k_nearest_neighbors, _ = neighbor_xy.shape
+    flat_xy = neighbor_xy.reshape(-1, 2)
+    found = ~np.isnan(flat_xy[:, 0])
+    lats = np.full(len(flat_xy), np.nan)
+    lons = np.full(len(flat_xy), np.nan)
+    if found.any():
+        found_lons, found_lats = transform(
+            f"EPSG:{crs}",
+            "EPSG:4326",
+            list(flat_xy[found, 0]),
+            list(flat_xy[found, 1]),
+        )
+        lats[found] = np.round(found_lats, 4)
+        lons[found] = np.round(found_lons, 4)
+    lats = lats.reshape(n_communities, k_nearest_neighbors)
+    lons = lons.reshape(n_communities, k_nearest_neighbors)
+
+    columns = {}
+    for i in range(k_nearest_neighbors):
+        columns[f"{label_prefix}_lat{i+1}"] = lats[:, i]
+        columns[f"{label_prefix}_lon{i+1}"] = lons[:, i]
+    return pd.DataFrame(columns)
 
 
 def prep_raster(raster_path, crs):
@@ -87,7 +127,7 @@ def read_windowed_raster(
     src,
     band_number,
     crs,
-    community_coords,
+    community_xy,
     grid_cells_vals,
     window_size_m=2**20,
     community_name=None,
@@ -98,17 +138,13 @@ def read_windowed_raster(
         src (rio.io.DatasetReader): rio dataset reader object
         band_number (int): Number of the band to read
         crs (int): EPSG code of the projected CRS
-        community_coords (tuple): (latitude, longitude) for the community
+        community_xy (tuple): (x, y) projected coordinates for the community
         grid_cells_vals (list): List of values, one of which a raster grid cell must match to be considered a nearest neighbor
         window_size_m (int): Size of the window in meters.
     Returns:
-        list: List of coordinates of raster grid cells that meet the condition"""
-    # convert community lat/lon to projected CRS coordinates
-    x, y = transform(
-        "EPSG:4326", f"EPSG:{crs}", [community_coords[1]], [community_coords[0]]
-    )
-    x = x[0]
-    y = y[0]
+        tuple: (np.ndarray of shape (n, 2) with the coordinates of raster grid cells that meet the condition, number of bytes read)
+    """
+    x, y = community_xy
     # use rio.windows.from_bounds(left, bottom, right, top) to make a window centered on the community, doing windowed reads speeds this up quite a bit
     window = rio.windows.from_bounds(
         x - window_size_m // 2,
@@ -117,17 +153,25 @@ def read_windowed_raster(
         y + window_size_m // 2,
         src.transform,
     )
+    # snap the window to whole pixels and clip it to the raster extent so the window transform lines up with the grid cells that are actually read
+    try:
+        window = (
+            window.round_offsets()
+            .round_lengths()
+            .intersection(rio.windows.Window(0, 0, src.width, src.height))
+        )
+    except rio.errors.WindowError:
+        # the window does not overlap the raster at all
+        return np.empty((0, 2)), 0
 
     raster = src.read(band_number, window=window, masked=True)
+    bytes_read = raster.data.nbytes
     affine_transform = src.window_transform(window)
     # we only want pixels that match certain values
     mask = np.isin(raster, grid_cells_vals)
     rows, cols = np.where(mask)
     # all possible nearest neighbor coordinates
-    coordinates = [
-        transform_row_col_to_projected_xy(affine_transform, row, col)
-        for row, col in zip(rows, cols)
-    ]
+    coordinates = transform_row_col_to_projected_xy(affine_transform, rows, cols)
     if DEBUG:
         # write the windowed raster "chip" for debugging
         output_path = f"debug/window_{community_name}.tif"
@@ -145,12 +189,306 @@ def read_windowed_raster(
         # write the coordinates to a shapefile for debugging
         output_path = f"debug/coords_{community_name}.shp"
         gdf = gpd.GeoDataFrame(
-            {"geometry": [Point(coord) for coord in coordinates]}, crs=f"EPSG:{crs}"
+            geometry=gpd.points_from_xy(coordinates[:, 0], coordinates[:, 1]),
+            crs=f"EPSG:{crs}",
         )
         # only write if not empty
         if not gdf.empty:
             gdf.to_file(output_path)
-    return coordinates
+    return coordinates, bytes_read
+
+
+def query_tree(tree, query_xy, k_nearest_neighbors):
+    """Find the k nearest indexed coordinates for one or more query points.
+
+    Args:
+        tree (scipy.spatial.cKDTree): KDTree of candidate coordinates
+        query_xy (np.ndarray): Array of shape (m, 2) with the query coordinates
+        k_nearest_neighbors (int): Number of nearest neighbors to find
+    Returns:
+        np.ndarray: Array of shape (m, k, 2) with the nearest coordinates, NaN where fewer than k candidates exist
+    """
+    query_xy = np.atleast_2d(query_xy)
+    neighbor_xy = np.full((len(query_xy), k_nearest_neighbors, 2), np.nan)
+    if tree.n == 0:
+        return neighbor_xy
+    # passing k as a list keeps the output 2D even when k is 1
+    _, indices = tree.query(query_xy, k=list(range(1, k_nearest_neighbors + 1)))
+    # missing neighbors are flagged with an index equal to the number of candidates
+    found = indices < tree.n
+    neighbor_xy[found] = tree.data[indices[found]]
+    return neighbor_xy
+
+
+def query_nearest_coordinates(coordinates, query_xy, k_nearest_neighbors):
+    """Find the k nearest candidate coordinates for one or more query points.
+
+    Args:
+        coordinates (np.ndarray): Array of shape (n, 2) with candidate coordinates
+        query_xy (np.ndarray): Array of shape (m, 2) with the query coordinates
+        k_nearest_neighbors (int): Number of nearest neighbors to find
+    Returns:
+        np.ndarray: Array of shape (m, k, 2) with the nearest coordinates, NaN where fewer than k candidates exist
+    """
+    # prepare KDTree with the candidate coordinates
+    # CP note: basically n-dimensional binary search tree, see https://youtu.be/Glp7THUpGow
+    tree = cKDTree(np.asarray(coordinates).reshape(-1, 2))
+    return query_tree(tree, query_xy, k_nearest_neighbors)
+
+
+def band_may_contain_values(src, band_number, grid_cells_vals):
+    """Check the band statistics stored with the dataset to see if any grid cell could match the condition.
+
+    Only statistics that are already stored with the dataset (e.g. from `gdalinfo -stats`) are used, nothing is computed here. If no statistics are stored the band is assumed to possibly contain the values.
+
+    Args:
+        src (rio.io.DatasetReader): rio dataset reader object
+        band_number (int): Number of the band to check
+        grid_cells_vals (list): List of values, one of which a raster grid cell must match to be considered a nearest neighbor
+    Returns:
+        bool: False if the stored statistics rule out every value, True otherwise
+    """
+    tags = src.tags(band_number)
+    try:
+        band_min = float(tags["STATISTICS_MINIMUM"])
+        band_max = float(tags["STATISTICS_MAXIMUM"])
+    except (KeyError, ValueError):
+        return True
+    return any(band_min <= val <= band_max for val in grid_cells_vals)
+
+
+def block_is_unwritten(src, band_number, block_row, block_col, grid_cells_vals):
+    """Check if a block was never written to the file and can only hold the fill value.
+
+    GeoTIFFs written with sparse blocks store no data at all for blocks that are entirely nodata, so those blocks can be skipped without reading them.
+
+    Args:
+        src (rio.io.DatasetReader): rio dataset reader object
+        band_number (int): Number of the band the block belongs to
+        block_row (int): Row index of the block
+        block_col (int): Column index of the block
+        grid_cells_vals (list): List of values, one of which a raster grid cell must match to be considered a nearest neighbor
+    Returns:
+        bool: True if the block can be skipped
+    """
+    # unwritten blocks are read back as nodata, or 0 if the band has no nodata value
+    fill_value = src.nodatavals[band_number - 1]
+    if fill_value is None:
+        fill_value = 0
+    # block sizes are only available for GeoTIFFs
+    if fill_value in grid_cells_vals or src.driver != "GTiff":
+        return False
+    try:
+        return src.block_size(band_number, block_row, block_col) == 0
+    except rio.errors.RasterBlockError:
+        # GDAL reports no size at all for blocks that were never written
+        return True
+
+
+def write_qualifying_cell_centers(src, band_number, grid_cells_vals, store_path):
+    """Stream the band block by block and append the center coordinates of every qualifying grid cell to an on-disk store.
+
+    Only one native block of the raster is held in memory at a time, so peak memory is bounded by the block size rather than the raster size.
+    Blocks are only skipped when the stored band statistics or a sparse (unwritten) block rule them out. Overviews are intentionally not used to
+    skip blocks: they are resampled (nearest or average), so an isolated qualifying grid cell can be missing from the overview of its block,
+    and skipping on them would silently drop neighbors. An ordinary GeoTIFF without statistics or sparse blocks is read block by block in full.
+
+    Args:
+        src (rio.io.DatasetReader): rio dataset reader object
+        band_number (int): Number of the band to read
+        grid_cells_vals (list): List of values, one of which a raster grid cell must match to be considered a nearest neighbor
+        store_path (pathlib.Path): Path of the raw float64 (x, y) coordinate file to write
+    Returns:
+        int: Number of qualifying grid cells written to the store
+    """
+    n_cells = 0
+    n_read = 0
+    n_skipped = 0
+    with open(store_path, "wb") as store:
+        if not band_may_contain_values(src, band_number, grid_cells_vals):
+            print("Band statistics rule out all grid cell values, skipping raster.")
+            return n_cells
+        for (block_row, block_col), window in src.block_windows(band_number):
+            if block_is_unwritten(
+                src, band_number, block_row, block_col, grid_cells_vals
+            ):
+                n_skipped += 1
+                continue
+            block = src.read(band_number, window=window, masked=True)
+            n_read += 1
+            rows, cols = np.where(np.isin(block, grid_cells_vals))
+            if len(rows) == 0:
+                continue
+            coordinates = transform_row_col_to_projected_xy(
+                src.window_transform(window), rows, cols
+            )
+            store.write(coordinates.astype("float64").tobytes())
+            n_cells += len(coordinates)
+    print(
+        f"Read {n_read} blocks, skipped {n_skipped} empty blocks, found {n_cells} qualifying grid cells."
+    )
+    return n_cells
+
+
+def extract_qualifying_cell_centers(src, band_number, grid_cells_vals, store_path):
+    """Get the center coordinates of every grid cell that meets the condition, backed by an on-disk store.
+
+    Args:
+        src (rio.io.DatasetReader): rio dataset reader object
+        band_number (int): Number of the band to read
+        grid_cells_vals (list): List of values, one of which a raster grid cell must match to be considered a nearest neighbor
+        store_path (pathlib.Path): Path of the raw float64 (x, y) coordinate file to write
+    Returns:
+        np.ndarray: Memory-mapped array of shape (n, 2) with the projected coordinates of the qualifying grid cells
+    """
+    n_cells = write_qualifying_cell_centers(
+        src, band_number, grid_cells_vals, store_path
+    )
+    if n_cells == 0:
+        return np.empty((0, 2))
+    return np.memmap(store_path, dtype="float64", mode="r", shape=(n_cells, 2))
+
+
+def get_index_cache_path(
+    raster_path, band_number, grid_cells_vals, crs, cache_dir="nn_index_cache"
+):
+    """Get the path of the cached shared index for a raster and search condition.
+
+    The cache key is built from the raster path, band, grid cell values, and CRS. The raster's size and modification time are included so an edited raster does not reuse a stale index.
+
+    Args:
+        raster_path (pathlib.Path): Path to the (already reprojected) raster file.
+        band_number (int): Number of the band to read from the raster file.
+        grid_cells_vals (list): List of values, one of which a raster grid cell must have to be considered a nearest neighbor
+        crs (int): EPSG code of the projected CRS
+        cache_dir (str): Directory where index files are cached
+    Returns:
+        pathlib.Path: Path to the cached index file
+    """
+    raster_path = Path(raster_path).resolve()
+    stat = raster_path.stat()
+    key = json.dumps(
+        [
+            str(raster_path),
+            stat.st_size,
+            stat.st_mtime_ns,
+            band_number,
+            sorted(grid_cells_vals),
+            crs,
+        ]
+    )
+    key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return Path(cache_dir) / f"{raster_path.stem}_{key_hash}.kdtree"
+
+
+def load_shared_index(
+    raster_path, band_number, grid_cells_vals, crs, cache_dir="nn_index_cache"
+):
+    """Load a single KDTree of every qualifying grid cell in the raster, building and caching it if needed.
+
+    Args:
+        raster_path (pathlib.Path): Path to the (already reprojected) raster file.
+        band_number (int): Number of the band to read from the raster file.
+        grid_cells_vals (list): List of values, one of which a raster grid cell must have to be considered a nearest neighbor
+        crs (int): EPSG code of the projected CRS
+        cache_dir (str): Directory where index files are cached
+    Returns:
+        scipy.spatial.cKDTree: KDTree of the qualifying grid cell center coordinates
+    """
+    cache_path = get_index_cache_path(
+        raster_path, band_number, grid_cells_vals, crs, cache_dir
+    )
+    if cache_path.exists():
+        print(f"Using cached index {cache_path}")
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+
+    print(f"Building shared index for {raster_path}...")
+    os.makedirs(cache_dir, exist_ok=True)
+    store_path = cache_path.with_suffix(".xy")
+    with rio.open(raster_path) as src:
+        coordinates = extract_qualifying_cell_centers(
+            src, band_number, grid_cells_vals, store_path
+        )
+    # the tree references the memory-mapped coordinates rather than copying them
+    tree = cKDTree(coordinates)
+    # write to a temporary file first so an interrupted run never leaves a truncated index behind
+    tmp_path = cache_path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(tree, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+    # the pickled tree carries its own copy of the coordinates, so the store is no longer needed
+    # and the tree is reloaded from the cache so it does not reference the deleted store
+    del tree, coordinates
+    os.remove(store_path)
+    return load_shared_index(raster_path, band_number, grid_cells_vals, crs, cache_dir)
+
+
+def find_windowed_neighbors(
+    raster_path,
+    band_number,
+    grid_cells_vals,
+    k_nearest_neighbors,
+    crs,
+    comm_xs,
+    comm_ys,
+    community_names,
+    initial_window_m=2**14,
+    max_window_m=2**20,
+):
+    """Find the k nearest qualifying grid cells for each community with an expanding windowed read.
+
+    The search starts with a small window centered on the community and doubles it until k qualifying grid cells are found that are guaranteed to be the nearest ones (i.e. no closer cell can lie outside the window), or until the window reaches `max_window_m`. At the maximum window size the nearest qualifying cells inside the window are used.
+
+    Args:
+        raster_path (pathlib.Path): Path to the (already reprojected) raster file.
+        band_number (int): Number of the band to read from the raster file.
+        grid_cells_vals (list): List of values, one of which a raster grid cell must have to be considered a nearest neighbor
+        k_nearest_neighbors (int): Number of nearest neighbors to find
+        crs (int): EPSG code of the projected CRS
+        comm_xs (np.ndarray): Projected x coordinates of the communities
+        comm_ys (np.ndarray): Projected y coordinates of the communities
+        community_names (np.ndarray): Names of the communities, used for debugging output
+        initial_window_m (int): Size of the first window in meters
+        max_window_m (int): Size of the largest window in meters
+    Returns:
+        tuple: (np.ndarray of shape (n_communities, k, 2) with the projected neighbor coordinates, NaN if none are found in the largest window, pd.DataFrame with the number of reads and bytes read for each community)
+    """
+    neighbor_xy = np.full((len(comm_xs), k_nearest_neighbors, 2), np.nan)
+    io_stats = []
+    with rio.open(raster_path) as src:
+        # rounding the window to whole pixels can trim up to a pixel from each side
+        pixel_size = max(abs(src.res[0]), abs(src.res[1]))
+        for i, (comm_x, comm_y) in enumerate(zip(comm_xs, comm_ys)):
+            window_size_m = min(initial_window_m, max_window_m)
+            n_reads = 0
+            n_bytes = 0
+            while True:
+                coordinates, bytes_read = read_windowed_raster(
+                    src,
+                    band_number,
+                    crs,
+                    (comm_x, comm_y),
+                    grid_cells_vals,
+                    window_size_m=window_size_m,
+                    community_name=community_names[i],
+                )
+                n_reads += 1
+                n_bytes += bytes_read
+                neighbor_xy[i] = query_nearest_coordinates(
+                    coordinates, (comm_x, comm_y), k_nearest_neighbors
+                )[0]
+                # any cell closer than the kth neighbor found must be inside the window if the kth neighbor is within the inscribed circle
+                kth_distance = np.hypot(
+                    neighbor_xy[i, -1, 0] - comm_x, neighbor_xy[i, -1, 1] - comm_y
+                )
+                if kth_distance <= window_size_m / 2 - pixel_size:
+                    break
+                if window_size_m >= max_window_m:
+                    break
+                window_size_m = min(window_size_m * 2, max_window_m)
+            io_stats.append({"reads": n_reads, "bytes": n_bytes})
+    return neighbor_xy, pd.DataFrame(io_stats, columns=["reads", "bytes"])
 
 
 def find_nearest_neighbors(
@@ -161,9 +499,15 @@ def find_nearest_neighbors(
     k_nearest_neighbors,
     label_prefix,
     crs,
+    shared_index=False,
+    cache_dir="nn_index_cache",
+    initial_window_m=2**14,
+    max_window_m=2**20,
 ):
     """
-    Find the k nearest raster cell centroid coordinates for each community within a windowed read.
+    Find the k nearest raster cell centroid coordinates for each community within an expanding windowed read, or against a single index of the whole raster when `shared_index` is set.
+
+    Community coordinates are projected in a single call up front, and all of the neighbor coordinates are reprojected back to lat/lon in a single call at the end.
 
     Args:
         community_df (pd.DataFrame): DataFrame containing community point locations.
@@ -173,100 +517,64 @@ def find_nearest_neighbors(
         k_nearest_neighbors (int): Number of nearest neighbors to find
         label_prefix (str): Prefix to add to the column names for the nearest neighbor latitudes and longitudes
         crs (int): EPSG code of the projected CRS
+        shared_index (bool): Query one cached KDTree of every qualifying grid cell instead of reading a window per community
+        cache_dir (str): Directory where shared index files are cached
+        initial_window_m (int): Size of the first window in meters for windowed reads
+        max_window_m (int): Size of the largest window in meters for windowed reads
     Returns:
         pd.DataFrame: DataFrame containing community point locations with nearest neighbors added.
     """
-    results = []
     raster_path = prep_raster(raster_path, crs)
-    with rio.open(raster_path) as src:
-        for _, community in community_df.iterrows():
-            community_coords = (community["latitude"], community["longitude"])
-            comm_x, comm_y = transform(
-                "EPSG:4326", f"EPSG:{crs}", [community_coords[1]], [community_coords[0]]
-            )
-            comm_x = comm_x[0]
-            comm_y = comm_y[0]
-
-            print(f"Finding nearest neighbors for {community['name']}...")
-            coordinates = read_windowed_raster(
-                src,
-                band_number,
-                crs,
-                community_coords,
-                grid_cells_vals,
-                community_name=community["name"],
-            )
+    comm_xs, comm_ys = transform_latlon_to_projected_xy(
+        community_df["latitude"], community_df["longitude"], crs
+    )
+    community_names = community_df["name"].to_numpy()
 
-            if not coordinates:
-                # If no valid coordinates are found in the window, create dummy result
-                result = {}
-                for i in range(k_nearest_neighbors):
-                    result[f"NN{i+1}_y"] = None
-                    result[f"NN{i+1}_x"] = None
-                results.append(result)
-                continue
+    # projected coordinates of the k nearest neighbors for every community
+    if shared_index:
+        tree = load_shared_index(
+            raster_path, band_number, grid_cells_vals, crs, cache_dir
+        )
+        print(f"Finding nearest neighbors for {len(community_df)} communities...")
+        neighbor_xy = query_tree(
+            tree, np.column_stack([comm_xs, comm_ys]), k_nearest_neighbors
+        )
+    else:
+        neighbor_xy, io_stats = find_windowed_neighbors(
+            raster_path,
+            band_number,
+            grid_cells_vals,
+            k_nearest_neighbors,
+            crs,
+            comm_xs,
+            comm_ys,
+            community_names,
+            initial_window_m=initial_window_m,
+            max_window_m=max_window_m,
+        )
+        print(
+            f"Windowed reads for {len(io_stats)} communities: {io_stats['reads'].sum()} reads, {io_stats['bytes'].sum() / 2**20:.1f} MiB total, {io_stats['reads'].mean():.1f} reads and {io_stats['bytes'].mean() / 2**20:.2f} MiB per point on average, {io_stats['reads'].max()} reads at most."
+        )
 
-            # prepare KDTree with coordinates from the windowed read
-            # CP note: basically n-dimensional binary search tree, see https://youtu.be/Glp7THUpGow
-            coordinate_arr = np.array([[x, y] for x, y in coordinates])
-            tree = cKDTree(coordinate_arr)
-            distances, indices = tree.query([(comm_x, comm_y)], k=k_nearest_neighbors)
-            distances = distances[0]
-            indices = indices[0]
-
-            result = {}
-            for i in range(k_nearest_neighbors):
-                if k_nearest_neighbors == 1:
-                    nearest_coord = coordinates[indices]
-                else:
-                    nearest_coord = coordinates[indices[i]]
-                result[f"NN{i+1}_x"] = nearest_coord[0]
-                result[f"NN{i+1}_y"] = nearest_coord[1]
+    results_df = neighbors_to_latlon_df(neighbor_xy, crs, label_prefix)
+    if results_df.iloc[:, 0].isna().all():
+        print("No nearest neighbors found for any communities.")
 
+    if DEBUG:
+        # write the nearest neighbors of each community to a shapefile for debugging
+        for i, community_name in enumerate(community_names):
+            lats = results_df.iloc[i][
+                [f"{label_prefix}_lat{j+1}" for j in range(k_nearest_neighbors)]
+            ]
+            lons = results_df.iloc[i][
+                [f"{label_prefix}_lon{j+1}" for j in range(k_nearest_neighbors)]
+            ]
             gdf = gpd.GeoDataFrame(
-                {
-                    "geometry": [
-                        Point(result[f"NN{i+1}_x"], result[f"NN{i+1}_y"])
-                        for i in range(k_nearest_neighbors)
-                    ]
-                },
-                crs=f"EPSG:{crs}",
+                geometry=gpd.points_from_xy(lons, lats), crs="EPSG:4326"
             )
-            gdf = gdf.to_crs("EPSG:4326")
-            # for each nearest neighbor, create a column for the latitude and longitude and add the latitude and longitude value for that neighbor to the column
-            for i in range(k_nearest_neighbors):
-                gdf[f"{label_prefix}_lat{i+1}"] = gdf.geometry.y.iloc[i]
-                gdf[f"{label_prefix}_lon{i+1}"] = gdf.geometry.x.iloc[i]
-                result[f"{label_prefix}_lat{i+1}"] = round(
-                    gdf[f"{label_prefix}_lat{i+1}"].iloc[0], 4
-                )
-                result[f"{label_prefix}_lon{i+1}"] = round(
-                    gdf[f"{label_prefix}_lon{i+1}"].iloc[0], 4
-                )
-                # now drop the projected NN keys because we don't need them anymore
-                result.pop(f"NN{i+1}_x")
-                result.pop(f"NN{i+1}_y")
-
-            results.append(result)
-
-            if DEBUG:
-                # write the nearest neighbors to a shapefile for debugging
-                output_path = f"debug/neighbors_{community['name']}.shp"
-                if not gdf.empty:
-                    gdf.to_file(output_path)
-
-    # convert to df and concatenate with original df
-    results_df = pd.DataFrame(results)
-    # drop any "NN" columns that might exist
-    results_df = results_df.drop(
-        columns=[col for col in results_df.columns if "NN" in col]
-    )
-    # handle case where no nearest neighbors are found with windowed read
-    if results_df.empty:
-        print("No nearest neighbors found for any communities.")
-        for i in range(k_nearest_neighbors):
-            results_df[f"ocean_lat{i+1}"] = None
-            results_df[f"ocean_lon{i+1}"] = None
+            gdf = gdf[~gdf.geometry.is_empty]
+            if not gdf.empty:
+                gdf.to_file(f"debug/neighbors_{community_name}.shp")
 
     # if the community_df already has the columns we're adding, drop them from the community_df
     community_df = community_df.drop(
@@ -287,14 +595,44 @@ def save_updated_csv(df, output_path):
         df.to_csv(output_path, index=False)
 
 
+def process_region(job):
+    """Find nearest neighbors for one point location CSV and write it back in place.
+
+    Args:
+        job (dict): Keyword arguments for this region: community_csv_path, raster_path (already reprojected to the region's CRS), band_number, grid_cell_values, neighbors, crs, shared_index, cache_dir, initial_window_m, max_window_m, and debug.
+    """
+    global DEBUG
+    DEBUG = job["debug"]
+    community_csv_path = job["community_csv_path"]
+    region_name = community_csv_path.name.split("_point_locations")[0]
+    print(f"Processing {region_name} with {job['crs']} projection...")
+
+    community_df = load_community_data(community_csv_path)
+    updated_community_df = find_nearest_neighbors(
+        community_df,
+        job["raster_path"],
+        job["band_number"],
+        job["grid_cell_values"],
+        job["neighbors"],
+        "ocean",
+        job["crs"],
+        shared_index=job["shared_index"],
+        cache_dir=job["cache_dir"],
+        initial_window_m=job["initial_window_m"],
+        max_window_m=job["max_window_m"],
+    )
+    save_updated_csv(updated_community_df, community_csv_path)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Find nearest raster neighbors for point locations. Example usage to find a single nearest neighbor for each point in 'community.csv' using a single band raster 'gridded_data.tif': python find_nearest_raster_neighbors.py community.csv gridded_data.tif --band_number 1 --N 1"
     )
     parser.add_argument(
-        "community_csv_path",
+        "community_csv_paths",
         type=str,
-        help="Path to the CSV file containing community point locations.",
+        nargs="+",
+        help="Path to the CSV file containing community point locations. Any number of CSV files can be provided and they will be processed in parallel.",
     )
     parser.add_argument("raster_path", type=str, help="Path to the raster file.")
     parser.add_argument(
@@ -316,35 +654,83 @@ if __name__ == "__main__":
         default=1,
         help="Number of nearest neighbors to find. Default is 1.",
     )
+    parser.add_argument(
+        "--initial_window_m",
+        type=int,
+        default=2**14,
+        help="Size in meters of the first window read around each point location. The window is doubled until the nearest neighbors are found or --max_window_m is reached. Default is 2**14.",
+    )
+    parser.add_argument(
+        "--max_window_m",
+        type=int,
+        default=2**20,
+        help="Size in meters of the largest window read around each point location. Default is 2**20.",
+    )
+    parser.add_argument(
+        "--shared_index",
+        action="store_true",
+        help="Build (or load from the cache) one spatial index of every qualifying grid cell in the raster and query all point locations against it instead of doing a windowed read per point location.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="nn_index_cache",
+        help="Directory for cached shared index files. Default is 'nn_index_cache'.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of CSV files to process at the same time. Default is one per available core.",
+    )
     parser.add_argument(
         "--DEBUG",
         action="store_true",
         help="Create debugging directory and write shapefiles of nearest neighbors and nearest neighbor candidates. Also write the raster subsets used in the search.",
     )
     args = parser.parse_args()
-    community_csv_path = Path(args.community_csv_path)
+    community_csv_paths = [Path(path) for path in args.community_csv_paths]
     raster_path = Path(args.raster_path)
-    band_number = args.band_number
-    grid_cell_values = args.grid_cell_values
-    neighbors = args.N
     DEBUG = args.DEBUG
 
     if DEBUG:
         os.makedirs("./debug/", exist_ok=True)
 
-    region_name = community_csv_path.name.split("_point_locations")[0]
-    proj_crs = crs_lookup[region_name]
-
-    print(f"Processing {region_name} with {proj_crs} projection...")
+    jobs = []
+    prepped_rasters = {}
+    for community_csv_path in community_csv_paths:
+        region_name = community_csv_path.name.split("_point_locations")[0]
+        proj_crs = crs_lookup[region_name]
+        # reproject the raster (and build the shared index) once per CRS up front, so regions that share a CRS don't redo it and workers never write the same file at the same time
+        if proj_crs not in prepped_rasters:
+            prepped_rasters[proj_crs] = prep_raster(raster_path, proj_crs)
+            if args.shared_index:
+                load_shared_index(
+                    prepped_rasters[proj_crs],
+                    args.band_number,
+                    args.grid_cell_values,
+                    proj_crs,
+                    args.cache_dir,
+                )
+        jobs.append(
+            {
+                "community_csv_path": community_csv_path,
+                "raster_path": prepped_rasters[proj_crs],
+                "band_number": args.band_number,
+                "grid_cell_values": args.grid_cell_values,
+                "neighbors": args.N,
+                "crs": proj_crs,
+                "shared_index": args.shared_index,
+                "cache_dir": args.cache_dir,
+                "initial_window_m": args.initial_window_m,
+                "max_window_m": args.max_window_m,
+                "debug": DEBUG,
+            }
+        )
 
-    community_df = load_community_data(community_csv_path)
-    updated_community_df = find_nearest_neighbors(
-        community_df,
-        raster_path,
-        band_number,
-        grid_cell_values,
-        neighbors,
-        "ocean",
-        proj_crs,
+    run_in_process_pool(
+        process_region,
+        jobs,
+        workers=args.workers,
+        labels=[path.name for path in community_csv_paths],
     )
-    save_updated_csv(updated_community_df, community_csv_path)
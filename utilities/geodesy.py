@@ -0,0 +1,110 @@
+"""
+Helpers for CRS-free distance calculations on the WGS84 ellipsoid. Points are
+converted to Earth-centered, Earth-fixed (ECEF) coordinates so a single k-d
+tree can index locations anywhere in the pan-Arctic without picking a
+projection, and candidate pairs are refined with ellipsoidal distances.
+"""
+
+import numpy as np
+from pyproj import Geod
+from scipy.spatial import cKDTree
+
+# WGS84 ellipsoid parameters
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+wgs84_geod = Geod(ellps="WGS84")
+
+
+def lonlat_to_ecef(lons, lats):
+    """Convert longitudes and latitudes on the WGS84 ellipsoid surface to ECEF coordinates.
+
+    Straight-line (chord) distances between ECEF coordinates are in meters and increase with the distance along the surface, so they can be used to find nearest neighbor candidates with a k-d tree.
+
+    Args:
+        lons (array-like): Longitudes in degrees
+        lats (array-like): Latitudes in degrees
+    Returns:
+        np.ndarray: Array of shape (n, 3) with the ECEF x, y, z coordinates in meters
+    """
+    lons = np.radians(np.asarray(lons, dtype="float64"))
+    lats = np.radians(np.asarray(lats, dtype="float64"))
+    sin_lat = np.sin(lats)
+    cos_lat = np.cos(lats)
+    # prime vertical radius of curvature
+    n = WGS84_A / np.sqrt(1 - WGS84_E2 * sin_lat**2)
+    return np.column_stack(
+        [
+            n * cos_lat * np.cos(lons),
+            n * cos_lat * np.sin(lons),
+            n * (1 - WGS84_E2) * sin_lat,
+        ]
+    )
+
+
+def ecef_to_lonlat(xyz):
+    """Convert ECEF coordinates to the longitudes and latitudes of the points on the WGS84 ellipsoid surface below or above them.
+
+    Uses Bowring's closed-form approximation, which is accurate to well below a millimeter for points within a few kilometers of the surface.
+
+    Args:
+        xyz (np.ndarray): Array of shape (..., 3) with the ECEF x, y, z coordinates in meters
+    Returns:
+        tuple: (longitudes, latitudes) in degrees, each of shape (...)
+    """
+    x, y, z = np.moveaxis(np.asarray(xyz, dtype="float64"), -1, 0)
+    b = WGS84_A * (1 - WGS84_F)
+    # second eccentricity squared
+    ep2 = (WGS84_A**2 - b**2) / b**2
+    p = np.hypot(x, y)
+    theta = np.arctan2(z * WGS84_A, p * b)
+    lats = np.arctan2(
+        z + ep2 * b * np.sin(theta) ** 3, p - WGS84_E2 * WGS84_A * np.cos(theta) ** 3
+    )
+    return np.degrees(np.arctan2(y, x)), np.degrees(lats)
+
+
+def geodesic_distance_m(lons1, lats1, lons2, lats2):
+    """Compute ellipsoidal (WGS84) distances between pairs of points in one batch.
+
+    Args:
+        lons1 (array-like): Longitudes of the first points in degrees
+        lats1 (array-like): Latitudes of the first points in degrees
+        lons2 (array-like): Longitudes of the second points in degrees
+        lats2 (array-like): Latitudes of the second points in degrees
+    Returns:
+        np.ndarray: Distances in meters, same shape as the inputs
+    """
+    lons1, lats1, lons2, lats2 = np.broadcast_arrays(
+        *[np.asarray(a, dtype="float64") for a in (lons1, lats1, lons2, lats2)]
+    )
+    _, _, distances = wgs84_geod.inv(
+        lons1.ravel(), lats1.ravel(), lons2.ravel(), lats2.ravel()
+    )
+    return np.asarray(distances).reshape(lons1.shape)
+
+
+def find_close_pairs(lons, lats, max_distance_m):
+    """Find every pair of points closer than a distance with one k-d tree of ECEF coordinates.
+
+    Chord distances are never longer than the distance along the surface, so the tree finds every candidate pair and the candidates are refined with ellipsoidal distances.
+
+    Args:
+        lons (array-like): Longitudes in degrees
+        lats (array-like): Latitudes in degrees
+        max_distance_m (float): Maximum distance between the points of a pair in meters
+    Returns:
+        tuple: ((n, 2) array of point index pairs with i < j, distances in meters)
+    """
+    lons = np.asarray(lons, dtype="float64")
+    lats = np.asarray(lats, dtype="float64")
+    tree = cKDTree(lonlat_to_ecef(lons, lats))
+    pairs = tree.query_pairs(max_distance_m, output_type="ndarray")
+    if len(pairs) == 0:
+        return pairs.reshape(0, 2), np.empty(0)
+    distances = geodesic_distance_m(
+        lons[pairs[:, 0]], lats[pairs[:, 0]], lons[pairs[:, 1]], lats[pairs[:, 1]]
+    )
+    close = distances < max_distance_m
+    return pairs[close], distances[close]
@@ -0,0 +1,45 @@
+"""
+Content hashes of point location CSVs and area layers, shared by the scripts
+that cache or incrementally rebuild outputs derived from them (the community
+area membership table, vector tiles, and label grids), so an output is rebuilt
+whenever its inputs change.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from create_shapefiles import mask_path
+from masks import hash_mask_file
+
+
+def hash_files(paths):
+    """Hash the contents of several files, skipping any that don't exist."""
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(2**20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def hash_layer(layer):
+    """Hash an area layer's registry entry, geometries, attributes, and CRS (plus the mask if the layer uses one).
+
+    Args:
+        layer (dict): Layer description from `area_layers`
+    Returns:
+        str: Hex digest that changes whenever the layer's memberships could change
+    """
+    shp_path = Path(layer["path"])
+    digest = hashlib.sha256(json.dumps(layer, sort_keys=True).encode("utf-8"))
+    digest.update(
+        hash_files(
+            [shp_path.with_suffix(ext) for ext in [".shp", ".dbf", ".prj"]]
+        ).encode()
+    )
+    if layer.get("within_mask"):
+        digest.update(hash_mask_file(Path(mask_path)).encode())
+    return digest.hexdigest()[:16]
@@ -0,0 +1,443 @@
+"""
+Precompute and cache the polygons of a layer burned into a raster grid, so
+zonal statistics over many rasters that share a grid (e.g. the SNAP climate
+rasters) don't rasterize the same polygons again for every raster.
+
+A layer whose polygons don't overlap (HUCs, boroughs, GMUs, ...) is stored as a
+label grid: an array with the grid's shape holding the 1-based position of the
+polygon that contains each grid cell's center (0 for none), in the smallest
+unsigned integer type that fits the number of polygons. Label grids are saved
+as .npy files, which are loaded memory-mapped. A layer whose polygons overlap
+(the layers flagged "overlapping" in `area_layers`, like protected areas)
+can't give each grid cell a single label, so it is stored as a sparse coverage
+matrix instead, with one row per polygon and one column per grid cell, saved
+as a compressed .npz file. The polygon ids are saved in a .json file next to
+either one.
+
+Polygons of a label grid layer that overlap another polygon anyway, and
+polygons smaller than a grid cell that don't contain any cell center, are
+taken out of the label grid and stored in a sparse coverage matrix next to it,
+each rasterized on its own like zonal_stats.py does (using every cell a small
+polygon touches), so they keep all of their grid cells and the statistics
+match zonal_stats.py.
+
+Cache files are keyed by a hash of the layer (see `hash_layer` in
+hashing.py) and a signature of the grid (CRS, transform, and
+shape), so they are rebuilt whenever either changes. Zonal statistics over a
+cached grid are a `np.bincount` (or a sparse matrix product) over the grid
+cells instead of one rasterization and windowed read per polygon, see
+`--label_grid` in zonal_stats.py.
+
+Example usage:
+    python label_grids.py tas_2050.tif huc12s boroughs ak_gmu ak_protected_areas
+"""
+
+import argparse
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import rasterio as rio
+import scipy.sparse
+import shapely
+from rasterio.features import rasterize
+
+from create_shapefiles import area_layers
+from hashing import hash_layer
+from zonal_stats import load_polygons, polygon_window, rasterize_polygon
+
+label_grid_cache_dir = Path("label_grid_cache")
+# bumped whenever the way label grids are built changes, so older cache files aren't reused
+label_grid_version = 2
+
+
+def get_grid(raster_path):
+    """Get the grid of a raster.
+
+    Args:
+        raster_path (str): Path to the raster
+    Returns:
+        tuple: (CRS, transform, (height, width))
+    """
+    with rio.open(raster_path) as src:
+        return src.crs, src.transform, src.shape
+
+
+def hash_grid(crs, transform, shape):
+    """Hash a grid's CRS, transform, and shape."""
+    signature = json.dumps([crs.to_wkt(), list(transform)[:6], list(shape)])
+    return hashlib.sha256(signature.encode("utf-8")).hexdigest()[:16]
+
+
+def get_layer(layer):
+    """Get the `area_layers` description of a layer name, or a description of a shapefile path."""
+    for area_layer in area_layers:
+        if area_layer["name"] == layer:
+            return area_layer
+    return {"name": Path(layer).stem, "path": layer}
+
+
+class LabelGrid:
+    """The polygons of a layer burned into a grid, as a label grid, a sparse coverage matrix, or both."""
+
+    def __init__(self, ids, shape, labels=None, coverage=None):
+        """
+        Args:
+            ids (list): Id of every polygon, in label order
+            shape (tuple): (height, width) of the grid
+            labels (np.ndarray): Label grid, 1-based position of the polygon of each grid cell or 0 for none
+            coverage (scipy.sparse.csr_array): Sparse coverage matrix of shape (polygons, grid cells), for overlapping layers,
+                or for the polygons that aren't in the label grid
+        """
+        self.ids = list(ids)
+        self.shape = tuple(shape)
+        self.labels = labels
+        self.coverage = coverage
+        self._zone_cells = None
+
+    @property
+    def zone_cells(self):
+        """(polygon position, flat grid cell index) of every grid cell covered by a polygon, sorted by polygon."""
+        if self._zone_cells is None:
+            zones, cells = [], []
+            if self.labels is not None:
+                flat = np.asarray(self.labels).ravel()
+                label_cells = np.flatnonzero(flat)
+                zones.append(flat[label_cells].astype("int64") - 1)
+                cells.append(label_cells)
+            if self.coverage is not None:
+                coo = self.coverage.tocoo()
+                zones.append(coo.row.astype("int64"))
+                cells.append(coo.col.astype("int64"))
+            zones, cells = np.concatenate(zones), np.concatenate(cells)
+            order = np.lexsort((cells, zones))
+            self._zone_cells = (zones[order], cells[order])
+        return self._zone_cells
+
+    def counts(self, valid=None):
+        """Count the (valid) grid cells of every polygon.
+
+        Args:
+            valid (np.ndarray): Boolean grid, True for grid cells with data, defaults to every grid cell
+        Returns:
+            np.ndarray: Number of grid cells per polygon
+        """
+        count = np.zeros(len(self.ids), dtype="int64")
+        if self.labels is not None:
+            labels = np.asarray(self.labels)
+            if valid is not None:
+                labels = labels[valid]
+            count += np.bincount(labels.ravel(), minlength=len(self.ids) + 1)[1:]
+        if self.coverage is not None:
+            weights = (
+                np.ones(self.coverage.shape[1])
+                if valid is None
+                else valid.ravel() * 1.0
+            )
+            count += (self.coverage @ weights).astype("int64")
+        return count
+
+    def zone_stats(self, band, percentiles=()):
+        """Compute the statistics of one band for every polygon.
+
+        Args:
+            band (np.ma.MaskedArray): Band with the grid's shape, masked where there is no data
+            percentiles (list): Percentiles to compute, from 0 to 100, with linear interpolation like `np.percentile`
+        Returns:
+            pd.DataFrame: One row per polygon with the id, count, mean, min, max, and p<percentile>, NaN for polygons without data
+        """
+        values = np.ma.getdata(band).ravel()
+        valid = ~np.ma.getmaskarray(band).ravel()
+        if values.dtype.kind == "f":
+            valid &= ~np.isnan(values)
+
+        n_zones = len(self.ids)
+        count = np.zeros(n_zones, dtype="int64")
+        total = np.zeros(n_zones)
+        if self.labels is not None:
+            # every grid cell belongs to at most one polygon of the label grid
+            labels = np.asarray(self.labels).ravel()[valid]
+            count += np.bincount(labels, minlength=n_zones + 1)[1:]
+            total += np.bincount(labels, values[valid], minlength=n_zones + 1)[1:]
+        if self.coverage is not None:
+            count += (self.coverage @ valid.astype("float64")).astype("int64")
+            total += self.coverage @ np.where(valid, values, 0).astype("float64")
+
+        stats = {"id": self.ids, "count": count}
+        with np.errstate(invalid="ignore", divide="ignore"):
+            stats["mean"] = total / count
+
+        # sort the values of each polygon once for the min, max, and percentiles
+        zones, cells = self.zone_cells
+        keep = valid[cells]
+        zones, zone_values = zones[keep], values[cells[keep]].astype("float64")
+        order = np.lexsort((zone_values, zones))
+        zone_values = zone_values[order]
+        starts = np.concatenate([[0], np.cumsum(count)[:-1]])
+        has_data = count > 0
+
+        def sorted_value(position):
+            """Linearly interpolate the sorted values of each polygon at a 0-based position."""
+            result = np.full(n_zones, np.nan)
+            low = np.floor(position).astype("int64")
+            high = np.minimum(low + 1, count - 1)
+            fraction = position - low
+            result[has_data] = (
+                zone_values[(starts + low)[has_data]] * (1 - fraction[has_data])
+                + zone_values[(starts + high)[has_data]] * fraction[has_data]
+            )
+            return result
+
+        last = np.maximum(count - 1, 0).astype("float64")
+        stats["min"] = sorted_value(np.zeros(n_zones))
+        stats["max"] = sorted_value(last)
+        for percentile in percentiles:
+            stats[f"p{percentile:g}"] = sorted_value(last * percentile / 100)
+        return pd.DataFrame(stats)
+
+
+def get_overlapping_polygons(geometries):
+    """Find the polygons whose interiors overlap another polygon.
+
+    Args:
+        geometries (np.ndarray): Polygons
+    Returns:
+        np.ndarray: Boolean array, True for the polygons that overlap another one
+    """
+    tree = shapely.STRtree(geometries)
+    first, second = tree.query(geometries, predicate="intersects")
+    pairs = first < second
+    first, second = first[pairs], second[pairs]
+    # neighbors that only share an edge intersect too, their interiors don't
+    interiors = shapely.relate_pattern(
+        geometries[first], geometries[second], "T********"
+    )
+    overlapping = np.zeros(len(geometries), dtype=bool)
+    overlapping[first[interiors]] = True
+    overlapping[second[interiors]] = True
+    return overlapping
+
+
+def build_coverage(geometries, positions, transform, shape, n_polygons):
+    """Rasterize polygons one at a time over the window of their bounds into a sparse coverage matrix.
+
+    Args:
+        geometries (list): Polygons in the grid's CRS
+        positions (list): Row of each polygon in the coverage matrix
+        transform (Affine): Transform of the grid
+        shape (tuple): (height, width) of the grid
+        n_polygons (int): Number of rows of the coverage matrix
+    Returns:
+        scipy.sparse.csr_array: Coverage matrix of shape (n_polygons, grid cells)
+    """
+    rows, cols = [], []
+    for position, geometry in zip(positions, geometries):
+        window = polygon_window(transform, shape, geometry.bounds)
+        if window is None:
+            continue
+        inside = rasterize_polygon(
+            geometry,
+            rio.windows.transform(window, transform),
+            (int(window.height), int(window.width)),
+        )
+        window_rows, window_cols = np.nonzero(inside)
+        cells = (window_rows + int(window.row_off)) * shape[1] + (
+            window_cols + int(window.col_off)
+        )
+        rows.append(np.full(len(cells), position))
+        cols.append(cells)
+    return scipy.sparse.csr_array(
+        (
+            np.ones(sum(len(c) for c in cols), dtype="uint8"),
+            (
+                np.concatenate(rows or [np.empty(0, "int64")]),
+                np.concatenate(cols or [np.empty(0, "int64")]),
+            ),
+        ),
+        shape=(n_polygons, shape[0] * shape[1]),
+    )
+
+
+def build_label_grid(layer, crs, transform, shape, id_column="id", sparse=None):
+    """Burn a layer's polygons into a grid.
+
+    Args:
+        layer (dict): Layer description with at least a name and a path, as in `area_layers`
+        crs (rio.crs.CRS): CRS of the grid
+        transform (Affine): Transform of the grid
+        shape (tuple): (height, width) of the grid
+        id_column (str): Column with the id of each polygon
+        sparse (bool): Store a sparse coverage matrix, defaults to True for the layers flagged overlapping in `area_layers`
+    Returns:
+        LabelGrid: The label grid or coverage matrix of the layer
+    """
+    if sparse is None:
+        sparse = layer.get("overlapping", False)
+    polygons = load_polygons(layer["path"], crs, id_column).sort_index()
+    ids = polygons[id_column].tolist()
+    geometries = polygons.geometry.values.to_numpy()
+
+    if sparse:
+        # overlapping polygons are rasterized one at a time over the window of their bounds
+        coverage = build_coverage(
+            geometries, range(len(ids)), transform, shape, len(ids)
+        )
+        return LabelGrid(ids, shape, coverage=coverage)
+
+    labels = rasterize(
+        zip(geometries, range(1, len(ids) + 1)),
+        out_shape=shape,
+        transform=transform,
+        fill=0,
+        dtype=np.min_scalar_type(len(ids)),
+    )
+    # the last of overlapping polygons would take every shared cell, and polygons smaller than a
+    # grid cell may not get any, so both are rasterized on their own into a coverage matrix instead
+    counts = np.bincount(labels.ravel(), minlength=len(ids) + 1)[1:]
+    separate = np.flatnonzero(get_overlapping_polygons(geometries) | (counts == 0))
+    if not len(separate):
+        return LabelGrid(ids, shape, labels=labels)
+    labels[np.isin(labels, separate + 1)] = 0
+    coverage = build_coverage(
+        geometries[separate], separate, transform, shape, len(ids)
+    )
+    print(
+        f"{layer['name']}: {len(separate)} overlapping or small polygons are stored in a sparse coverage next to the label grid"
+    )
+    return LabelGrid(ids, shape, labels=labels, coverage=coverage)
+
+
+def get_cache_path(layer, crs, transform, shape, id_column="id"):
+    """Get the cache path of a layer's label grid for a grid, without the file extension."""
+    return (
+        label_grid_cache_dir
+        / f"{layer['name']}_{id_column}_{hash_layer(layer)}_{hash_grid(crs, transform, shape)}_v{label_grid_version}"
+    )
+
+
+def read_label_grid(cache_path, shape):
+    """Read a cached label grid (memory-mapped) and/or coverage matrix, or None if it isn't cached."""
+    ids_path = cache_path.with_suffix(".json")
+    if not ids_path.exists():
+        return None
+    ids = json.loads(ids_path.read_text(encoding="utf-8"))
+    labels = coverage = None
+    if cache_path.with_suffix(".npy").exists():
+        labels = np.load(cache_path.with_suffix(".npy"), mmap_mode="r")
+    if cache_path.with_suffix(".npz").exists():
+        coverage = scipy.sparse.csr_array(
+            scipy.sparse.load_npz(cache_path.with_suffix(".npz"))
+        )
+    return LabelGrid(ids, shape, labels=labels, coverage=coverage)
+
+
+def write_label_grid(label_grid, cache_path):
+    """Write a label grid as .npy and/or a coverage matrix as compressed .npz, with its ids in .json."""
+    os.makedirs(cache_path.parent, exist_ok=True)
+    # write to temporary files first so an interrupted run never leaves a truncated cache file behind
+    if label_grid.labels is not None:
+        tmp_path = cache_path.with_suffix(".tmp.npy")
+        np.save(tmp_path, label_grid.labels)
+        os.replace(tmp_path, cache_path.with_suffix(".npy"))
+    if label_grid.coverage is not None:
+        tmp_path = cache_path.with_suffix(".tmp.npz")
+        scipy.sparse.save_npz(tmp_path, label_grid.coverage, compressed=True)
+        os.replace(tmp_path, cache_path.with_suffix(".npz"))
+    # the ids are written last, they mark the cache entry as complete
+    tmp_path = cache_path.with_suffix(".tmp.json")
+    tmp_path.write_text(json.dumps(label_grid.ids, default=str), encoding="utf-8")
+    os.replace(tmp_path, cache_path.with_suffix(".json"))
+
+
+def load_label_grid(layer, crs, transform, shape, id_column="id", sparse=None):
+    """Get a layer's label grid for a grid from the cache, building and caching it if needed.
+
+    Args:
+        layer (str): Layer name from `area_layers` or path to a polygon layer
+        crs (rio.crs.CRS): CRS of the grid
+        transform (Affine): Transform of the grid
+        shape (tuple): (height, width) of the grid
+        id_column (str): Column with the id of each polygon
+        sparse (bool): Store a sparse coverage matrix, defaults to True for the layers flagged overlapping in `area_layers`
+    Returns:
+        LabelGrid: The label grid (memory-mapped) or coverage matrix of the layer
+    """
+    layer = get_layer(layer)
+    cache_path = get_cache_path(layer, crs, transform, shape, id_column)
+    label_grid = read_label_grid(cache_path, shape)
+    if label_grid is None:
+        write_label_grid(
+            build_label_grid(layer, crs, transform, shape, id_column, sparse),
+            cache_path,
+        )
+        label_grid = read_label_grid(cache_path, shape)
+    return label_grid
+
+
+def label_grid_zonal_stats(
+    layer, raster_path, bands=None, percentiles=(10, 50, 90), id_column="id"
+):
+    """Compute zonal statistics of a raster for every polygon of a layer from the layer's cached label grid.
+
+    Every band is read whole once and summarized over the label grid, the polygons are never rasterized again for rasters on the same grid.
+
+    Args:
+        layer (str): Layer name from `area_layers` or path to a polygon layer
+        raster_path (str): Path to the raster
+        bands (list): Numbers of the bands to summarize, defaults to every band
+        percentiles (list): Percentiles to compute, from 0 to 100
+        id_column (str): Column with the id of each polygon
+    Returns:
+        pd.DataFrame: One row per (id, band) with the count, mean, min, max, and percentiles, in the order of the layer
+    """
+    crs, transform, shape = get_grid(raster_path)
+    label_grid = load_label_grid(layer, crs, transform, shape, id_column)
+    band_stats = []
+    with rio.open(raster_path) as src:
+        for band in bands or src.indexes:
+            stats = label_grid.zone_stats(src.read(band, masked=True), percentiles)
+            stats.insert(1, "band", band)
+            band_stats.append(stats)
+    # one row per band for each polygon, in the order of the layer
+    return pd.concat(band_stats).sort_index(kind="stable").reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "raster", type=str, help="Raster whose grid the layers are burned into"
+    )
+    parser.add_argument(
+        "layers",
+        type=str,
+        nargs="+",
+        help="Polygon layers, paths or names of layers in area_layers of create_shapefiles.py",
+    )
+    parser.add_argument(
+        "--id_column",
+        type=str,
+        default="id",
+        help="Column with the id of each polygon. Default is id.",
+    )
+    args = parser.parse_args()
+
+    crs, transform, shape = get_grid(args.raster)
+    for layer in args.layers:
+        label_grid = load_label_grid(layer, crs, transform, shape, args.id_column)
+        kind = " and ".join(
+            name
+            for name, part in [
+                ("label grid", label_grid.labels),
+                ("sparse coverage", label_grid.coverage),
+            ]
+            if part is not None
+        )
+        print(
+            f"{layer}: {kind} of {len(label_grid.ids)} polygons, "
+            f"{int((label_grid.counts() > 0).sum())} with grid cells"
+        )
@@ -0,0 +1,131 @@
+"""
+Shared polygon masks (e.g. the IEM AOI) for filtering features and point
+locations. A mask file is read, unioned, and prepared only once per process,
+and the union is also cached on disk as WKB so later runs skip the slow union
+of the source polygons altogether. Containment tests first drop candidates
+whose bounding box doesn't touch any part of the mask, using an STRtree of the
+mask's parts, and only the remaining candidates are tested against the
+prepared union.
+"""
+
+import functools
+import hashlib
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+# unioned mask geometries are cached here as .wkb files
+mask_cache_dir = Path("mask_cache")
+
+
+class Mask:
+    """A prepared mask geometry with an STRtree of its parts for bounding box prefiltering."""
+
+    def __init__(self, geometry):
+        """
+        Args:
+            geometry (shapely.Geometry): Mask (multi)polygon
+        """
+        self.geometry = geometry
+        shapely.prepare(self.geometry)
+        # a multipolygon mask (e.g. the IEM AOI with the Aleutians) has a much tighter set of part bounding boxes than its overall bounding box
+        self.tree = shapely.STRtree(shapely.get_parts(geometry))
+
+    def _candidates(self, geoms):
+        """Get the indices of the geometries whose bounding box intersects the bounding box of some mask part."""
+        input_index, _ = self.tree.query(geoms)
+        return np.unique(input_index)
+
+    def within(self, geoms):
+        """Test which geometries are within the mask.
+
+        Args:
+            geoms (array-like): Geometries in the mask CRS
+        Returns:
+            np.ndarray: Boolean array, True where the geometry is within the mask
+        """
+        geoms = np.asarray(geoms, dtype=object)
+        result = np.zeros(len(geoms), dtype=bool)
+        candidates = self._candidates(geoms)
+        result[candidates] = shapely.contains(self.geometry, geoms[candidates])
+        return result
+
+    def contains_xy(self, x, y):
+        """Test which points are within the mask.
+
+        Args:
+            x (array-like): x coordinates in the mask CRS
+            y (array-like): y coordinates in the mask CRS
+        Returns:
+            np.ndarray: Boolean array, True where the point is within the mask
+        """
+        x = np.asarray(x, dtype="float64")
+        y = np.asarray(y, dtype="float64")
+        result = np.zeros(len(x), dtype=bool)
+        candidates = self._candidates(shapely.points(x, y))
+        result[candidates] = shapely.contains_xy(
+            self.geometry, x[candidates], y[candidates]
+        )
+        return result
+
+
+def hash_mask_file(path):
+    """Hash a mask shapefile's geometries and CRS so the cached union is rebuilt when the source changes.
+
+    Args:
+        path (Path): Path to the mask .shp file
+    Returns:
+        str: Hex digest of the .shp and .prj files
+    """
+    digest = hashlib.sha256()
+    for sidecar in [path, path.with_suffix(".prj")]:
+        if sidecar.exists():
+            with open(sidecar, "rb") as f:
+                for chunk in iter(lambda: f.read(2**20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_mask_union(path, epsg):
+    """Get the union of a mask file's polygons in a CRS from the cache, building and caching it if needed.
+
+    Args:
+        path (Path): Path to the mask .shp file
+        epsg (int): EPSG code of the CRS the mask is needed in
+    Returns:
+        shapely.Geometry: The unioned mask geometry
+    """
+    cache_path = mask_cache_dir / f"{path.stem}_{epsg}_{hash_mask_file(path)[:16]}.wkb"
+    if cache_path.exists():
+        return shapely.from_wkb(cache_path.read_bytes())
+
+    mask_gdf = gpd.read_file(path)
+    mask_gdf.to_crs(epsg, inplace=True)
+    union = mask_gdf.geometry.union_all()
+
+    os.makedirs(mask_cache_dir, exist_ok=True)
+    # write to a temporary file first so an interrupted run never leaves a truncated cache file behind
+    tmp_path = cache_path.with_suffix(".tmp")
+    tmp_path.write_bytes(shapely.to_wkb(union))
+    os.replace(tmp_path, cache_path)
+    return union
+
+
+@functools.lru_cache(maxsize=None)
+def _load_mask(path, epsg):
+    return Mask(get_mask_union(path, epsg))
+
+
+def load_mask(path, epsg=4326):
+    """Load a mask file as a single prepared Mask, reusing the one already loaded for the same file and CRS.
+
+    Args:
+        path (str or Path): Path to the mask .shp file
+        epsg (int): EPSG code of the CRS the mask is needed in
+    Returns:
+        Mask: The shared mask
+    """
+    return _load_mask(Path(path).resolve(), epsg)
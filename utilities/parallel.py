@@ -0,0 +1,101 @@
+"""
+Helpers for fanning the point location pipelines out over a process pool, one
+task per region CSV (or layer, or chunk). Each task's printed output is
+captured in the worker and printed by the parent once the task is done, in
+submission order, so the logs of regions processed at the same time don't
+interleave.
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+
+def get_mp_context():
+    """Get a multiprocessing context that uses fork where the OS allows it.
+
+    Forked workers inherit everything the parent process has already loaded (e.g. the coastline or a cached index) as copy-on-write memory instead of loading or pickling their own copy.
+
+    Returns:
+        multiprocessing.context.BaseContext: Multiprocessing context for the process pool
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def default_workers():
+    """Get the default number of worker processes, one per available core."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def run_with_captured_output(func, item):
+    """Run func(item) and capture everything it prints.
+
+    Args:
+        func (callable): Function to run
+        item: Argument to pass to func
+    Returns:
+        tuple: (result or None, captured output, True if func raised an exception)
+    """
+    buffer = io.StringIO()
+    failed = False
+    result = None
+    with contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(buffer):
+        try:
+            result = func(item)
+        except Exception:
+            traceback.print_exc()
+            failed = True
+    return result, buffer.getvalue(), failed
+
+
+def run_in_process_pool(func, items, workers=None, labels=None, skip_empty_logs=False):
+    """Run func over every item in a process pool and print the merged logs.
+
+    With a single worker the items are processed serially in this process and output is printed as it happens.
+
+    Args:
+        func (callable): Module-level function that takes one item
+        items (list): Items to process
+        workers (int): Number of worker processes, defaults to one per available core
+        labels (list): Label printed above each item's log, defaults to str(item)
+        skip_empty_logs (bool): Don't print the label of items that printed nothing, e.g. for many small chunks of the same job
+    Returns:
+        list: Results of func for each item, in the same order as items
+    """
+    items = list(items)
+    if labels is None:
+        labels = [str(item) for item in items]
+    if workers is None:
+        workers = default_workers()
+    workers = max(1, min(workers, len(items)))
+
+    if workers == 1:
+        return [func(item) for item in items]
+
+    results = []
+    failures = []
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=get_mp_context()
+    ) as executor:
+        futures = [
+            executor.submit(run_with_captured_output, func, item) for item in items
+        ]
+        for label, future in zip(labels, futures):
+            result, log, failed = future.result()
+            if log or not skip_empty_logs:
+                print(f"##### {label}")
+                print(log, end="")
+            if failed:
+                failures.append(label)
+            results.append(result)
+    if failures:
+        raise RuntimeError(f"Processing failed for: {', '.join(failures)}")
+    return results
@@ -0,0 +1,232 @@
+"""
+Sample the values of one or more rasters at every community in
+vector_data/point/*.csv, and write them to a tidy CSV with one row per
+(community, location, raster, band).
+
+The coordinates of all communities are transformed to the CRS of a raster and
+turned into row and column indices in one vectorized call per raster. The
+points are then grouped by the raster block they fall in and each block is
+read once, for every band at once, instead of doing one read per point.
+Rasters are processed in parallel across a process pool.
+
+With --ocean, coastal communities (is_coastal) are also sampled at their
+nearest ocean neighbor (ocean_lat1 / ocean_lon1, see
+find_nearest_raster_neighbors.py), for rasters that only have data over the
+ocean such as sea ice. Those rows have "ocean" as location, and the community
+rows have "community".
+
+Example usage:
+    python sample_rasters.py tas_2050.tif pr_2050.tif --output community_values.csv
+    python sample_rasters.py hsia_mask.tif --bands 1 --ocean
+"""
+
+import argparse
+import functools
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from rasterio.warp import transform
+
+from parallel import run_in_process_pool
+
+
+def load_sample_points(ocean=False):
+    """Load the points to sample from every point location CSV.
+
+    Args:
+        ocean (bool): Also include the nearest ocean neighbor of every coastal community
+    Returns:
+        pd.DataFrame: id, location ("community" or "ocean"), latitude, and longitude of every point
+    """
+    communities = pd.concat(
+        [
+            pd.read_csv(path, dtype={"id": str})
+            for path in sorted(glob.iglob("../vector_data/point/*.csv"))
+        ],
+        ignore_index=True,
+    )
+    points = [communities[["id", "latitude", "longitude"]].assign(location="community")]
+    if ocean:
+        coastal = communities[
+            communities["is_coastal"].fillna(False).astype(bool)
+            & communities["ocean_lat1"].notna()
+            & communities["ocean_lon1"].notna()
+        ]
+        points.append(
+            pd.DataFrame(
+                {
+                    "id": coastal["id"],
+                    "latitude": coastal["ocean_lat1"],
+                    "longitude": coastal["ocean_lon1"],
+                    "location": "ocean",
+                }
+            )
+        )
+    return pd.concat(points, ignore_index=True)[
+        ["id", "location", "latitude", "longitude"]
+    ]
+
+
+def get_rows_cols(src, latitudes, longitudes):
+    """Get the row and column of the grid cell under every point.
+
+    Args:
+        src (rio.io.DatasetReader): rio dataset reader object
+        latitudes (np.ndarray): Latitudes of the points
+        longitudes (np.ndarray): Longitudes of the points
+    Returns:
+        tuple: (rows, cols) as int64 arrays, -1 for points outside of the raster
+    """
+    if src.crs == "EPSG:4326":
+        xs, ys = np.asarray(longitudes), np.asarray(latitudes)
+    else:
+        xs, ys = transform("EPSG:4326", src.crs, list(longitudes), list(latitudes))
+        xs, ys = np.asarray(xs), np.asarray(ys)
+    # the inverse affine transform maps x and y to fractional column and row
+    cols, rows = ~src.transform * (xs, ys)
+    rows = np.floor(rows)
+    cols = np.floor(cols)
+    inside = (
+        (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+    ) & np.isfinite(rows + cols)
+    rows = np.where(inside, rows, -1).astype("int64")
+    cols = np.where(inside, cols, -1).astype("int64")
+    return rows, cols
+
+
+def sample_raster(raster_path, latitudes, longitudes, bands=None):
+    """Sample a raster at every point, reading each raster block under the points only once.
+
+    Args:
+        raster_path (str): Path to the raster
+        latitudes (np.ndarray): Latitudes of the points
+        longitudes (np.ndarray): Longitudes of the points
+        bands (list): Numbers of the bands to sample, defaults to every band
+    Returns:
+        tuple: (band numbers, float64 array of shape (bands, points) with NaN for nodata and points outside of the raster, number of blocks read)
+    """
+    with rio.open(raster_path) as src:
+        bands = list(bands or src.indexes)
+        values = np.full((len(bands), len(latitudes)), np.nan)
+        rows, cols = get_rows_cols(src, latitudes, longitudes)
+        inside = np.flatnonzero(rows >= 0)
+
+        block_height, block_width = src.block_shapes[bands[0] - 1]
+        block_rows = rows[inside] // block_height
+        block_cols = cols[inside] // block_width
+        # sort the points by block, so the points of each block are one contiguous slice
+        block_keys = block_rows * -(-src.width // block_width) + block_cols
+        order = np.argsort(block_keys, kind="stable")
+        inside, block_keys = inside[order], block_keys[order]
+        starts = np.flatnonzero(np.diff(block_keys, prepend=-1))
+        ends = np.append(starts[1:], len(inside))
+
+        for start, end in zip(starts, ends):
+            points = inside[start:end]
+            block_row = rows[points[0]] // block_height
+            block_col = cols[points[0]] // block_width
+            window = rio.windows.Window(
+                block_col * block_width,
+                block_row * block_height,
+                min(block_width, src.width - block_col * block_width),
+                min(block_height, src.height - block_row * block_height),
+            )
+            block = src.read(bands, window=window, masked=True)
+            block_values = block[
+                :,
+                rows[points] - block_row * block_height,
+                cols[points] - block_col * block_width,
+            ]
+            values[:, points] = np.ma.filled(block_values.astype("float64"), np.nan)
+    return bands, values, len(starts)
+
+
+def sample_raster_points(raster_path, points, bands=None):
+    """Sample one raster at every point and make a tidy table of the values.
+
+    Args:
+        raster_path (str): Path to the raster
+        points (pd.DataFrame): Points from `load_sample_points`
+        bands (list): Numbers of the bands to sample, defaults to every band
+    Returns:
+        pd.DataFrame: One row per (point, band) with the id, location, raster, band, and value
+    """
+    bands, values, n_blocks = sample_raster(
+        raster_path,
+        points["latitude"].to_numpy(),
+        points["longitude"].to_numpy(),
+        bands,
+    )
+    print(
+        f"{os.path.basename(raster_path)}: sampled {len(points)} points in {n_blocks} block reads"
+    )
+    return pd.DataFrame(
+        {
+            "id": np.tile(points["id"].to_numpy(), len(bands)),
+            "location": np.tile(points["location"].to_numpy(), len(bands)),
+            "raster": os.path.basename(raster_path),
+            "band": np.repeat(bands, len(points)),
+            "value": values.ravel(),
+        }
+    )
+
+
+def sample_rasters(raster_paths, bands=None, ocean=False, workers=None):
+    """Sample every raster at every community.
+
+    Args:
+        raster_paths (list): Paths to the rasters
+        bands (list): Numbers of the bands to sample, defaults to every band of each raster
+        ocean (bool): Also sample coastal communities at their nearest ocean neighbor
+        workers (int): Number of worker processes, defaults to one per available core
+    Returns:
+        pd.DataFrame: One row per (community, location, raster, band) with the value
+    """
+    points = load_sample_points(ocean)
+    results = run_in_process_pool(
+        functools.partial(sample_raster_points, points=points, bands=bands),
+        raster_paths,
+        workers=workers,
+    )
+    return pd.concat(results, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("rasters", type=str, nargs="+", help="Paths to the rasters")
+    parser.add_argument(
+        "--bands",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Bands to sample. Default is every band.",
+    )
+    parser.add_argument(
+        "--ocean",
+        action="store_true",
+        help="Also sample coastal communities at their nearest ocean neighbor (ocean_lat1, ocean_lon1).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of rasters to sample at the same time. Default is one per core.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="raster_samples.csv",
+        help="Path of the output CSV. Default is raster_samples.csv.",
+    )
+    args = parser.parse_args()
+
+    samples = sample_rasters(args.rasters, args.bands, args.ocean, args.workers)
+    samples.to_csv(args.output, index=False)
+    print(
+        f"Wrote {len(samples)} values ({samples['value'].notna().sum()} with data) to {args.output}"
+    )
@@ -0,0 +1,255 @@
+"""
+Generalize every layer in the `area_layers` registry of create_shapefiles.py at
+several tolerances (10 m, 100 m, and 1 km by default) and write the merged
+areas of each level, plus a manifest of the method and vertex counts per layer,
+to all_places/simplified. See USAGE.MD for how the method of a layer is picked.
+
+Example usage:
+    python simplify_layers.py
+    python simplify_layers.py --tolerances 10 100 1000 5000 --formats parquet fgb
+"""
+
+import argparse
+import functools
+import json
+import os
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+from create_shapefiles import (
+    area_layers,
+    load_area_layers,
+    write_flatgeobuf,
+    write_geoparquet,
+)
+from parallel import run_in_process_pool
+
+# equal distance units (meters) over Alaska, as used by simplify_huc12.py
+simplify_crs = 3338
+output_dir = "all_places/simplified"
+# vertices are snapped to this grid (in meters) to make nearly matching shared edges match exactly
+snap_grid_m = 1
+writers = {"parquet": write_geoparquet, "fgb": write_flatgeobuf}
+
+
+def get_invalid_coverage_polygons(geoms):
+    """Find the polygons with edges that don't match their neighbors' or that overlap them.
+
+    Args:
+        geoms (np.ndarray): Projected polygons
+    Returns:
+        np.ndarray: Boolean array, True for the polygons that break the coverage
+    """
+    return ~shapely.is_empty(shapely.coverage_invalid_edges(geoms))
+
+
+def simplify_coverage(geoms, tolerance):
+    """Simplify polygons as a coverage, falling back to per polygon simplification where that fails.
+
+    Args:
+        geoms (np.ndarray): Projected polygons that form a valid coverage
+        tolerance (float): Simplification tolerance in CRS units
+    Returns:
+        tuple: (simplified polygons, number of polygons that needed the fallback)
+    """
+    simplified = shapely.coverage_simplify(geoms, tolerance)
+    fallback = ~shapely.is_valid(simplified) | shapely.is_empty(simplified)
+    simplified[fallback] = shapely.simplify(
+        geoms[fallback], tolerance, preserve_topology=True
+    )
+    return simplified, int(fallback.sum())
+
+
+def prepare_coverage(geoms, overlapping=False):
+    """Pick the simplification method for a layer's polygons.
+
+    Polygons are never repaired into a coverage (e.g. with `shapely.coverage_clean`), since that moves land from one polygon to another.
+
+    Args:
+        geoms (np.ndarray): Projected polygons
+        overlapping (bool): The polygons are expected to overlap, so they are simplified on their own
+    Returns:
+        tuple: (method name, polygons to simplify, reason for the method), the method is "coverage", "snapped_coverage", or "polygon"
+    """
+    if overlapping:
+        return "polygon", geoms, "flagged overlapping in area_layers"
+    if shapely.coverage_is_valid(geoms):
+        return "coverage", geoms, "valid coverage"
+    snapped = shapely.set_precision(geoms, snap_grid_m)
+    if shapely.coverage_is_valid(snapped):
+        return (
+            "snapped_coverage",
+            snapped,
+            f"valid coverage after snapping to {snap_grid_m} m",
+        )
+    invalid = int(get_invalid_coverage_polygons(snapped).sum())
+    return (
+        "polygon",
+        geoms,
+        f"not a valid coverage after snapping to {snap_grid_m} m ({invalid} of {len(geoms)} polygons with invalid edges)",
+    )
+
+
+def simplify_area_layer(item, tolerances):
+    """Simplify one layer of `area_layers` at every tolerance.
+
+    Args:
+        item (tuple): (layer description from `area_layers`, layer from `load_area_layer`)
+        tolerances (list): Tolerances in meters
+    Returns:
+        tuple: See `simplify_layer`
+    """
+    layer, layer_gdf = item
+    return simplify_layer(
+        layer_gdf, tolerances, overlapping=layer.get("overlapping", False)
+    )
+
+
+def simplify_layer(layer_gdf, tolerances, overlapping=False):
+    """Simplify one layer at every tolerance.
+
+    Coverages are simplified with `shapely.coverage_simplify`, which keeps the shared edges of neighbors identical but keeps more vertices than simplifying each
+    polygon on its own, so the vertex counts of per polygon simplification are measured too and recorded as "polygon_vertices" for comparison.
+
+    Args:
+        layer_gdf (gpd.GeoDataFrame): Layer in EPSG:4326 from `load_area_layer`
+        tolerances (list): Tolerances in meters
+        overlapping (bool): The polygons are expected to overlap, so they are simplified on their own
+    Returns:
+        tuple: (dict mapping tolerance to the simplified layer in EPSG:4326, layer statistics dict)
+    """
+    projected = layer_gdf.to_crs(simplify_crs)
+    method, geoms, reason = prepare_coverage(
+        projected.geometry.values.to_numpy(), overlapping
+    )
+    coverage = method != "polygon"
+    stats = {
+        "polygons": len(geoms),
+        "method": method,
+        "reason": reason,
+        "vertices": {"0": int(shapely.get_num_coordinates(geoms).sum())},
+    }
+    if coverage:
+        stats["polygon_vertices"] = {}
+        stats["fallback_polygons"] = {}
+    elif not overlapping:
+        print(f"Warning: {reason}, simplifying each polygon on its own")
+    levels = {0: layer_gdf}
+    for tolerance in tolerances:
+        per_polygon = shapely.simplify(geoms, tolerance, preserve_topology=True)
+        if coverage:
+            simplified, fallbacks = simplify_coverage(geoms, tolerance)
+            stats["polygon_vertices"][str(tolerance)] = int(
+                shapely.get_num_coordinates(per_polygon).sum()
+            )
+            stats["fallback_polygons"][str(tolerance)] = fallbacks
+            if fallbacks:
+                print(
+                    f"Warning: {fallbacks} polygons simplified on their own at {tolerance} m"
+                )
+        else:
+            simplified = per_polygon
+        stats["vertices"][str(tolerance)] = int(
+            shapely.get_num_coordinates(simplified).sum()
+        )
+        levels[tolerance] = projected.set_geometry(
+            gpd.GeoSeries(simplified, index=projected.index, crs=simplify_crs)
+        ).to_crs(4326)
+    return levels, stats
+
+
+def simplify_layers(
+    layers=area_layers, tolerances=(10, 100, 1000), formats=("parquet",), workers=None
+):
+    """Simplify every layer at every tolerance and write the merged levels and the manifest.
+
+    Args:
+        layers (list): Layer descriptions from `area_layers`
+        tolerances (list): Tolerances in meters
+        formats (list): Output formats, keys of `writers`
+        workers (int): Number of worker processes used to simplify the layers, defaults to one per available core
+    Returns:
+        dict: The manifest
+    """
+    tolerances = sorted(set(tolerances))
+    layer_gdfs = load_area_layers(layers)
+    # layers are simplified in separate processes, coverage_simplify isn't safe to run from several threads at once
+    results = run_in_process_pool(
+        functools.partial(simplify_area_layer, tolerances=tolerances),
+        list(zip(layers, layer_gdfs)),
+        workers=workers,
+        labels=[layer["name"] for layer in layers],
+    )
+
+    manifest = {"crs": simplify_crs, "levels": [], "layers": []}
+    for layer, (_, stats) in zip(layers, results):
+        manifest["layers"].append({"layer": layer["name"], **stats})
+        print(
+            f"{layer['name']} ({stats['method']}): "
+            + ", ".join(
+                f"{tol} m: {n} vertices" for tol, n in stats["vertices"].items()
+            )
+        )
+
+    os.makedirs(output_dir, exist_ok=True)
+    for tolerance in [0] + tolerances:
+        merged = pd.concat([levels[tolerance] for levels, _ in results])
+        level = {
+            "tolerance_m": tolerance,
+            "vertices": int(shapely.get_num_coordinates(merged.geometry.values).sum()),
+            "files": {},
+        }
+        for output_format in formats:
+            path = f"{output_dir}/all_areas_{tolerance}m.{output_format}"
+            writers[output_format](merged, path)
+            level["files"][output_format] = {
+                "path": path,
+                "bytes": os.path.getsize(path),
+            }
+        manifest["levels"].append(level)
+
+    with open(f"{output_dir}/manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--tolerances",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000],
+        help="Simplification tolerances in meters. Default is 10 100 1000.",
+    )
+    parser.add_argument(
+        "--formats",
+        type=str,
+        nargs="+",
+        choices=list(writers),
+        default=["parquet"],
+        help="Output formats for each level. Default is parquet.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes used to simplify the layers. Default is one per core.",
+    )
+    args = parser.parse_args()
+
+    manifest = simplify_layers(
+        tolerances=args.tolerances,
+        formats=args.formats,
+        workers=args.workers,
+    )
+    for level in manifest["levels"]:
+        sizes = ", ".join(
+            f"{fmt}: {file['bytes'] / 2**20:.1f} MiB"
+            for fmt, file in level["files"].items()
+        )
+        print(f"{level['tolerance_m']} m: {level['vertices']} vertices ({sizes})")
@@ -4,151 +4,276 @@ files. It will overwrite any existing tag in the tags column currently, but we
 can modify this script to be more sophisticated as needed. The script outputs
 the tagged CSVs to a new directory called "tagged_csvs", from where they can be
 copied into the vector_data/point directory.
+
+Which tags are added is described in a rules file (tagging_rules.json by
+default) rather than in this script. With --incremental, only rows whose id or
+coordinates changed since the last run (or every row, if the rules or a mask
+file changed) are re-evaluated against the tagging polygons.
 """
 
+import argparse
+import hashlib
+import json
 import os
 import csv
 import glob
 import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point, box
+from pyproj import Transformer
+from shapely.geometry import box
+
+from masks import Mask, load_mask
 
 # ardac = ARDAC Explorer
 # awe = Alaska Wildfire Explorer
 # eds = Arctic-EDS
 # ncr = Northern Climate Reports
 
-file_tags = {
-    "alaska_point_locations.csv": ["eds", "ardac", "awe"],
-}
-
-tags_for_all_locations = ["ardac"]
-
-check_within_iem = [
-    "alaska_point_locations.csv",
-    "british_columbia_point_locations.csv",
-    "yukon_point_locations.csv",
-]
-
-check_within_aqi_geotiff = [
-    "british_columbia_point_locations.csv",
-    "yukon_point_locations.csv",
-]
-
-# Military sites to include in Arctic-EDS but no other webapps
-eds_only = [
-    "AK557",
-    "AK558",
-    "AK559",
-    "AK560",
-    "AK561",
-    "AK562",
-    "AK563",
-    "AK564",
-    "AK565",
-    "AK566",
-    "AK567",
-    "AK568",
-    "AK569",
-    "AK570",
-    "AK571",
-    "AK572",
-    "AK573",
-    "AK574",
-    "AK575",
-    "AK576",
-    "AK577",
-    "AK578",
-    "AK579",
-    "AK580",
-    "AK581",
-    "AK582",
-    "AK583",
-    "AK584",
-    "AK585",
-]
-
-if not os.path.exists("tagged_csvs"):
-    os.makedirs("tagged_csvs")
-
-# Load the IEM AOI mask
-iem_gdf = gpd.read_file(
-    "../vector_data/polygon/boundaries/iem_with_ak_aleutians/iem_with_ak_aleutians.shp"
-)
-iem_gdf.to_crs(4326, inplace=True)
-
-# BBOX coordinates taken from an example aqi_forecast_24_hrs.tif file
-aqi_bbox = box(-1783505.405, 484131.432, 1134455.303, 2733401.487)
-aqi_gdf = gpd.GeoDataFrame({"geometry": [aqi_bbox]}, crs="EPSG:3338")
-
-
-def add_tags_within_polygon(communities, polygon_gdf, tag):
-    """Tag communities with provided tag if they are within the polygon_gdf"""
-    # Ensure communities are in the same CRS as polygon_gdf
-
-    # Find communities within the polygon_gdf
-    polygon_communities = communities.to_crs(polygon_gdf.crs).within(
-        polygon_gdf.geometry.unary_union
-    )
+# the rules file has these keys:
+# tags_for_all_locations: tags added to every community
+# file_tags: tags added to every community in a given CSV file
+# eds_only: ids of military sites to include in Arctic-EDS but no other webapps
+# polygon_tags: tags added to communities within a polygon, for the listed CSV
+#   files. The polygon is either a "path" to a shapefile or a "bbox" with a "crs".
+
+# per-row hashes and tags from the last run, used by --incremental
+state_path = "tagged_csvs/tag_state.csv"
+
+
+def load_rules(rules_path):
+    """Load the tagging rules file."""
+    with open(rules_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def hash_rules(rules):
+    """Hash the tagging rules and the contents of every mask file they reference.
+
+    Args:
+        rules (dict): Tagging rules from `load_rules`
+    Returns:
+        str: Hex digest that changes whenever the rules or a mask file change
+    """
+    digest = hashlib.sha256(json.dumps(rules, sort_keys=True).encode("utf-8"))
+    for rule in rules["polygon_tags"]:
+        if "path" in rule:
+            with open(rule["path"], "rb") as f:
+                for chunk in iter(lambda: f.read(2**20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()[:16]
+
 
-    # Filter out communities that are in eds_only
-    polygon_communities = polygon_communities & ~communities["id"].isin(eds_only)
+def load_polygon_masks(rules):
+    """Load each tagging polygon once as a prepared mask for fast repeated containment tests.
 
-    # Tag remaining communities with provided tag
-    tags = communities.loc[polygon_communities, "tags"].str.split(",")
-    tags = tags.apply(lambda x: x + [tag])
-    tags = tags.apply(sorted)
-    communities.loc[polygon_communities, "tags"] = tags.apply(lambda x: ",".join(x))
+    Args:
+        rules (dict): Tagging rules from `load_rules`
+    Returns:
+        dict: Maps tag to a (masks.Mask, EPSG code of the mask CRS) tuple
+    """
+    masks = {}
+    for rule in rules["polygon_tags"]:
+        if "path" in rule:
+            mask = load_mask(rule["path"])
+            mask_epsg = 4326
+        else:
+            mask = Mask(box(*rule["bbox"]))
+            mask_epsg = rule["crs"]
+        masks[rule["tag"]] = (mask, mask_epsg)
+    return masks
 
-    return communities
 
+def points_within_mask(communities, mask, mask_epsg):
+    """Test which communities fall within a prepared mask, vectorized over all communities.
 
-for path in glob.iglob("../vector_data/point/*.csv"):
-    file = os.path.basename(path)
-    communities = pd.read_csv(path)
-    columns = communities.columns
+    Args:
+        communities (pd.DataFrame): Point locations with latitude and longitude columns
+        mask (masks.Mask): Prepared mask
+        mask_epsg (int): EPSG code of the mask CRS
+    Returns:
+        np.ndarray: Boolean array, True where the community is within the mask
+    """
+    x = communities["longitude"].to_numpy(dtype="float64")
+    y = communities["latitude"].to_numpy(dtype="float64")
+    if mask_epsg != 4326:
+        transformer = Transformer.from_crs(4326, mask_epsg, always_xy=True)
+        x, y = transformer.transform(x, y)
+    return mask.contains_xy(x, y)
 
-    if "tags" not in communities.columns:
-        communities["tags"] = ""
-        columns = list(columns) + ["tags"]
+
+def needs_polygon_tests(file, rules):
+    """Check if any polygon tag applies to a CSV file."""
+    return any(file in rule["files"] for rule in rules["polygon_tags"])
+
+
+def build_tag_matrix(communities, file, masks, rules):
+    """Build a boolean matrix with one column per tag and one row per community.
+
+    Args:
+        communities (pd.DataFrame): Point locations from one CSV
+        file (str): Name of the CSV file, used to look up the file specific tags and checks
+        masks (dict): Prepared polygon masks from `load_polygon_masks`
+        rules (dict): Tagging rules from `load_rules`
+    Returns:
+        pd.DataFrame: Boolean tag matrix with the same index as communities
+    """
+    is_eds_only = communities["id"].isin(rules["eds_only"]).to_numpy()
+    tags = rules["tags_for_all_locations"] + rules["file_tags"].get(file, [])
+    polygon_tags = [rule["tag"] for rule in rules["polygon_tags"]]
+    tag_names = sorted(set(tags + polygon_tags + ["eds"]))
+    tag_matrix = pd.DataFrame(False, index=communities.index, columns=tag_names)
 
     # Add "eds" to all communities with ID in eds_only
-    communities["tags"] = communities["tags"].astype(str)
-    communities.loc[communities["id"].isin(eds_only), "tags"] = "eds"
+    tag_matrix.loc[is_eds_only, "eds"] = True
 
     # Add tags to communities that are not in eds_only
-    tags = tags_for_all_locations.copy()
-
-    if file in file_tags:
-        tags += file_tags[file]
-    communities.loc[~communities["id"].isin(eds_only), "tags"] = ",".join(tags)
-
-    if file in check_within_iem:
-        geometries = [
-            Point(xy) for xy in zip(communities["longitude"], communities["latitude"])
-        ]
-        communities = gpd.GeoDataFrame(
-            communities, geometry=geometries, crs="EPSG:4326"
-        )
+    for tag in tags:
+        tag_matrix.loc[~is_eds_only, tag] = True
+
+    for rule in rules["polygon_tags"]:
+        if file in rule["files"]:
+            mask, mask_epsg = masks[rule["tag"]]
+            tag_matrix[rule["tag"]] |= (
+                points_within_mask(communities, mask, mask_epsg) & ~is_eds_only
+            )
+
+    return tag_matrix
+
+
+def serialize_tags(tag_matrix):
+    """Serialize a boolean tag matrix to sorted, comma-separated tag strings.
+
+    Args:
+        tag_matrix (pd.DataFrame): Boolean tag matrix from `build_tag_matrix`
+    Returns:
+        pd.Series: Comma-separated tags for each row
+    """
+    tags = pd.Series("", index=tag_matrix.index, dtype=object)
+    for tag in sorted(tag_matrix.columns):
+        tags = tags.where(~tag_matrix[tag], tags + "," + tag)
+    return tags.str.lstrip(",")
 
-        communities = add_tags_within_polygon(communities, iem_gdf, "ncr")
-        communities = add_tags_within_polygon(communities, aqi_gdf, "awe")
 
-        # Remove the geometry column before writing to CSV
-        communities = communities.drop(columns="geometry")
+def hash_rows(communities):
+    """Hash the id and coordinates of each row, vectorized over all rows.
 
-    # Sort tags and remove duplicates if they exist
-    communities["tags"] = communities["tags"].str.split(",")
-    communities["tags"] = communities["tags"].apply(set).apply(list).apply(sorted)
-    communities["tags"] = communities["tags"].apply(lambda x: ",".join(x))
+    Args:
+        communities (pd.DataFrame): Point locations from one CSV
+    Returns:
+        np.ndarray: int64 hash for each row
+    """
+    hashes = pd.util.hash_pandas_object(
+        communities[["id", "latitude", "longitude"]], index=False
+    )
+    return hashes.to_numpy().view("int64")
+
+
+def load_tag_state():
+    """Load the per-row hashes and tags from the last run, or an empty table if there is none."""
+    # nullable integers keep the hashes exact when rows without a previous hash are filled in with missing values
+    dtypes = {
+        "file": str,
+        "id": str,
+        "row_hash": "Int64",
+        "rules_hash": str,
+        "tags": str,
+    }
+    if not os.path.exists(state_path):
+        return pd.DataFrame(columns=list(dtypes)).astype(dtypes)
+    return pd.read_csv(state_path, dtype=dtypes, keep_default_na=False)[list(dtypes)]
 
+
+def write_tagged_csv(communities, columns, output_path):
+    """Write the tagged communities to a CSV with the original column order."""
     # Replace all nans with empty strings
     communities = communities.fillna("")
 
     # Convert back to a list of dicts
     new_csv = communities.to_dict("records")
 
-    with open(f"tagged_csvs/{file}", "w") as f:
+    with open(output_path, "w") as f:
         writer = csv.DictWriter(f, fieldnames=columns)
         writer.writeheader()
         writer.writerows(new_csv)
+
+
+def tag_point_locations(rules_path="tagging_rules.json", incremental=False):
+    """Tag every point location CSV and write the results to the tagged_csvs directory.
+
+    Args:
+        rules_path (str): Path to the tagging rules file
+        incremental (bool): Reuse the tags from the last run for rows whose id and coordinates are unchanged
+    """
+    os.makedirs("tagged_csvs", exist_ok=True)
+    rules = load_rules(rules_path)
+    rules_hash = hash_rules(rules)
+    previous_state = load_tag_state() if incremental else load_tag_state().iloc[:0]
+    # masks are only loaded if some row actually needs a polygon test
+    masks = None
+    new_state = []
+
+    for path in sorted(glob.iglob("../vector_data/point/*.csv")):
+        file = os.path.basename(path)
+        communities = pd.read_csv(path)
+        columns = list(communities.columns)
+
+        if "tags" not in communities.columns:
+            columns = columns + ["tags"]
+
+        row_hashes = hash_rows(communities)
+        previous = (
+            previous_state[
+                (previous_state["file"] == file)
+                & (previous_state["rules_hash"] == rules_hash)
+            ]
+            .drop_duplicates("id")
+            .set_index("id")
+            .reindex(communities["id"])
+        )
+        # rows with duplicated ids can't be matched to their previous state, so they are always re-evaluated
+        unchanged = (previous["row_hash"] == row_hashes).fillna(False).to_numpy(
+            dtype=bool
+        ) & ~communities["id"].duplicated(keep=False).to_numpy()
+        changed = communities[~unchanged]
+
+        tags = pd.Series(previous["tags"].to_numpy(), index=communities.index)
+        if not changed.empty:
+            if masks is None and needs_polygon_tests(file, rules):
+                masks = load_polygon_masks(rules)
+            tag_matrix = build_tag_matrix(changed, file, masks, rules)
+            tags.loc[changed.index] = serialize_tags(tag_matrix)
+        communities["tags"] = tags
+        print(f"{file}: re-evaluated {len(changed)} of {len(communities)} rows")
+
+        write_tagged_csv(communities, columns, f"tagged_csvs/{file}")
+        new_state.append(
+            pd.DataFrame(
+                {
+                    "file": file,
+                    "id": communities["id"],
+                    "row_hash": row_hashes,
+                    "rules_hash": rules_hash,
+                    "tags": communities["tags"],
+                }
+            )
+        )
+
+    pd.concat(new_state, ignore_index=True).to_csv(state_path, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--rules",
+        type=str,
+        default="tagging_rules.json",
+        help="Path to the tagging rules file. Default is tagging_rules.json.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only re-evaluate rows whose id or coordinates changed since the last run.",
+    )
+    args = parser.parse_args()
+    tag_point_locations(args.rules, args.incremental)
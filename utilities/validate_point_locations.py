@@ -0,0 +1,325 @@
+"""
+Validate every point location CSV in vector_data/point against the data model
+in the README and write a machine-readable JSON report. The CSVs are streamed
+in chunks and the following rules are checked:
+
+    precision: latitude, longitude, ocean_lat1 and ocean_lon1 have at most 4 decimals
+    id_format: ids are a two letter region prefix followed by an integer, with
+        the same prefix for every id in a CSV (as parsed by
+        get_last_id_number_in_df in add_point_location.py)
+    id_unique: ids are unique across all CSVs
+    range: latitude is within [-90, 90] and longitude within [-180, 180]
+    tags: every tag is one of the tags in the tagging rules file
+    proximity: points are more than ~1 km apart (a warning, as the README only
+        asks for this "to the extent possible")
+
+Example usage:
+    python validate_point_locations.py
+    python validate_point_locations.py --report validation_report.json --min_distance_m 1000
+"""
+
+import argparse
+import collections
+import glob
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from geodesy import find_close_pairs
+from tag_point_locations import load_rules
+
+id_pattern = re.compile(r"^([A-Z]{2})(\d+)$")
+# optional sign, integer part, and at most 4 decimals
+precision_pattern = re.compile(r"^-?\d+(\.\d{1,4})?$")
+coordinate_columns = ["latitude", "longitude", "ocean_lat1", "ocean_lon1"]
+chunk_size = 5000
+
+
+def get_valid_tags(rules):
+    """Collect every tag that the tagging rules can add."""
+    tags = set(rules["tags_for_all_locations"]) | {"eds"}
+    for file_tags in rules["file_tags"].values():
+        tags.update(file_tags)
+    tags.update(rule["tag"] for rule in rules["polygon_tags"])
+    return tags
+
+
+def make_issue(rule, severity, file, line, point_id, message):
+    """Make one report entry."""
+    return {
+        "rule": rule,
+        "severity": severity,
+        "file": file,
+        "line": line,
+        "id": point_id,
+        "message": message,
+    }
+
+
+def validate_chunk(chunk, file, first_line, valid_tags, seen_ids):
+    """Check the row level rules for one chunk of a CSV.
+
+    Args:
+        chunk (pd.DataFrame): Rows of the CSV read as strings
+        file (str): Name of the CSV file
+        first_line (int): Line number of the first row in the CSV file
+        valid_tags (set): Tags allowed in the tags column
+        seen_ids (dict): Maps each id seen so far to its (file, line), updated in place
+    Returns:
+        tuple: (list of issues, (n, 2) array of the in range longitudes and latitudes, list of their (file, line, id), id prefix of every row)
+    """
+    issues = []
+    lines = np.arange(first_line, first_line + len(chunk))
+    ids = chunk["id"].to_numpy()
+
+    for column in coordinate_columns:
+        if column not in chunk.columns:
+            continue
+        values = chunk[column].str.strip()
+        # the ocean neighbor columns may be empty until they are computed
+        if column.startswith("ocean"):
+            checked = values != ""
+        else:
+            checked = pd.Series(True, index=chunk.index)
+        bad = checked & ~values.str.match(precision_pattern)
+        for line, point_id, value in zip(lines[bad], ids[bad], values[bad]):
+            issues.append(
+                make_issue(
+                    "precision",
+                    "error",
+                    file,
+                    int(line),
+                    point_id,
+                    f"{column} {value!r} is not a number with at most 4 decimals",
+                )
+            )
+
+    id_match = chunk["id"].str.extract(id_pattern)
+    for line, point_id in zip(lines[id_match[0].isna()], ids[id_match[0].isna()]):
+        issues.append(
+            make_issue(
+                "id_format",
+                "error",
+                file,
+                int(line),
+                point_id,
+                "id is not a two letter prefix followed by an integer",
+            )
+        )
+    for line, point_id in zip(lines, ids):
+        if point_id in seen_ids:
+            first_file, first_seen_line = seen_ids[point_id]
+            issues.append(
+                make_issue(
+                    "id_unique",
+                    "error",
+                    file,
+                    int(line),
+                    point_id,
+                    f"id is also used on line {first_seen_line} of {first_file}",
+                )
+            )
+        else:
+            seen_ids[point_id] = (file, int(line))
+
+    lats = pd.to_numeric(chunk["latitude"], errors="coerce").to_numpy()
+    lons = pd.to_numeric(chunk["longitude"], errors="coerce").to_numpy()
+    in_range = (np.abs(lats) <= 90) & (np.abs(lons) <= 180)
+    for line, point_id, lat, lon in zip(
+        lines[~in_range], ids[~in_range], lats[~in_range], lons[~in_range]
+    ):
+        issues.append(
+            make_issue(
+                "range",
+                "error",
+                file,
+                int(line),
+                point_id,
+                f"latitude {lat} / longitude {lon} is missing or out of range",
+            )
+        )
+
+    if "tags" in chunk.columns:
+        for line, point_id, tags in zip(lines, ids, chunk["tags"]):
+            unknown = [tag for tag in tags.split(",") if tag and tag not in valid_tags]
+            if unknown:
+                issues.append(
+                    make_issue(
+                        "tags",
+                        "error",
+                        file,
+                        int(line),
+                        point_id,
+                        f"unknown tags {unknown}",
+                    )
+                )
+
+    points = [
+        (file, int(line), point_id)
+        for line, point_id in zip(lines[in_range], ids[in_range])
+    ]
+    return (
+        issues,
+        np.column_stack([lons[in_range], lats[in_range]]),
+        points,
+        id_match[0],
+    )
+
+
+def check_id_prefixes(file, prefix_lines):
+    """Check that every id in a CSV uses the CSV's most common prefix.
+
+    Args:
+        file (str): Name of the CSV file
+        prefix_lines (dict): Maps each prefix to a list of (line, id) that use it
+    Returns:
+        list: Issues for the ids that use another prefix
+    """
+    if len(prefix_lines) < 2:
+        return []
+    file_prefix = max(prefix_lines, key=lambda prefix: len(prefix_lines[prefix]))
+    return [
+        make_issue(
+            "id_format",
+            "error",
+            file,
+            line,
+            point_id,
+            f"id prefix {prefix} differs from the {file_prefix} prefix of the other ids in the file",
+        )
+        for prefix, lines in prefix_lines.items()
+        if prefix != file_prefix
+        for line, point_id in lines
+    ]
+
+
+def check_proximity(lonlat, points, min_distance_m):
+    """Find pairs of points closer than the minimum distance.
+
+    Args:
+        lonlat (np.ndarray): (n, 2) array of longitudes and latitudes
+        points (list): (file, line, id) of every point
+        min_distance_m (float): Minimum distance between points in meters
+    Returns:
+        list: Issues for every pair of points that are too close, reported on the second point of the pair
+    """
+    pairs, distances = find_close_pairs(lonlat[:, 0], lonlat[:, 1], min_distance_m)
+    issues = []
+    for (i, j), distance in zip(pairs, distances):
+        first, second = sorted([points[i], points[j]])
+        issues.append(
+            make_issue(
+                "proximity",
+                "warning",
+                second[0],
+                second[1],
+                second[2],
+                f"{distance:.0f} m from {first[2]} (line {first[1]} of {first[0]})",
+            )
+        )
+    return issues
+
+
+def validate_point_locations(rules_path="tagging_rules.json", min_distance_m=1000):
+    """Validate every point location CSV.
+
+    Args:
+        rules_path (str): Path to the tagging rules file with the valid tags
+        min_distance_m (float): Minimum distance between points in meters
+    Returns:
+        dict: The report, with a summary and the list of issues
+    """
+    valid_tags = get_valid_tags(load_rules(rules_path))
+    issues = []
+    seen_ids = {}
+    lonlats = []
+    points = []
+    rows = {}
+
+    for path in sorted(glob.iglob("../vector_data/point/*.csv")):
+        file = os.path.basename(path)
+        prefix_lines = collections.defaultdict(list)
+        # read everything as strings, so the precision is checked on the digits as written
+        reader = pd.read_csv(
+            path, dtype=str, keep_default_na=False, chunksize=chunk_size
+        )
+        # line 1 is the header
+        first_line = 2
+        for chunk in reader:
+            chunk_issues, lonlat, chunk_points, prefixes = validate_chunk(
+                chunk, file, first_line, valid_tags, seen_ids
+            )
+            issues.extend(chunk_issues)
+            lonlats.append(lonlat)
+            points.extend(chunk_points)
+            for line, point_id, prefix in zip(
+                range(first_line, first_line + len(chunk)), chunk["id"], prefixes
+            ):
+                if isinstance(prefix, str):
+                    prefix_lines[prefix].append((line, point_id))
+            first_line += len(chunk)
+        rows[file] = first_line - 2
+        issues.extend(check_id_prefixes(file, prefix_lines))
+
+    issues.extend(check_proximity(np.concatenate(lonlats), points, min_distance_m))
+    issues.sort(key=lambda issue: (issue["file"], issue["line"], issue["rule"]))
+
+    counts = collections.Counter((issue["rule"], issue["severity"]) for issue in issues)
+    return {
+        "summary": {
+            "files": len(rows),
+            "rows": sum(rows.values()),
+            "errors": sum(
+                n for (_, severity), n in counts.items() if severity == "error"
+            ),
+            "warnings": sum(
+                n for (_, severity), n in counts.items() if severity == "warning"
+            ),
+            "issues_per_rule": {rule: n for (rule, _), n in sorted(counts.items())},
+            "rows_per_file": rows,
+        },
+        "issues": issues,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--report",
+        type=str,
+        default="validation_report.json",
+        help="Path of the JSON report. Default is validation_report.json.",
+    )
+    parser.add_argument(
+        "--rules",
+        type=str,
+        default="tagging_rules.json",
+        help="Tagging rules file with the valid tags. Default is tagging_rules.json.",
+    )
+    parser.add_argument(
+        "--min_distance_m",
+        type=float,
+        default=1000,
+        help="Minimum distance between points in meters. Default is 1000.",
+    )
+    args = parser.parse_args()
+
+    report = validate_point_locations(args.rules, args.min_distance_m)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    summary = report["summary"]
+    print(
+        f"Validated {summary['rows']} rows in {summary['files']} files: "
+        f"{summary['errors']} errors, {summary['warnings']} warnings"
+    )
+    for rule, n in summary["issues_per_rule"].items():
+        print(f"  {rule}: {n}")
+    print(f"Report written to {args.report}")
+    if summary["errors"]:
+        raise SystemExit(1)
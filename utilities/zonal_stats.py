@@ -0,0 +1,302 @@
+"""
+Compute zonal statistics of a raster for every polygon of a layer, using the
+polygons as "data cookie cutters". For every polygon and band the count, mean,
+min, max, and percentiles of the valid (not nodata) grid cells whose centers
+fall within the polygon are written to a tidy CSV with one row per (id, band).
+
+Each polygon is rasterized once onto the raster grid, only over the window of
+its bounds, and that mask is reused for every band, which are all read from
+the same window at once. Polygons smaller than a grid cell that don't contain
+any cell center use every cell they touch instead. The polygons are sorted
+along a Hilbert curve and split into chunks that are processed across a
+process pool, so each worker reads nearby windows that share raster blocks.
+
+The polygons can be any shapefile (e.g. under vector_data/polygon/boundaries)
+or the name of a layer in the `area_layers` registry of create_shapefiles.py.
+
+Example usage:
+    python zonal_stats.py huc12s tas_2050.tif
+    python zonal_stats.py ../vector_data/polygon/boundaries/boroughs/ak_boroughs.shp tas_2050.tif --bands 1 2 --percentiles 5 50 95
+"""
+
+import argparse
+import functools
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from rasterio.features import geometry_mask
+
+from create_shapefiles import area_layers
+from parallel import default_workers, run_in_process_pool
+
+
+def resolve_layer_path(layer):
+    """Get the shapefile path of a layer name from `area_layers`, or return the path as is."""
+    for area_layer in area_layers:
+        if area_layer["name"] == layer:
+            return area_layer["path"]
+    return layer
+
+
+def load_polygons(polygons_path, crs, id_column="id"):
+    """Read the polygons, reprojected to the raster's CRS and sorted along a Hilbert curve.
+
+    Args:
+        polygons_path (str): Path to the polygon layer
+        crs (rio.crs.CRS): CRS of the raster
+        id_column (str): Column with the id of each polygon
+    Returns:
+        gpd.GeoDataFrame: The id column and geometries, sorted so nearby polygons are next to each other
+    """
+    gdf = gpd.read_file(polygons_path, columns=[id_column])
+    # reprojecting the polygons is much cheaper than resampling the raster, and keeps the grid cell values as they are
+    if gdf.crs != crs:
+        gdf = gdf.to_crs(crs)
+    gdf = gdf[~(gdf.geometry.is_empty | gdf.geometry.isna())]
+    return gdf.iloc[np.argsort(gdf.hilbert_distance(), kind="stable")]
+
+
+def polygon_window(transform, shape, bounds):
+    """Get the window of whole grid cells covering the bounds, clipped to the raster.
+
+    Args:
+        transform (Affine): Transform of the raster
+        shape (tuple): (height, width) of the raster
+        bounds (tuple): (minx, miny, maxx, maxy) in the raster's CRS
+    Returns:
+        rio.windows.Window: The window, or None if the bounds are outside of the raster
+    """
+    window = rio.windows.from_bounds(*bounds, transform=transform)
+    # round outwards, so every grid cell the polygon touches is in the window
+    col_off, row_off = np.floor(window.col_off), np.floor(window.row_off)
+    window = rio.windows.Window(
+        col_off,
+        row_off,
+        np.ceil(window.col_off + window.width) - col_off,
+        np.ceil(window.row_off + window.height) - row_off,
+    )
+    try:
+        return window.intersection(rio.windows.Window(0, 0, shape[1], shape[0]))
+    except rio.errors.WindowError:
+        return None
+
+
+def rasterize_polygon(geometry, window_transform, shape):
+    """Rasterize one polygon onto the grid of its window.
+
+    Args:
+        geometry (shapely.Geometry): Polygon in the raster's CRS
+        window_transform (Affine): Transform of the window
+        shape (tuple): (height, width) of the window
+    Returns:
+        np.ndarray: Boolean array, True for the grid cells within the polygon
+    """
+    inside = ~geometry_mask(
+        [geometry], out_shape=shape, transform=window_transform, all_touched=False
+    )
+    if not inside.any():
+        # the polygon is smaller than a grid cell and doesn't contain any cell center
+        inside = ~geometry_mask(
+            [geometry], out_shape=shape, transform=window_transform, all_touched=True
+        )
+    return inside
+
+
+def summarize(values, percentiles):
+    """Compute the statistics of the grid cell values of one polygon and band.
+
+    Args:
+        values (np.ndarray): Valid grid cell values
+        percentiles (list): Percentiles to compute, from 0 to 100
+    Returns:
+        dict: count, mean, min, max, and p<percentile> of the values, NaN if there are none
+    """
+    stats = {"count": len(values)}
+    if len(values):
+        stats.update(
+            mean=float(values.mean()), min=float(values.min()), max=float(values.max())
+        )
+        stats.update(
+            (f"p{percentile:g}", float(value))
+            for percentile, value in zip(
+                percentiles, np.percentile(values, percentiles)
+            )
+        )
+    else:
+        stats.update(mean=np.nan, min=np.nan, max=np.nan)
+        stats.update((f"p{percentile:g}", np.nan) for percentile in percentiles)
+    return stats
+
+
+def zonal_stats_chunk(chunk, raster_path, bands, percentiles):
+    """Compute the statistics of a chunk of polygons.
+
+    Args:
+        chunk (list): (id, geometry) of each polygon, in the raster's CRS
+        raster_path (str): Path to the raster
+        bands (list): Numbers of the bands to summarize
+        percentiles (list): Percentiles to compute, from 0 to 100
+    Returns:
+        list: One dict per (id, band) with the id, band, and statistics
+    """
+    rows = []
+    # every worker opens its own dataset, rasterio datasets can't be shared between processes
+    with rio.open(raster_path) as src:
+        for polygon_id, geometry in chunk:
+            window = polygon_window(src.transform, src.shape, geometry.bounds)
+            if window is None:
+                inside = None
+            else:
+                inside = rasterize_polygon(
+                    geometry,
+                    src.window_transform(window),
+                    (int(window.height), int(window.width)),
+                )
+                data = src.read(bands, window=window, masked=True)
+            for band_index, band in enumerate(bands):
+                if inside is None:
+                    values = np.empty(0)
+                else:
+                    band_data = data[band_index]
+                    values = band_data.data[inside & ~np.ma.getmaskarray(band_data)]
+                    if values.dtype.kind == "f":
+                        values = values[~np.isnan(values)]
+                rows.append(
+                    {"id": polygon_id, "band": band, **summarize(values, percentiles)}
+                )
+    return rows
+
+
+def zonal_stats(
+    polygons_path,
+    raster_path,
+    bands=None,
+    percentiles=(10, 50, 90),
+    id_column="id",
+    workers=None,
+    chunk_size=None,
+):
+    """Compute zonal statistics of a raster for every polygon of a layer.
+
+    Args:
+        polygons_path (str): Path to the polygon layer, or a layer name from `area_layers`
+        raster_path (str): Path to the raster
+        bands (list): Numbers of the bands to summarize, defaults to every band
+        percentiles (list): Percentiles to compute, from 0 to 100
+        id_column (str): Column with the id of each polygon
+        workers (int): Number of worker processes, defaults to one per available core
+        chunk_size (int): Number of polygons per task, defaults to spreading the polygons over four tasks per worker
+    Returns:
+        pd.DataFrame: One row per (id, band) with the count, mean, min, max, and percentiles, in the order of the layer
+    """
+    with rio.open(raster_path) as src:
+        crs = src.crs
+        if bands is None:
+            bands = list(src.indexes)
+    polygons = load_polygons(resolve_layer_path(polygons_path), crs, id_column)
+    if workers is None:
+        workers = default_workers()
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(polygons) // (workers * 4)))
+
+    items = list(zip(polygons[id_column], polygons.geometry))
+    chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+    results = run_in_process_pool(
+        functools.partial(
+            zonal_stats_chunk,
+            raster_path=raster_path,
+            bands=list(bands),
+            percentiles=list(percentiles),
+        ),
+        chunks,
+        workers=workers,
+        labels=[f"chunk {n + 1} of {len(chunks)}" for n in range(len(chunks))],
+        skip_empty_logs=True,
+    )
+    stats = pd.DataFrame([row for rows in results for row in rows])
+    # back to the order of the layer, each polygon has one row per band
+    polygon_rows = np.argsort(polygons.index.to_numpy(), kind="stable")
+    rows = (polygon_rows[:, None] * len(bands) + np.arange(len(bands))).ravel()
+    return stats.iloc[rows].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "polygons",
+        type=str,
+        help="Polygon layer, a path or the name of a layer in area_layers of create_shapefiles.py",
+    )
+    parser.add_argument("raster", type=str, help="Path to the raster")
+    parser.add_argument(
+        "--bands",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Bands to summarize. Default is every band.",
+    )
+    parser.add_argument(
+        "--percentiles",
+        type=float,
+        nargs="+",
+        default=[10, 50, 90],
+        help="Percentiles to compute. Default is 10 50 90.",
+    )
+    parser.add_argument(
+        "--id_column",
+        type=str,
+        default="id",
+        help="Column with the id of each polygon. Default is id.",
+    )
+    parser.add_argument(
+        "--label_grid",
+        action="store_true",
+        help="Summarize over the layer's cached label grid for the raster's grid (see label_grids.py) instead of rasterizing every polygon.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes. Default is one per core.",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="Path of the output CSV. Default is <layer>_<raster>_zonal_stats.csv.",
+    )
+    args = parser.parse_args()
+
+    output = args.output or (
+        f"{os.path.splitext(os.path.basename(resolve_layer_path(args.polygons)))[0]}_"
+        f"{os.path.splitext(os.path.basename(args.raster))[0]}_zonal_stats.csv"
+    )
+    if args.label_grid:
+        # label_grids builds on this module, so it's only imported when it's used
+        from label_grids import label_grid_zonal_stats
+
+        stats = label_grid_zonal_stats(
+            args.polygons,
+            args.raster,
+            bands=args.bands,
+            percentiles=args.percentiles,
+            id_column=args.id_column,
+        )
+    else:
+        stats = zonal_stats(
+            args.polygons,
+            args.raster,
+            bands=args.bands,
+            percentiles=args.percentiles,
+            id_column=args.id_column,
+            workers=args.workers,
+        )
+    stats.to_csv(output, index=False)
+    print(
+        f"Wrote statistics of {stats['id'].nunique()} polygons and {stats['band'].nunique()} bands to {output}"
+    )